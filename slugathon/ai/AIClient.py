@@ -7,6 +7,7 @@ __license__ = "GNU GPL v2"
 
 
 import argparse
+from collections import Counter
 import random
 import tempfile
 import os
@@ -22,7 +23,7 @@ from twisted.spread.pb import PBConnectionLost, DeadReferenceError
 from twisted.python import log
 from zope.interface import implementer
 
-from slugathon.net import config, Results
+from slugathon.net import config, Results, User
 from slugathon.util.Observer import IObserver
 from slugathon.util.Observed import Observed
 from slugathon.game import Action, Game, Phase, Creature
@@ -41,7 +42,7 @@ class AIClient(pb.Referenceable, Observed):
 
     def __init__(self, playername, password, host, port, delay, game_name,
                  log_path, ai_time_limit, player_time_limit, form_game,
-                 min_players, max_players):
+                 min_players, max_players, workers=0, bot_params=None):
         Observed.__init__(self)
         self.playername = playername
         self.password = password
@@ -56,20 +57,23 @@ class AIClient(pb.Referenceable, Observed):
         self.log_path = log_path
         self._setup_logging()
 
-        bp = None
-        # Using Results means we need to be on the server.
-        results = Results.Results()
-        if not re.match(r"^ai\d+$", playername):
-            raise AssertionError("invalid playername for AI")
-        player_id = int(playername[2:])
-        player_info = results.get_player_info(player_id)
-        if player_info is None:
-            player_id = results.get_weighted_random_player_id()
-            playername = "ai%d" % player_id
+        bp = bot_params
+        if bp is None:
+            # Using Results means we need to be on the server.
+            results = Results.Results()
+            if not re.match(r"^ai\d+$", playername):
+                raise AssertionError("invalid playername for AI")
+            player_id = int(playername[2:])
             player_info = results.get_player_info(player_id)
-        bp = BotParams.BotParams.fromstring(player_info)
+            if player_info is None:
+                player_id = results.get_weighted_random_player_id()
+                playername = "ai%d" % player_id
+                player_info = results.get_player_info(player_id)
+            bp = BotParams.BotParams.fromstring(player_info)
         self.ai = CleverBot.CleverBot(self.playername, ai_time_limit,
-                                      bot_params=bp)
+                                      bot_params=bp, workers=workers)
+        # Schedules the AI's moves; replaced to run games off the reactor.
+        self.clock = reactor
         self.game_name = game_name
         self.ai_time_limit = ai_time_limit
         self.player_time_limit = player_time_limit
@@ -79,6 +83,8 @@ class AIClient(pb.Referenceable, Observed):
         self.paused = False
         self.last_actions = []
         self.aps = predictsplits.AllPredictSplits()
+        # "full" and "partial" calls to update_creatures
+        self.sync_counts = Counter()
 
     def _setup_logging(self):
         if self.log_path:
@@ -194,12 +200,13 @@ class AIClient(pb.Referenceable, Observed):
         owner = playernames[0]
         game = Game.Game(name, owner, create_time, start_time, min_players,
                          max_players, started=started, finish_time=finish_time)
+        game.clock = self.clock
         self.add_observer(game)
         for playername in playernames[1:]:
             game.add_player(playername)
         self.games.append(game)
-        if not game.finish_time and (not self.game_name or
-                                     game.name == self.game_name):
+        if (not game.finish_time and self.playername not in playernames and
+                (not self.game_name or game.name == self.game_name)):
             def1 = self.user.callRemote("join_game", game.name, self.aiclass,
                                         self.ai.player_info)
             def1.addErrback(self.failure)
@@ -210,15 +217,35 @@ class AIClient(pb.Referenceable, Observed):
             self.remove_observer(game)
             self.games.remove(game)
 
-    def update_creatures(self, game):
-        """Update creatures in game from self.aps."""
-        for legion in game.all_legions():
+    def update_creatures(self, game, markerids=None):
+        """Update creatures in game from self.aps.
+
+        If markerids is given, only update those legions and their
+        relatives, since revealing creatures in one legion can change the
+        predicted contents of the others split from the same one.
+        Otherwise update every legion.
+        """
+        if markerids is None:
+            self.sync_counts["full"] += 1
+            legions = game.all_legions()
+            get_leaf = self.aps.get_leaf
+        else:
+            self.sync_counts["partial"] += 1
+            leaves = {}
+            for markerid in markerids:
+                for leaf in self.aps.get_relatives(markerid):
+                    leaves.setdefault(leaf.markerid, leaf)
+            legions = [legion for legion in game.all_legions()
+                       if legion.markerid in leaves]
+            get_leaf = leaves.get
+        for legion in legions:
             markerid = legion.markerid
-            node = self.aps.get_leaf(markerid)
+            node = get_leaf(markerid)
             if node and node.creature_names != legion.creature_names:
                 legion.creatures = Creature.n2c(node.creature_names)
                 for creature in legion.creatures:
                     creature.legion = legion
+                legion.creatures_changed()
 
     def failure(self, error):
         log.err(error)
@@ -234,9 +261,14 @@ class AIClient(pb.Referenceable, Observed):
         observed = None
         self.update(observed, action, names)
 
+    def remote_update_batch(self, updates):
+        """Handle an update_batch from User.send_updates."""
+        User.apply_updates(self.remote_update, updates)
+
     def exit_unconditionally(self, returncode):
         """Just exit the process, with no tracebacks or other drama."""
         logging.info("")
+        self.ai.shutdown()
         if reactor.running:
             try:
                 reactor.stop()
@@ -271,7 +303,7 @@ class AIClient(pb.Referenceable, Observed):
             node = self.aps.get_leaf(action.donor_markerid)
             if node:
                 node.reveal_creatures([action.creature_name])
-            self.update_creatures(game)
+            self.update_creatures(game, [action.donor_markerid])
 
         # Update the Game first, then act.
         self.notify(action, names)
@@ -297,18 +329,18 @@ class AIClient(pb.Referenceable, Observed):
             logging.info("AssignedAllTowers player_info %s",
                          self.ai.player_info)
             game = self.name_to_game(action.game_name)
-            reactor.callLater(self.delay, self.ai.maybe_pick_color, game)
+            self.clock.callLater(self.delay, self.ai.maybe_pick_color, game)
 
         elif isinstance(action, Action.PickedColor):
             game = self.name_to_game(action.game_name)
             self.ai.maybe_pick_color(game)
-            reactor.callLater(self.delay, self.ai.maybe_pick_first_marker,
-                              game, action.playername)
+            self.clock.callLater(self.delay, self.ai.maybe_pick_first_marker,
+                                 game, action.playername)
 
         elif isinstance(action, Action.AssignedAllColors):
             game = self.name_to_game(action.game_name)
             if game.active_player.name == self.playername:
-                reactor.callLater(self.delay, self.ai.split, game)
+                self.clock.callLater(self.delay, self.ai.split, game)
 
         elif isinstance(action, Action.GameOver):
             if action.winner_names:
@@ -317,13 +349,16 @@ class AIClient(pb.Referenceable, Observed):
                               " and ".join(action.winner_names)))
             else:
                 logging.info("Game %s over, draw" % action.game_name)
+            logging.info("update_creatures calls: %d full, %d partial",
+                         self.sync_counts["full"],
+                         self.sync_counts["partial"])
             logging.info("AI exiting")
             self.exit_unconditionally(0)
 
         elif isinstance(action, Action.StartSplitPhase):
             game = self.name_to_game(action.game_name)
             if game.active_player.name == self.playername:
-                reactor.callLater(self.delay, self.ai.split, game)
+                self.clock.callLater(self.delay, self.ai.split, game)
 
         elif isinstance(action, Action.CreateStartingLegion):
             game = self.name_to_game(action.game_name)
@@ -335,7 +370,7 @@ class AIClient(pb.Referenceable, Observed):
                                              starting_creature_names)
             self.aps.append(ps)
             if action.playername == self.playername:
-                reactor.callLater(self.delay, self.ai.split, game)
+                self.clock.callLater(self.delay, self.ai.split, game)
 
         elif isinstance(action, Action.SplitLegion):
             game = self.name_to_game(action.game_name)
@@ -347,9 +382,10 @@ class AIClient(pb.Referenceable, Observed):
                     list(action.parent_creature_names))
                 self.aps.get_leaf(action.child_markerid).reveal_creatures(
                     list(action.child_creature_names))
-            self.update_creatures(game)
+            self.update_creatures(game, [action.parent_markerid,
+                                         action.child_markerid])
             if action.playername == self.playername:
-                reactor.callLater(self.delay, self.ai.split, game)
+                self.clock.callLater(self.delay, self.ai.split, game)
 
         elif isinstance(action, Action.UndoSplit):
             game = self.name_to_game(action.game_name)
@@ -358,43 +394,46 @@ class AIClient(pb.Referenceable, Observed):
                 (action.parent_markerid, action.child_markerid, game.turn))
             self.aps.get_leaf(action.parent_markerid).merge(
                 self.aps.get_leaf(action.child_markerid), game.turn)
-            self.update_creatures(game)
+            self.update_creatures(game, [action.parent_markerid,
+                                         action.child_markerid])
 
         elif isinstance(action, Action.RollMovement):
             game = self.name_to_game(action.game_name)
             if action.playername == self.playername:
-                reactor.callLater(self.delay, self.ai.move_legions, game)
+                self.clock.callLater(self.delay, self.ai.move_legions, game)
 
         elif isinstance(action, Action.MoveLegion):
             game = self.name_to_game(action.game_name)
             if action.playername == self.playername:
-                reactor.callLater(self.delay, self.ai.move_legions, game)
+                self.clock.callLater(self.delay, self.ai.move_legions, game)
 
         elif isinstance(action, Action.StartFightPhase):
             if action.playername == self.playername:
                 game = self.name_to_game(action.game_name)
-                reactor.callLater(self.delay, self.ai.choose_engagement, game)
+                self.clock.callLater(self.delay, self.ai.choose_engagement,
+                                     game)
 
         elif isinstance(action, Action.StartMusterPhase):
             if action.playername == self.playername:
                 game = self.name_to_game(action.game_name)
-                reactor.callLater(self.delay, self.ai.recruit, game)
+                self.clock.callLater(self.delay, self.ai.recruit, game)
 
         elif isinstance(action, Action.ResolvingEngagement):
             game = self.name_to_game(action.game_name)
-            reactor.callLater(self.delay, self.ai.resolve_engagement, game,
-                              action.hexlabel)
+            self.clock.callLater(self.delay, self.ai.resolve_engagement, game,
+                                 action.hexlabel)
 
         elif (isinstance(action, Action.Flee) or
               isinstance(action, Action.Concede)):
             game = self.name_to_game(action.game_name)
             if game.active_player.name == self.playername:
-                reactor.callLater(self.delay, self.ai.choose_engagement, game)
+                self.clock.callLater(self.delay, self.ai.choose_engagement,
+                                     game)
 
         elif isinstance(action, Action.DoNotFlee):
             game = self.name_to_game(action.game_name)
-            reactor.callLater(self.delay, self.ai.resolve_engagement, game,
-                              action.hexlabel)
+            self.clock.callLater(self.delay, self.ai.resolve_engagement, game,
+                                 action.hexlabel)
 
         elif isinstance(action, Action.Fight):
             game = self.name_to_game(action.game_name)
@@ -402,14 +441,15 @@ class AIClient(pb.Referenceable, Observed):
             if (game.defender_legion and game.defender_legion.player.name ==
                     self.playername and action.defender_markerid in
                     player.markerid_to_legion):
-                reactor.callLater(self.delay, self.ai.move_creatures, game)
+                self.clock.callLater(self.delay, self.ai.move_creatures, game)
 
         elif isinstance(action, Action.MoveCreature):
             game = self.name_to_game(action.game_name)
             legion = game.battle_active_legion
             if legion:
                 if legion.player.name == self.playername:
-                    reactor.callLater(self.delay, self.ai.move_creatures, game)
+                    self.clock.callLater(self.delay, self.ai.move_creatures,
+                                         game)
             else:
                 logging.info("game.battle_active_legion not found")
 
@@ -418,7 +458,7 @@ class AIClient(pb.Referenceable, Observed):
             legion = game.battle_active_legion
             if legion:
                 if legion.player.name == self.playername:
-                    reactor.callLater(self.delay, self.ai.strike, game)
+                    self.clock.callLater(self.delay, self.ai.strike, game)
             else:
                 logging.info("game.battle_active_legion not found")
 
@@ -428,18 +468,18 @@ class AIClient(pb.Referenceable, Observed):
             if legion:
                 if legion.player.name == self.playername:
                     if action.carries:
-                        reactor.callLater(self.delay,
-                                          self.ai.carry,
-                                          game,
-                                          action.striker_name,
-                                          action.striker_hexlabel,
-                                          action.target_name,
-                                          action.target_hexlabel,
-                                          action.num_dice,
-                                          action.strike_number,
-                                          action.carries)
+                        self.clock.callLater(self.delay,
+                                             self.ai.carry,
+                                             game,
+                                             action.striker_name,
+                                             action.striker_hexlabel,
+                                             action.target_name,
+                                             action.target_hexlabel,
+                                             action.num_dice,
+                                             action.strike_number,
+                                             action.carries)
                     else:
-                        reactor.callLater(self.delay, self.ai.strike, game)
+                        self.clock.callLater(self.delay, self.ai.strike, game)
             else:
                 logging.info("game.battle_active_legion not found")
 
@@ -449,18 +489,18 @@ class AIClient(pb.Referenceable, Observed):
             if legion:
                 if legion.player.name == self.playername:
                     if action.carries_left:
-                        reactor.callLater(self.delay,
-                                          self.ai.carry,
-                                          game,
-                                          action.striker_name,
-                                          action.striker_hexlabel,
-                                          action.target_name,
-                                          action.target_hexlabel,
-                                          action.num_dice,
-                                          action.strike_number,
-                                          action.carries_left)
+                        self.clock.callLater(self.delay,
+                                             self.ai.carry,
+                                             game,
+                                             action.striker_name,
+                                             action.striker_hexlabel,
+                                             action.target_name,
+                                             action.target_hexlabel,
+                                             action.num_dice,
+                                             action.strike_number,
+                                             action.carries_left)
                     else:
-                        reactor.callLater(self.delay, self.ai.strike, game)
+                        self.clock.callLater(self.delay, self.ai.strike, game)
             else:
                 logging.info("game.battle_active_legion not found")
 
@@ -469,7 +509,7 @@ class AIClient(pb.Referenceable, Observed):
             legion = game.battle_active_legion
             if legion:
                 if legion.player.name == self.playername:
-                    reactor.callLater(self.delay, self.ai.strike, game)
+                    self.clock.callLater(self.delay, self.ai.strike, game)
             else:
                 logging.info("game.battle_active_legion not found")
 
@@ -479,10 +519,11 @@ class AIClient(pb.Referenceable, Observed):
             if legion:
                 if legion.player.name == self.playername:
                     if legion == game.defender_legion:
-                        reactor.callLater(self.delay, self.ai.reinforce, game)
+                        self.clock.callLater(self.delay, self.ai.reinforce,
+                                             game)
                     else:
-                        reactor.callLater(self.delay, self.ai.summon_angel,
-                                          game)
+                        self.clock.callLater(self.delay, self.ai.summon_angel,
+                                             game)
             else:
                 logging.info("game.battle_active_legion not found")
 
@@ -491,7 +532,8 @@ class AIClient(pb.Referenceable, Observed):
             legion = game.battle_active_legion
             if legion:
                 if legion.player.name == self.playername:
-                    reactor.callLater(self.delay, self.ai.move_creatures, game)
+                    self.clock.callLater(self.delay, self.ai.move_creatures,
+                                         game)
             else:
                 logging.info("game.battle_active_legion not found")
 
@@ -501,46 +543,48 @@ class AIClient(pb.Referenceable, Observed):
                 list(action.recruiter_names))
             self.aps.get_leaf(action.markerid).add_creature(
                 action.creature_name)
-            self.update_creatures(game)
+            self.update_creatures(game, [action.markerid])
             if action.playername == self.playername:
                 if game.phase is Phase.PhaseMaster.MUSTER:
                     if game.active_player.name == self.playername:
-                        reactor.callLater(self.delay, self.ai.recruit, game)
+                        self.clock.callLater(self.delay, self.ai.recruit, game)
                 elif game.phase is Phase.PhaseMaster.FIGHT:
                     if game.battle_phase is Phase.PhaseBattle.REINFORCE:
-                        reactor.callLater(self.delay, self.ai.reinforce, game)
+                        self.clock.callLater(self.delay, self.ai.reinforce,
+                                             game)
                     else:
-                        reactor.callLater(self.delay,
-                                          self.ai.choose_engagement, game)
+                        self.clock.callLater(self.delay,
+                                             self.ai.choose_engagement, game)
             else:
                 if (game.phase is Phase.PhaseMaster.FIGHT and
                         game.battle_phase is not Phase.PhaseBattle.REINFORCE and
                         game.active_player.name == self.playername):
-                    reactor.callLater(self.delay, self.ai.choose_engagement,
-                                      game)
+                    self.clock.callLater(self.delay, self.ai.choose_engagement,
+                                         game)
 
         elif isinstance(action, Action.UndoRecruit):
             game = self.name_to_game(action.game_name)
             self.aps.get_leaf(action.markerid).remove_creature(
                 action.creature_name)
-            self.update_creatures(game)
+            self.update_creatures(game, [action.markerid])
 
         elif isinstance(action, Action.UnReinforce):
             game = self.name_to_game(action.game_name)
             self.aps.get_leaf(action.markerid).remove_creature(
                 action.creature_name)
-            self.update_creatures(game)
+            self.update_creatures(game, [action.markerid])
 
         elif isinstance(action, Action.DoNotReinforce):
             game = self.name_to_game(action.game_name)
             if action.playername == self.playername:
                 assert game.phase is Phase.PhaseMaster.FIGHT
-                reactor.callLater(self.delay, self.ai.choose_engagement, game)
+                self.clock.callLater(self.delay, self.ai.choose_engagement,
+                                     game)
             else:
                 if (game.phase is Phase.PhaseMaster.FIGHT and
                         game.active_player.name == self.playername):
-                    reactor.callLater(self.delay, self.ai.choose_engagement,
-                                      game)
+                    self.clock.callLater(self.delay, self.ai.choose_engagement,
+                                         game)
 
         elif isinstance(action, Action.SummonAngel):
             game = self.name_to_game(action.game_name)
@@ -551,13 +595,15 @@ class AIClient(pb.Referenceable, Observed):
             recipient = self.aps.get_leaf(action.markerid)
             if recipient:
                 recipient.add_creature(action.creature_name)
-            self.update_creatures(game)
+            self.update_creatures(game, [action.donor_markerid,
+                                         action.markerid])
             if action.playername == self.playername:
                 if game.battle_phase is Phase.PhaseBattle.REINFORCE:
-                    reactor.callLater(self.delay, self.ai.summon_angel, game)
+                    self.clock.callLater(self.delay, self.ai.summon_angel,
+                                         game)
                 else:
-                    reactor.callLater(self.delay, self.ai.choose_engagement,
-                                      game)
+                    self.clock.callLater(self.delay, self.ai.choose_engagement,
+                                         game)
 
         elif isinstance(action, Action.UnsummonAngel):
             game = self.name_to_game(action.game_name)
@@ -567,22 +613,25 @@ class AIClient(pb.Referenceable, Observed):
                 action.creature_name)
             self.aps.get_leaf(action.donor_markerid).add_creature(
                 action.creature_name)
-            self.update_creatures(game)
+            self.update_creatures(game, [action.markerid,
+                                         action.donor_markerid])
             if action.playername == self.playername:
                 if game.battle_phase is Phase.PhaseBattle.REINFORCE:
-                    reactor.callLater(self.delay, self.ai.summon_angel, game)
+                    self.clock.callLater(self.delay, self.ai.summon_angel,
+                                         game)
                 else:
-                    reactor.callLater(self.delay, self.ai.choose_engagement,
-                                      game)
+                    self.clock.callLater(self.delay, self.ai.choose_engagement,
+                                         game)
 
         elif isinstance(action, Action.DoNotSummonAngel):
             game = self.name_to_game(action.game_name)
             if action.playername == self.playername:
                 if game.battle_phase is Phase.PhaseBattle.REINFORCE:
-                    reactor.callLater(self.delay, self.ai.summon_angel, game)
+                    self.clock.callLater(self.delay, self.ai.summon_angel,
+                                         game)
                 else:
-                    reactor.callLater(self.delay, self.ai.choose_engagement,
-                                      game)
+                    self.clock.callLater(self.delay, self.ai.choose_engagement,
+                                         game)
 
         elif isinstance(action, Action.BattleOver):
             game = self.name_to_game(action.game_name)
@@ -594,14 +643,15 @@ class AIClient(pb.Referenceable, Observed):
                 node = self.aps.get_leaf(action.loser_markerid)
                 if node:
                     node.remove_creatures(list(action.loser_losses))
-            self.update_creatures(game)
+            self.update_creatures(game, [action.winner_markerid,
+                                         action.loser_markerid])
             if game.active_player.name == self.playername:
                 if game.attacker_legion:
                     legion = game.attacker_legion
                     if (legion.markerid == action.winner_markerid and
                             legion.can_summon):
-                        reactor.callLater(self.delay, self.ai.summon_angel,
-                                          game)
+                        self.clock.callLater(self.delay, self.ai.summon_angel,
+                                             game)
                         return
             else:
                 if game.defender_legion:
@@ -609,32 +659,35 @@ class AIClient(pb.Referenceable, Observed):
                     if legion.player.name == self.playername:
                         if (legion.markerid == action.winner_markerid and
                                 legion.can_recruit):
-                            reactor.callLater(self.delay, self.ai.reinforce,
-                                              game)
+                            self.clock.callLater(self.delay, self.ai.reinforce,
+                                                 game)
                             return
             if game.active_player.name == self.playername:
-                reactor.callLater(self.delay, self.ai.choose_engagement, game)
+                self.clock.callLater(self.delay, self.ai.choose_engagement,
+                                     game)
 
         elif isinstance(action, Action.CanAcquireAngels):
             game = self.name_to_game(action.game_name)
             if action.playername == self.playername:
-                reactor.callLater(self.delay, self.ai.acquire_angels, game,
-                                  action.markerid, action.angels,
-                                  action.archangels)
+                self.clock.callLater(self.delay, self.ai.acquire_angels, game,
+                                     action.markerid, action.angels,
+                                     action.archangels)
 
         elif isinstance(action, Action.AcquireAngels):
             game = self.name_to_game(action.game_name)
             for angel_name in action.angel_names:
                 self.aps.get_leaf(action.markerid).add_creature(angel_name)
-            self.update_creatures(game)
+            self.update_creatures(game, [action.markerid])
             logging.info("active player %s", game.active_player)
             if game.active_player.name == self.playername:
-                reactor.callLater(self.delay, self.ai.choose_engagement, game)
+                self.clock.callLater(self.delay, self.ai.choose_engagement,
+                                     game)
 
         elif isinstance(action, Action.DoNotAcquireAngels):
             game = self.name_to_game(action.game_name)
             if game.active_player.name == self.playername:
-                reactor.callLater(self.delay, self.ai.choose_engagement, game)
+                self.clock.callLater(self.delay, self.ai.choose_engagement,
+                                     game)
 
         elif (isinstance(action, Action.EliminatePlayer) or
               isinstance(action, Action.Withdraw)):
@@ -665,7 +718,7 @@ class AIClient(pb.Referenceable, Observed):
                 node = self.aps.get_leaf(action.markerid)
                 if node is not None:
                     node.reveal_creatures(action.creature_names)
-                self.update_creatures(game)
+                self.update_creatures(game, [action.markerid])
 
         elif isinstance(action, Action.PauseAI):
             self.paused = True
@@ -695,6 +748,8 @@ def add_arguments(parser):
     parser.add_argument("--form-game", action="store_true", default=False)
     parser.add_argument("--min-players", type=int, default=2)
     parser.add_argument("--max-players", type=int, default=6)
+    # Processes to score battle moves in; 0 or 1 to score them in this one
+    parser.add_argument("--workers", type=int, default=0)
 
 
 def main():
@@ -712,7 +767,8 @@ def main():
                         args.player_time_limit,
                         args.form_game,
                         args.min_players,
-                        args.max_players)
+                        args.max_players,
+                        args.workers)
     reactor.callWhenRunning(aiclient.connect)
     reactor.run()
 
@@ -0,0 +1,367 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+"""Monte Carlo simulation of quick battles, for the AI's engagement
+decisions."""
+
+
+from bisect import bisect_right
+from sys import maxsize
+import random
+import time
+
+from slugathon.ai import StrikeMatrix
+from slugathon.game import BattleMap, Creature
+
+
+# The attacker loses if the defender survives this many battle turns.
+MAX_BATTLE_TURNS = 7
+
+
+class _Strike(object):
+
+    """Precomputed odds of one creature striking another from one site."""
+
+    __slots__ = ("at_least", "cumulative", "mean_hits")
+
+    def __init__(self, num_dice, strike_number):
+        # at_least[k] is the chance of at least k hits.
+        self.at_least = StrikeMatrix.hit_probabilities(num_dice,
+                                                       strike_number)
+        # cumulative[k] is the chance of at most k hits, so bisecting it
+        # with a uniform random number rolls the number of hits.
+        self.cumulative = [1. - self.at_least[hits]
+                           for hits in range(1, num_dice + 1)]
+        self.mean_hits = num_dice * (7. - min(max(strike_number, 1), 7)) / 6
+
+
+class _DetachedLegion(object):
+
+    """Stands in for the legion, player, and game of copied creatures.
+
+    Creature finds Titan power through legion.player and the battle map
+    through legion.player.game, so this is all three, with just those
+    attributes.  Moving or wounding the copies never reaches the real
+    game's battle index or Zobrist hash.
+    """
+
+    zobrist_features = None
+
+    def __init__(self, titan_power, battlemap):
+        self.player = self
+        self.game = self
+        self.titan_power = titan_power
+        self.battlemap = battlemap
+
+    def is_battle_legion(self, legion):
+        return False
+
+
+class SimulationResult(object):
+
+    """Totals over a number of simulated battles."""
+
+    def __init__(self):
+        self.battles = 0
+        self.attacker_wins = 0
+        self.defender_wins = 0
+        # Both legions eliminated
+        self.draws = 0
+        # Points of surviving creatures, summed over all battles
+        self.attacker_points = 0
+        self.defender_points = 0
+
+    def __repr__(self):
+        return ("SimulationResult battles %d attacker %.3f defender %.3f "
+                "points %.1f %.1f" % (self.battles,
+                                      self.attacker_win_probability,
+                                      self.defender_win_probability,
+                                      self.expected_attacker_points,
+                                      self.expected_defender_points))
+
+    @property
+    def attacker_win_probability(self):
+        if not self.battles:
+            return 0.
+        return self.attacker_wins / self.battles
+
+    @property
+    def defender_win_probability(self):
+        if not self.battles:
+            return 0.
+        return self.defender_wins / self.battles
+
+    @property
+    def expected_attacker_points(self):
+        """Return the mean point value of the attacker's survivors."""
+        if not self.battles:
+            return 0.
+        return self.attacker_points / self.battles
+
+    @property
+    def expected_defender_points(self):
+        """Return the mean point value of the defender's survivors."""
+        if not self.battles:
+            return 0.
+        return self.defender_points / self.battles
+
+
+class BattleSimulator(object):
+
+    """Plays out quick battles between attacker and defender on the real
+    battle map for their hex, without touching the game.
+
+    In a quick battle every creature is engaged from the attacker's first
+    turn.  On each player turn the active legion strikes and the other
+    legion counterstrikes, each creature at the living enemy it is
+    likeliest to kill, then the dead are removed.  Killing a Titan kills
+    its legion, and the attacker loses if the defender lasts
+    MAX_BATTLE_TURNS battle turns.  Movement, rangestrikes, carries,
+    summons, and reinforcements are left out.
+
+    Each defending creature fights from a pair of adjacent hexes drawn
+    from the map for each battle, so terrain counts about as often as it
+    appears on the map.  Whether a creature can stand in a hex, and its
+    dice and strike numbers, come from Game.battle_hex_entry_cost,
+    Creature.number_of_dice, and Creature.strike_number, which are only
+    called while the simulator is set up, on copies of the creatures that
+    belong to a _DetachedLegion rather than to the game.
+    """
+
+    def __init__(self, attacker, defender, hexlabel=None, entry_side=None,
+                 rng=None):
+        game = defender.player.game
+        if hexlabel is None:
+            hexlabel = defender.hexlabel
+        if entry_side not in (1, 3, 5):
+            entry_side = attacker.entry_side
+            if entry_side not in (1, 3, 5):
+                entry_side = 1
+        self.rng = rng or random.Random()
+        mterrain = game.board.hexes[hexlabel].terrain
+        battlemap = BattleMap.BattleMap(mterrain, entry_side)
+        self.attackers = self._copy_creatures(attacker, battlemap)
+        self.defenders = self._copy_creatures(defender, battlemap)
+        self.attacker_scores = [creature.score for creature in self.attackers]
+        self.defender_scores = [creature.score for creature in self.defenders]
+        self.attacker_powers = [creature.power for creature in self.attackers]
+        self.defender_powers = [creature.power for creature in self.defenders]
+        self.attacker_hits = [creature.hits for creature in self.attackers]
+        self.defender_hits = [creature.hits for creature in self.defenders]
+        self.attacker_titan = self._titan_index(self.attackers)
+        self.defender_titan = self._titan_index(self.defenders)
+        self._init_strikes(game, battlemap)
+
+    @staticmethod
+    def _copy_creatures(legion, battlemap):
+        """Return copies of the living creatures in legion, in a
+        _DetachedLegion with its Titan power and battlemap."""
+        detached = _DetachedLegion(legion.player.titan_power, battlemap)
+        copies = []
+        for creature in legion.creatures:
+            if not creature.dead:
+                copy = Creature.Creature(creature.name)
+                copy.legion = detached
+                copy.hits = creature.hits
+                copies.append(copy)
+        return copies
+
+    @staticmethod
+    def _titan_index(creatures):
+        for ii, creature in enumerate(creatures):
+            if creature.is_titan:
+                return ii
+        return None
+
+    @staticmethod
+    def _find_sites(battlemap):
+        """Return a list of (hex1, hex2, weight) for the distinct pairs of
+        adjacent onboard hexes, hex1 for the defender and hex2 for the
+        attacker, that creatures can engage across.
+
+        Pairs with the same terrain, elevations, and borders between them
+        play the same, so each is kept once, weighted by how many pairs it
+        stands for.
+        """
+        sites = {}
+        for hex1 in battlemap.hexes.values():
+            if hex1.entrance:
+                continue
+            for hexside, hex2 in hex1.neighbors.items():
+                if hex2.entrance:
+                    continue
+                border = hex1.borders[hexside]
+                border2 = hex2.borders[(hexside + 3) % 6]
+                if border == "Cliff" or border2 == "Cliff":
+                    continue
+                key = (hex1.terrain, hex1.elevation, hex2.terrain,
+                       hex2.elevation, border, border2)
+                site = sites.get(key)
+                if site is None:
+                    sites[key] = [hex1, hex2, 1]
+                else:
+                    site[2] += 1
+        return [tuple(site) for site in sites.values()]
+
+    def _init_strikes(self, game, battlemap):
+        """Fill in, for each site, who can fight there and with what odds.
+
+        self.defender_sites[j] lists the site indexes defenders[j] can stand
+        in, repeated by weight.  self.attacker_strikes[s][i][j] and
+        self.defender_strikes[s][j][i] are the _Strike of attackers[i]
+        striking defenders[j] and back when defenders[j] is in site s, or
+        None if they cannot fight there.  game is only asked for entry
+        costs, which do not depend on its state.
+        """
+        self.sites = self._find_sites(battlemap)
+        self.defender_sites = [[] for unused in self.defenders]
+        self.attacker_strikes = []
+        self.defender_strikes = []
+        num_attackers = len(self.attackers)
+        num_defenders = len(self.defenders)
+        for ss, (hex1, hex2, weight) in enumerate(self.sites):
+            attacker_strikes = [[None] * num_defenders
+                                for unused in range(num_attackers)]
+            defender_strikes = [[None] * num_attackers
+                                for unused in range(num_defenders)]
+            attackers_here = []
+            for ii, attacker in enumerate(self.attackers):
+                if game.battle_hex_entry_cost(attacker, hex2.terrain,
+                                              None) < maxsize:
+                    attacker.hexlabel = hex2.label
+                    attackers_here.append(ii)
+            for jj, defender in enumerate(self.defenders):
+                if game.battle_hex_entry_cost(defender, hex1.terrain,
+                                              None) >= maxsize:
+                    continue
+                defender.hexlabel = hex1.label
+                self.defender_sites[jj].extend([ss] * weight)
+                for ii in attackers_here:
+                    attacker = self.attackers[ii]
+                    attacker_strikes[ii][jj] = _Strike(
+                        attacker.number_of_dice(defender, True),
+                        attacker.strike_number(defender, True))
+                    defender_strikes[jj][ii] = _Strike(
+                        defender.number_of_dice(attacker, True),
+                        defender.strike_number(attacker, True))
+            self.attacker_strikes.append(attacker_strikes)
+            self.defender_strikes.append(defender_strikes)
+
+    def _strike(self, rows, targets_hits, targets_powers):
+        """For each row in rows, a list of the striker's _Strike or None
+        against each target, strike the living target the striker is
+        likeliest to kill, adding the hits rolled to targets_hits."""
+        rng = self.rng
+        for row in rows:
+            best = None
+            best_kill = -1.
+            for jj, strike in enumerate(row):
+                if strike is None:
+                    continue
+                hits_left = targets_powers[jj] - targets_hits[jj]
+                if hits_left <= 0:
+                    continue
+                at_least = strike.at_least
+                if hits_left < len(at_least):
+                    kill = at_least[hits_left]
+                else:
+                    kill = 0.
+                if kill > best_kill or (kill == best_kill and
+                                        strike.mean_hits > best.mean_hits):
+                    best = strike
+                    best_jj = jj
+                    best_kill = kill
+            if best is not None:
+                targets_hits[best_jj] += bisect_right(best.cumulative,
+                                                      rng.random())
+
+    def _play_battle(self):
+        """Play one quick battle and return (attacker_hits, defender_hits)
+        at the end, with every creature of an eliminated legion dead."""
+        rng = self.rng
+        attacker_hits = list(self.attacker_hits)
+        defender_hits = list(self.defender_hits)
+        attacker_powers = self.attacker_powers
+        defender_powers = self.defender_powers
+        # The site each defender fights from, or None if it cannot fight.
+        sites = [rng.choice(site_list) if site_list else None
+                 for site_list in self.defender_sites]
+        attacker_strikes = self.attacker_strikes
+        defender_strikes = self.defender_strikes
+        for battle_turn in range(1, MAX_BATTLE_TURNS + 1):
+            for attacker_active in (False, True):
+                if battle_turn == 1 and not attacker_active:
+                    # The attacker has not entered yet.
+                    continue
+                attackers = [ii for ii, power in enumerate(attacker_powers)
+                             if attacker_hits[ii] < power]
+                defenders = [jj for jj, power in enumerate(defender_powers)
+                             if defender_hits[jj] < power]
+                if not attackers or not defenders:
+                    return attacker_hits, defender_hits
+                attacker_rows = [
+                    [attacker_strikes[site][ii][jj]
+                     if site is not None else None
+                     for jj, site in enumerate(sites)]
+                    for ii in attackers]
+                defender_rows = [defender_strikes[sites[jj]][jj]
+                                 for jj in defenders
+                                 if sites[jj] is not None]
+                if attacker_active:
+                    self._strike(attacker_rows, defender_hits,
+                                 defender_powers)
+                    self._strike(defender_rows, attacker_hits,
+                                 attacker_powers)
+                else:
+                    self._strike(defender_rows, attacker_hits,
+                                 attacker_powers)
+                    self._strike(attacker_rows, defender_hits,
+                                 defender_powers)
+                self._kill_legion_if_titan_dead(attacker_hits,
+                                                attacker_powers,
+                                                self.attacker_titan)
+                self._kill_legion_if_titan_dead(defender_hits,
+                                                defender_powers,
+                                                self.defender_titan)
+        # Time loss: the attacker is eliminated.
+        for ii, power in enumerate(attacker_powers):
+            attacker_hits[ii] = max(attacker_hits[ii], power)
+        return attacker_hits, defender_hits
+
+    @staticmethod
+    def _kill_legion_if_titan_dead(hits, powers, titan):
+        if titan is not None and hits[titan] >= powers[titan]:
+            for ii, power in enumerate(powers):
+                hits[ii] = max(hits[ii], power)
+
+    def simulate(self, num_battles, deadline=None):
+        """Play up to num_battles quick battles, stopping early if the time
+        passes deadline, and return a SimulationResult."""
+        result = SimulationResult()
+        for unused in range(num_battles):
+            if deadline is not None and time.time() > deadline:
+                break
+            attacker_hits, defender_hits = self._play_battle()
+            attacker_points = sum(
+                score for ii, score in enumerate(self.attacker_scores)
+                if attacker_hits[ii] < self.attacker_powers[ii])
+            defender_points = sum(
+                score for jj, score in enumerate(self.defender_scores)
+                if defender_hits[jj] < self.defender_powers[jj])
+            attacker_alive = any(
+                hits < power for hits, power in zip(attacker_hits,
+                                                    self.attacker_powers))
+            defender_alive = any(
+                hits < power for hits, power in zip(defender_hits,
+                                                    self.defender_powers))
+            result.battles += 1
+            if attacker_alive:
+                result.attacker_wins += 1
+                result.attacker_points += attacker_points
+            elif defender_alive:
+                result.defender_wins += 1
+                result.defender_points += defender_points
+            else:
+                result.draws += 1
+        return result
@@ -54,3 +54,6 @@ class Bot(Interface):
 
     def acquire_angels(game, markerid, num_angels, num_archangels):
         """Acquire angels."""
+
+    def shutdown():
+        """Release any resources, such as worker processes."""
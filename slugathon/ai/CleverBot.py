@@ -6,19 +6,28 @@ __license__ = "GNU GPL v2"
 
 
 import random
-import copy
 import time
 from sys import maxsize
-import itertools
-import collections
 import logging
 
 from twisted.python import log
 from zope.interface import implementer
 
 from slugathon.ai.Bot import Bot
-from slugathon.ai import BotParams
-from slugathon.game import Game, Creature, Phase, Legion
+from slugathon.ai import (BotParams, StrikeMatrix, TranspositionTable,
+                          BattleSimulator, ScoringPool)
+from slugathon.game import Game, Creature, Phase, Legion, GameState
+from slugathon.util import Zobrist
+
+
+# Number of battle positions to remember scores for
+SCORE_CACHE_SIZE = 50000
+
+# Number of quick battles to play out before fleeing
+SIMULATED_BATTLES = 1000
+
+# Chance of a kill at which strike goes after a target before others
+KILL_PROBABILITY = 0.5
 
 
 def best7(score_moves):
@@ -43,11 +52,172 @@ def best7(score_moves):
     return best_moves
 
 
+class LegionMoveScore(object):
+
+    """The score from CleverBot._score_legion_move for creatures, kept
+    current as they move one at a time.
+
+    The score is the sum of one term per creature from
+    CleverBot._score_creature, the kill bonus, which depends on the total
+    mean hits on each enemy, and the adjacent ally bonus, which counts
+    pairs of neighboring allies.  Moving a creature marks as stale its own
+    term, the ally counts of creatures next to its old and new hexes, and
+    the terms of allies whose line of sight to or from an enemy
+    rangestriker passes through its old or new hex.  Stale parts are only
+    recomputed when score is read, so a layout found in the bot's score
+    cache by key costs nothing to score.
+    """
+
+    def __init__(self, bot, game, creatures):
+        self.bot = bot
+        self.game = game
+        self.creatures = list(creatures)
+        legion = self.creatures[0].legion
+        self.enemies = game.other_battle_legion(legion).creatures
+        self.rangestriking_enemies = [
+            enemy for enemy in self.enemies
+            if enemy.rangestrikes and not enemy.magicmissile and
+            not enemy.offboard and enemy.hexlabel is not None]
+        self.num_kill_bonuses = sum(
+            1 for creature in self.creatures
+            if bot._may_charge(game, creature))
+        if legion is game.attacker_legion:
+            self.role = "attacker"
+        else:
+            self.role = "defender"
+        self.position = bot._battle_position_hash(game, self.creatures)
+        num_creatures = len(self.creatures)
+        self.terms = [0.] * num_creatures
+        self.mean_hits = [None] * num_creatures
+        self.num_adjacent_allies = [0] * num_creatures
+        self._stale_terms = set(range(num_creatures))
+        self._stale_allies = set(range(num_creatures))
+        self._score = None
+
+    @property
+    def key(self):
+        """The bot's _battle_position_hash for the current layout."""
+        return self.position.value
+
+    @property
+    def score(self):
+        if self._score is None:
+            for ii in self._stale_terms:
+                self._score_creature(ii)
+            for ii in self._stale_allies:
+                self.num_adjacent_allies[ii] = self.bot._num_adjacent_allies(
+                    self.game, self.creatures[ii])
+            self._stale_terms.clear()
+            self._stale_allies.clear()
+            self._score = self._total()
+        return self._score
+
+    def _score_creature(self, ii):
+        """Recompute the term and mean hits for creatures[ii]."""
+        creature = self.creatures[ii]
+        matrix = StrikeMatrix.StrikeMatrix([creature], self.enemies)
+        self.terms[ii] = self.bot._score_creature(
+            self.game, creature, matrix, 0, matrix.max_mean_hits()[0],
+            matrix.total_mean_damage_taken()[0])
+        self.mean_hits[ii] = [float(hits) for hits in matrix.mean_hits[0]]
+
+    def _line_of_sight_through(self, ii, hexlabels):
+        """Return True iff a creature in one of hexlabels could block line
+        of sight for a rangestrike to or from creatures[ii]."""
+        creature = self.creatures[ii]
+        hexlabel = creature.hexlabel
+        if hexlabel is None or creature.offboard:
+            return False
+        battlemap = self.game.battlemap
+        lines = []
+        for enemy in self.rangestriking_enemies:
+            if battlemap.range(enemy.hexlabel, hexlabel) <= enemy.skill:
+                lines.append((enemy.hexlabel, hexlabel))
+        if creature.rangestrikes and not creature.magicmissile:
+            for enemy in self.enemies:
+                if (enemy.hexlabel is not None and not enemy.offboard and
+                   battlemap.range(hexlabel, enemy.hexlabel) <=
+                   creature.skill):
+                    lines.append((hexlabel, enemy.hexlabel))
+        for line in lines:
+            for unused, creature_hexlabels in battlemap.los_blocks.get(
+                    line, ()):
+                for hexlabel2 in hexlabels:
+                    if hexlabel2 in creature_hexlabels:
+                        return True
+        return False
+
+    def _total(self):
+        """Return the score from the current terms."""
+        bp = self.bot.bp
+        total_mean_hits = [0.] * len(self.enemies)
+        for row in self.mean_hits:
+            for jj, hits in enumerate(row):
+                total_mean_hits[jj] += hits
+        kill_bonus = self.bot._kill_bonus(self.enemies, total_mean_hits)
+        return (sum(self.terms) +
+                bp.KILL_MULTIPLIER * kill_bonus * self.num_kill_bonuses +
+                bp.ADJACENT_ALLY_BONUS * sum(self.num_adjacent_allies))
+
+    def move(self, ii, hexlabel):
+        """Move creatures[ii] to hexlabel, updating key and marking what
+        the move touches for rescoring."""
+        creature = self.creatures[ii]
+        old_hexlabel = creature.hexlabel
+        if hexlabel == old_hexlabel:
+            return
+        feature = self.bot._battle_position_feature(self.role, creature)
+        self.position.remove(feature)
+        self.position.remove(("scored",) + feature)
+        creature.hexlabel = hexlabel
+        feature = self.bot._battle_position_feature(self.role, creature)
+        self.position.add(feature)
+        self.position.add(("scored",) + feature)
+        self._score = None
+        self._stale_terms.add(ii)
+        self._stale_allies.add(ii)
+        hexes = self.game.battlemap.hexes
+        for jj, creature2 in enumerate(self.creatures):
+            if (jj not in self._stale_terms and
+                    self._line_of_sight_through(jj, (old_hexlabel,
+                                                     hexlabel))):
+                self._stale_terms.add(jj)
+            if jj in self._stale_allies:
+                continue
+            # Entrances are not symmetric neighbors, so look from creature2.
+            for neighbor in hexes[creature2.hexlabel].neighbors.values():
+                if (neighbor.label == old_hexlabel or
+                        neighbor.label == hexlabel):
+                    self._stale_allies.add(jj)
+                    break
+
+    def delta(self, ii, hexlabel):
+        """Return how much the score would change if creatures[ii] moved to
+        hexlabel, leaving it where it is."""
+        creature = self.creatures[ii]
+        old_hexlabel = creature.hexlabel
+        score = self.score
+        saved = (self.terms[:], self.mean_hits[:],
+                 self.num_adjacent_allies[:], self.position.copy())
+        try:
+            self.move(ii, hexlabel)
+            return self.score - score
+        finally:
+            creature.hexlabel = old_hexlabel
+            (self.terms, self.mean_hits, self.num_adjacent_allies,
+             self.position) = saved
+            self._stale_terms.clear()
+            self._stale_allies.clear()
+            self._score = score
+
+
 @implementer(Bot)
 class CleverBot(object):
 
-    def __init__(self, playername, ai_time_limit, bot_params=None):
-        logging.info("CleverBot %s %s", playername, ai_time_limit)
+    def __init__(self, playername, ai_time_limit, bot_params=None,
+                 workers=0):
+        logging.info("CleverBot %s %s %s", playername, ai_time_limit,
+                     workers)
         self.playername = playername
         self.user = None
         self.ai_time_limit = ai_time_limit
@@ -56,6 +226,15 @@ class CleverBot(object):
             self.bp = BotParams.default_bot_params
         else:
             self.bp = bot_params
+        # Scores from _score_legion_move, by battle position
+        self.score_cache = TranspositionTable.TranspositionTable(
+            SCORE_CACHE_SIZE)
+        # Worker processes for the legion move search, or None to search
+        # in this process
+        if workers > 1:
+            self.scoring_pool = ScoringPool.ScoringPool(workers)
+        else:
+            self.scoring_pool = None
 
     @property
     def player_info(self):
@@ -162,8 +341,7 @@ class CleverBot(object):
                 logging.info("defender hasn't chosen whether to flee yet")
                 if defender.can_flee:
                     logging.info("can flee")
-                    if (defender.terrain_combat_value * self.bp.FLEE_RATIO <
-                       attacker.terrain_combat_value):
+                    if self._should_flee(attacker, defender):
                         logging.info("fleeing")
                         def1 = self.user.callRemote("flee", game.name,
                                                     defender.markerid)
@@ -191,6 +369,22 @@ class CleverBot(object):
         else:
             logging.info("not my engagement")
 
+    def _should_flee(self, attacker, defender):
+        """Return True if defender should flee from attacker.
+
+        Fleeing is worth considering if attacker's combat value is well
+        above defender's, but the combat values leave out a lot, so only
+        flee if simulated battles say that defender would probably lose.
+        """
+        if (defender.terrain_combat_value * self.bp.FLEE_RATIO >=
+                attacker.terrain_combat_value):
+            return False
+        simulator = BattleSimulator.BattleSimulator(attacker, defender)
+        result = simulator.simulate(SIMULATED_BATTLES,
+                                    time.time() + self.ai_time_limit / 2.)
+        logging.info("%s vs %s %s", attacker, defender, result)
+        return result.battles == 0 or result.defender_win_probability < 0.5
+
     def _scary_enemy_legions_behind(self, legion):
         """Return True if there are any scary enemy legions that can
         catch this legion next turn."""
@@ -379,7 +573,8 @@ class CleverBot(object):
             summonables = legion.player.all_summonables
             if summonables:
                 tuples = sorted(((creature.sort_value, creature)
-                                 for creature in summonables), reverse=True)
+                                 for creature in summonables),
+                                key=lambda tup: tup[0], reverse=True)
                 summonable = tuples[0][1]
 
                 # After battle, do not summon if 6 high and we could recruit
@@ -558,6 +753,7 @@ class CleverBot(object):
         player = game.active_player
         non_moves = {}  # markerid: score
         while True:
+            state = GameState.snapshot(game)
             # Score moves
             # (score, legion, hexlabel, entry_side)
             best_moves = []
@@ -567,10 +763,10 @@ class CleverBot(object):
                                             player.movement_roll)
                 logging.debug("legion %s moves %s", legion, moves)
                 for hexlabel, entry_side in moves:
-                    score = self._score_move(legion, hexlabel, True)
+                    score = self._score_move(legion, hexlabel, True, state)
                     best_moves.append(
                         (score, legion, hexlabel, entry_side))
-            best_moves.sort()
+            best_moves.sort(key=lambda tup: tup[0])
             logging.debug("best moves %s", best_moves)
             if not best_moves:
                 logging.debug("dumping all legions")
@@ -592,7 +788,8 @@ class CleverBot(object):
             # (score, legion, hexlabel, None)
             # Entry side None means not a move.
             for legion in player.unmoved_legions:
-                score = self._score_move(legion, legion.hexlabel, False)
+                score = self._score_move(legion, legion.hexlabel, False,
+                                         state)
                 non_moves[legion.markerid] = score
             logging.debug("non_moves %s", non_moves)
 
@@ -626,33 +823,36 @@ class CleverBot(object):
             def1.addErrback(self.failure)
             return
 
-    def _score_move(self, legion, hexlabel, moved):
-        """Return a score for legion moving to (or staying in) hexlabel."""
+    def _score_move(self, legion, hexlabel, moved, state=None):
+        """Return a score for legion moving to (or staying in) hexlabel.
+
+        The score is worked out on state, a GameState snapshot of the game,
+        or a new snapshot if state is None, so the real legion never moves.
+        """
+        if state is None:
+            state = GameState.snapshot(legion.player.game)
+        legion = state.legions[legion.markerid]
+        playername = legion.playername
         score = 0
-        player = legion.player
-        game = player.game
-        caretaker = game.caretaker
-        board = game.board
-        enemies = player.enemy_legions(hexlabel)
-        legion_combat_value = legion.combat_value
-        legion_sort_value = legion.sort_value
+        enemies = state.enemy_legions(playername, hexlabel)
+        legion_combat_value = state.combat_value(legion)
+        legion_sort_value = state.sort_value(legion)
 
         if enemies:
             assert len(enemies) == 1
             enemy = enemies.pop()
-            enemy_combat_value = enemy.terrain_combat_value
-            logging.debug("legion %s hexlabel %s", legion, hexlabel)
+            enemy_combat_value = state.terrain_combat_value(enemy)
+            logging.debug("legion %s hexlabel %s", legion.markerid, hexlabel)
             logging.debug("legion_combat_value %s", legion_combat_value)
             logging.debug("enemy_combat_value %s", enemy_combat_value)
             if enemy_combat_value < self.bp.SQUASH * legion_combat_value:
-                score += enemy.score
+                score += state.score(enemy)
             elif (enemy_combat_value >= self.bp.BE_SQUASHED *
                   legion_combat_value):
                 score -= legion_sort_value
-        if moved and (len(legion) < 7 or enemies):
-            masterhex = board.hexes[hexlabel]
-            terrain = masterhex.terrain
-            recruits = legion.available_recruits(terrain, caretaker)
+        if moved and (legion.height < 7 or enemies):
+            terrain = state.board.hexes[hexlabel].terrain
+            recruits = state.available_recruits(legion, terrain)
             if recruits:
                 recruit_name = recruits[-1]
                 recruit = Creature.Creature(recruit_name)
@@ -665,50 +865,77 @@ class CleverBot(object):
                 logging.debug("recruit value %s %s %s", legion.markerid,
                               hexlabel, recruit_value)
                 score += recruit_value
-        if game.turn > 1:
+        if state.turn > 1:
             # Do not fear enemy legions on turn 1.  8-high legions will be
             # forced to split, and hanging around in the tower to avoid getting
             # attacked 5-on-4 is too passive.
-            try:
-                previous_hexlabel = legion.hexlabel
-                legion.hexlabel = hexlabel
-                for enemy in player.enemy_legions():
-                    if (enemy.terrain_combat_value >= self.bp.BE_SQUASHED *
-                       legion_combat_value):
-                        for roll in range(1, 6 + 1):
-                            moves = game.find_normal_moves(enemy,
-                                                           game.board.hexes[
-                                                               enemy.hexlabel],
-                                                           roll).union(
-                                game.find_titan_teleport_moves(enemy))
-                            hexlabels = set((move[0] for move in moves))
-                            if hexlabel in hexlabels:
-                                score -= legion_sort_value / 6.0
-            finally:
-                legion.hexlabel = previous_hexlabel
+            state2 = state.move_legion(legion.markerid, hexlabel)
+            for enemy in state2.enemy_legions(playername):
+                if (state2.terrain_combat_value(enemy) >= self.bp.BE_SQUASHED *
+                   legion_combat_value):
+                    for roll in range(1, 6 + 1):
+                        moves = state2.find_normal_moves(
+                            enemy, enemy.hexlabel, roll).union(
+                            state2.find_titan_teleport_moves(enemy))
+                        hexlabels = set((move[0] for move in moves))
+                        if hexlabel in hexlabels:
+                            score -= legion_sort_value / 6.0
         return score
 
-    def _gen_legion_moves_inner(self, movesets):
+    def _gen_legion_moves_inner(self, movesets, prune=None):
         """Yield tuples of distinct hexlabels, one from each moveset, in order,
         with no duplicates.
 
-        movesets is a list of sets of hexlabels, corresponding to the order of
-        remaining creatures in the legion.
+        movesets is a list of iterables of hexlabels, corresponding to the
+        order of remaining creatures in the legion.  Each moveset is tried in
+        its own iteration order, so callers can list the most promising
+        hexlabels first and get the most promising legion moves first.
+
+        This is a backtracking search that keeps the hexes used so far in a
+        bitmask, so nothing is copied, and legion moves are produced lazily.
+
+        If prune is not None, it is called with each partial tuple of
+        hexlabels, and if it returns True the rest of that branch is skipped.
         """
-        if not movesets:
+        bits = {}
+        choices = []
+        for moveset in movesets:
+            choice = []
+            for hexlabel in moveset:
+                if hexlabel not in bits:
+                    bits[hexlabel] = 1 << len(bits)
+                choice.append((hexlabel, bits[hexlabel]))
+            choices.append(choice)
+        num_creatures = len(choices)
+        if not num_creatures:
             yield ()
-        elif len(movesets) == 1:
-            for move in movesets[0]:
-                yield (move,)
-        else:
-            for move in movesets[0]:
-                movesets1 = copy.deepcopy(movesets[1:])
-                for moveset in movesets1:
-                    moveset.discard(move)
-                for moves in self._gen_legion_moves_inner(movesets1):
-                    yield (move,) + moves
-
-    def _gen_legion_moves(self, movesets):
+            return
+        moves = [None] * num_creatures
+        positions = [0] * num_creatures
+        # used[depth] is the bitmask of hexes taken by earlier creatures
+        used = [0] * num_creatures
+        depth = 0
+        while depth >= 0:
+            choice = choices[depth]
+            position = positions[depth]
+            if position == len(choice):
+                positions[depth] = 0
+                depth -= 1
+                continue
+            positions[depth] = position + 1
+            hexlabel, bit = choice[position]
+            if used[depth] & bit:
+                continue
+            moves[depth] = hexlabel
+            if prune is not None and prune(tuple(moves[:depth + 1])):
+                continue
+            if depth == num_creatures - 1:
+                yield tuple(moves)
+            else:
+                used[depth + 1] = used[depth] | bit
+                depth += 1
+
+    def _gen_legion_moves(self, movesets, prune=None):
         """Yield all possible legion_moves for movesets.
 
         movesets is a list of sets of hexlabels to which each Creature can move
@@ -720,11 +947,14 @@ class CleverBot(object):
         where each Creature's hexlabel is one from its original list, and no
         two Creatures have the same hexlabel.  Like:
         ["A1", "B1", "B3"]
+
+        movesets may also be lists ordered best first, in which case the
+        legion_moves come out in that order too.  See
+        _gen_legion_moves_inner for prune.
         """
         logging.info("_gen_legion_moves %s", movesets)
-        for moves in self._gen_legion_moves_inner(movesets):
-            if len(moves) == len(movesets):
-                yield list(moves)
+        for moves in self._gen_legion_moves_inner(movesets, prune):
+            yield list(moves)
 
     def _gen_fallback_legion_moves(self, movesets):
         """Yield all possible legion_moves for movesets, possibly including
@@ -770,6 +1000,13 @@ class CleverBot(object):
 
         creature_moves is a list of (creature_name, start_hexlabel,
         finish_hexlabel) tuples.
+
+        First try dependency order: a creature moving into a hex that an
+        ally starts in must wait for the ally to leave.  If that fails,
+        because allies block each other's paths or want each other's hexes,
+        search move orders.  The board only depends on which creatures have
+        moved so far, not the order they moved in, so each set of moves is
+        tried at most once.
         """
         max_score = 0
         sort_values = {}
@@ -777,28 +1014,333 @@ class CleverBot(object):
             creature = game.creatures_in_battle_hex(start, creature_name).pop()
             sort_values[creature_name] = creature.sort_value
             max_score += creature.sort_value
-        perms = list(itertools.permutations(creature_moves))
-        logging.info("%d perms" % len(perms))
-        # Scramble the list so we don't get a bunch of similar bad
-        # orders jumbled together at the beginning.
-        random.shuffle(perms)
-        best_score = -maxsize
-        best_perm = None
+        order = self._dependency_order(creature_moves, sort_values)
+        score = self._score_perm(game, sort_values, order)
+        if score == max_score:
+            logging.info("found perfect order %s", order)
+            return order
+        best_order = self._search_move_order(game, order, sort_values,
+                                             max_score, score)
+        logging.info("returning %s" % best_order)
+        return best_order
+
+    def _dependency_order(self, creature_moves, sort_values):
+        """Return a list of creature_moves with each move after the move of
+        the ally that starts in its finishing hex, if any, and otherwise
+        the most valuable creatures first.
+
+        Moves caught in a cycle go at the end.
+        """
+        start_to_index = {}
+        for ii, (creature_name, start, move) in enumerate(creature_moves):
+            if start not in ["ATTACKER", "DEFENDER"]:
+                start_to_index[start] = ii
+        # index of the move that has to happen first, or None
+        predecessors = []
+        for ii, (creature_name, start, move) in enumerate(creature_moves):
+            jj = start_to_index.get(move)
+            if jj == ii:
+                jj = None
+            predecessors.append(jj)
+        remaining = sorted(range(len(creature_moves)), key=lambda ii:
+                           -sort_values[creature_moves[ii][0]])
+        done = set()
+        order = []
+        progress = True
+        while remaining and progress:
+            progress = False
+            for ii in remaining:
+                jj = predecessors[ii]
+                if jj is None or jj in done:
+                    done.add(ii)
+                    order.append(creature_moves[ii])
+                    remaining.remove(ii)
+                    progress = True
+                    break
+        for ii in remaining:
+            order.append(creature_moves[ii])
+        return order
+
+    def _search_move_order(self, game, order, sort_values, max_score,
+                           order_score):
+        """Return the order of the creature_moves in order that lets the
+        most valuable creatures reach their hexes, stopping early on a
+        perfect order or at the time limit.
+
+        order_score is the score of order itself.
+        """
+        # Several creatures with the same name can share an entrance.
+        creatures = []
+        used = set()
+        for creature_name, start, move in order:
+            for creature in game.creatures_in_battle_hex(start,
+                                                         creature_name):
+                if id(creature) not in used:
+                    used.add(id(creature))
+                    creatures.append(creature)
+                    break
         finish_time = time.time() + self.ai_time_limit
-        for perm in perms:
-            score = self._score_perm(game, sort_values, perm)
-            if score == max_score:
-                best_perm = perm
-                logging.info("found perfect order")
-                break
-            elif score > best_score:
-                best_perm = perm
-                best_score = score
-            if time.time() > finish_time:
-                logging.info("time limit")
-                break
-        logging.info("returning %s" % list(best_perm))
-        return list(best_perm)
+        # list of (score, path) where path is a list of indexes into order
+        best = [(order_score, None)]
+        seen = set()
+        nodes = [0]
+
+        def search(made, path, score):
+            nodes[0] += 1
+            if score > best[0][0]:
+                best[0] = (score, path[:])
+            if score == max_score or time.time() > finish_time:
+                return True
+            for ii, (creature_name, start, move) in enumerate(order):
+                if made & (1 << ii):
+                    continue
+                made2 = made | (1 << ii)
+                if made2 in seen:
+                    continue
+                creature = creatures[ii]
+                if move != start and move not in game.find_battle_moves(
+                        creature):
+                    continue
+                seen.add(made2)
+                creature.previous_hexlabel = creature.hexlabel
+                creature.hexlabel = move
+                path.append(ii)
+                try:
+                    if search(made2, path, score + sort_values[creature_name]):
+                        return True
+                finally:
+                    path.pop()
+                    creature.hexlabel = creature.previous_hexlabel
+                    creature.previous_hexlabel = None
+            return False
+
+        search(0, [], 0)
+        score, path = best[0]
+        logging.info("searched %d move orders, best score %s of %s",
+                     nodes[0], score, max_score)
+        if path is None:
+            return order
+        result = [order[ii] for ii in path]
+        result.extend(order[ii] for ii in range(len(order))
+                      if ii not in path)
+        return result
+
+    def _legion_move_bounds(self, game, creatures, movesets):
+        """Return (bases, mean_hits, num_kill_bonuses) for bounding the
+        score of legion moves built from movesets.
+
+        bases is a list, in the same order as creatures, of dicts of
+        hexlabel: the most that creature can score in that hex, wherever its
+        allies end up, not counting the kill bonus.  It is scored by
+        _score_creature with its allies off the board, so they can't block
+        its line of sight, then the parts that depend on its allies are
+        replaced by the most they could be: every neighboring hex holding an
+        ally, enemy rangestrikes all being blocked by allies, and its own
+        rangestrikes blocked or not, whichever scores more.  Each of those
+        is clamped separately, so the bound holds whatever the signs of the
+        BotParams weights.
+
+        The kill bonus is handled for the whole legion by _legion_move_bound,
+        using mean_hits, a parallel list of dicts of hexlabel: list of the
+        mean hits that creature can do to each enemy from that hex.
+        num_kill_bonuses is the number of creatures that get the kill bonus.
+        """
+        legion = creatures[0].legion
+        legion2 = game.other_battle_legion(legion)
+        enemies = legion2.creatures
+        hexes = game.battlemap.hexes
+        max_adjacent_allies = len(creatures) - 1
+
+        def damage_score(creature, damage):
+            """Return the score for creature taking damage mean hits."""
+            score = self.bp.DAMAGE_PENALTY * damage
+            if damage >= creature.hits_left:
+                score += self.bp.DEATH_MULTIPLIER * creature.sort_value
+            return score
+
+        def rangestrike_slack(creature, matrix):
+            """Return how much more creature could score if allies blocked
+            all the rangestrikes matrix says it has."""
+            if any(matrix.melee[0]) or not any(matrix.strikes[0]):
+                return 0
+            slack = max(-self.bp.RANGESTRIKE_BONUS, 0)
+            if self._may_charge(game, creature):
+                slack += max(-self.bp.HIT_BONUS * matrix.max_mean_hits()[0],
+                             0)
+                if legion == game.attacker_legion:
+                    min_range = min(game.battlemap.range(creature.hexlabel,
+                                                         enemy.hexlabel)
+                                    for enemy in legion2.living_creatures)
+                    slack += max(min_range *
+                                 self.bp.ATTACKER_DISTANCE_PENALTY -
+                                 self.bp.ATTACKER_AGGRESSION_BONUS, 0)
+            return slack
+
+        bases = []
+        mean_hits = []
+        num_kill_bonuses = 0
+        for creature, moveset in zip(creatures, movesets):
+            if self._may_charge(game, creature):
+                num_kill_bonuses += 1
+            allies = [ally for ally in legion.living_creatures
+                      if ally is not creature]
+            base = {}
+            creature_mean_hits = {}
+            # Not previous_hexlabel, which the game uses for allies that
+            # have already moved.
+            ally_hexlabels = [ally.hexlabel for ally in allies]
+            start_hexlabel = creature.hexlabel
+            try:
+                for ally in allies:
+                    ally.hexlabel = None
+                for move in moveset:
+                    creature.hexlabel = move
+                    matrix = StrikeMatrix.StrikeMatrix([creature], enemies)
+                    row = [float(hits) for hits in matrix.mean_hits[0]]
+                    damage = matrix.total_mean_damage_taken()[0]
+                    melee_damage = sum(
+                        float(hits) for jj, hits in
+                        enumerate(matrix.mean_hits_taken[0])
+                        if matrix.melee[0][jj])
+                    score = self._score_creature(game, creature, matrix, 0,
+                                                 matrix.max_mean_hits()[0],
+                                                 damage)
+                    score += (max(damage_score(creature, melee_damage),
+                                  damage_score(creature, damage)) -
+                              damage_score(creature, damage))
+                    score += rangestrike_slack(creature, matrix)
+                    most_adjacent_allies = min(len(hexes[move].neighbors),
+                                               max_adjacent_allies)
+                    score += max(self.bp.ADJACENT_ALLY_BONUS *
+                                 most_adjacent_allies, 0)
+                    base[move] = score
+                    creature_mean_hits[move] = row
+            finally:
+                creature.hexlabel = start_hexlabel
+                for ally, hexlabel in zip(allies, ally_hexlabels):
+                    ally.hexlabel = hexlabel
+            bases.append(base)
+            mean_hits.append(creature_mean_hits)
+        return bases, mean_hits, num_kill_bonuses
+
+    def _legion_move_bound(self, enemies, bases, mean_hits, num_kill_bonuses,
+                           max_bases, max_mean_hits, partial):
+        """Return an upper bound on the score of any legion move that starts
+        with partial, a tuple of hexlabels for the first len(partial)
+        creatures.
+
+        The other creatures are assumed to get their best base score and
+        their most mean hits on every enemy at once.
+        """
+        bound = 0.
+        total_mean_hits = [0.] * len(enemies)
+        for ii, move in enumerate(partial):
+            bound += bases[ii][move]
+            for jj, hits in enumerate(mean_hits[ii][move]):
+                total_mean_hits[jj] += hits
+        for ii in range(len(partial), len(bases)):
+            bound += max_bases[ii]
+            for jj, hits in enumerate(max_mean_hits[ii]):
+                total_mean_hits[jj] += hits
+        if self.bp.KILL_MULTIPLIER > 0:
+            kill_bonus = self._kill_bonus(enemies, total_mean_hits)
+            bound += self.bp.KILL_MULTIPLIER * kill_bonus * num_kill_bonuses
+        return bound
+
+    def _search_legion_moves(self, game, creatures, movesets,
+                             finish_time=None):
+        """Find the best legion move by branch and bound.
+
+        movesets is a list of best-first lists of hexlabels, one per
+        Creature in creatures.  The search stops at finish_time, or after
+        ai_time_limit if finish_time is None.
+
+        Creatures are assigned hexes one at a time, and any partial legion
+        move whose bound (see _legion_move_bound) cannot beat the best full
+        legion move so far is dropped along with everything under it.  If
+        this finishes within the time limit, the result is the best legion
+        move.  Otherwise upper_bound is the most any unsearched legion move
+        could score.
+
+        Return (best_legion_move, best_score, upper_bound, nodes, pruned),
+        where nodes is the number of partial and full legion moves expanded
+        and pruned the number dropped.  best_legion_move is None if there
+        are no legal legion moves.
+        """
+        # Allow for rounding error in the bounds.
+        EPSILON = 1e-9
+        enemies = game.other_battle_legion(creatures[0].legion).creatures
+        bases, mean_hits, num_kill_bonuses = self._legion_move_bounds(
+            game, creatures, movesets)
+        max_bases = [max(base.values()) for base in bases]
+        max_mean_hits = []
+        for creature_mean_hits in mean_hits:
+            rows = list(creature_mean_hits.values())
+            max_mean_hits.append([max(row[jj] for row in rows)
+                                  for jj in range(len(enemies))])
+
+        def bound(partial):
+            return self._legion_move_bound(enemies, bases, mean_hits,
+                                           num_kill_bonuses, max_bases,
+                                           max_mean_hits, partial)
+
+        # [best_score, nodes, pruned], mutated by prune
+        state = [-maxsize, 0, 0]
+
+        def prune(partial):
+            if bound(partial) <= state[0] + EPSILON:
+                state[2] += 1
+                return True
+            state[1] += 1
+            return False
+
+        best_legion_move = None
+        legion_move = None
+        upper_bound = None
+        # Consecutive legion moves mostly differ in the last few creatures,
+        # so only rehash and rescore what those moves touch, and skip the
+        # rescoring when the layout is already in score_cache.
+        legion_move_score = None
+        start_hexlabels = [creature.hexlabel for creature in creatures]
+        if finish_time is None:
+            finish_time = time.time() + self.ai_time_limit
+        try:
+            for legion_move in self._gen_legion_moves(movesets, prune):
+                if legion_move_score is None:
+                    for ii, creature in enumerate(creatures):
+                        creature.hexlabel = legion_move[ii]
+                    legion_move_score = LegionMoveScore(self, game,
+                                                        creatures)
+                else:
+                    for ii, move in enumerate(legion_move):
+                        legion_move_score.move(ii, move)
+                key = legion_move_score.key
+                score = self.score_cache.get(key)
+                if score is None:
+                    score = legion_move_score.score
+                    self.score_cache.put(key, score)
+                if score > state[0]:
+                    best_legion_move = legion_move
+                    state[0] = score
+                if time.time() > finish_time:
+                    # Bound the legion moves that come after this one.
+                    upper_bound = state[0]
+                    for depth, moveset in enumerate(movesets):
+                        prefix = tuple(legion_move[:depth])
+                        for move in moveset[moveset.index(
+                                legion_move[depth]) + 1:]:
+                            if move not in prefix:
+                                upper_bound = max(upper_bound,
+                                                  bound(prefix + (move,)))
+                    logging.info("time limit")
+                    break
+            else:
+                upper_bound = state[0]
+        finally:
+            for creature, hexlabel in zip(creatures, start_hexlabels):
+                creature.hexlabel = hexlabel
+        best_score, nodes, pruned = state
+        return best_legion_move, best_score, upper_bound, nodes, pruned
 
     def _find_best_creature_moves(self, game):
         """Return a list of up to one (creature_name, start_hexlabel,
@@ -809,10 +1351,11 @@ class CleverBot(object):
         where its allies will end up.  Find the best 7 moves for each creature
         (because with up to 7 creatures in a legion, a creature may have to
         take its 7th-favorite move, and because 7! = 5040, not too big).
-        Combine these into legion moves, and score those again, then take
-        the best legion move.  Finally, find the order of creature moves
-        that lets all the creatures reach their assigned hexes without
-        blocking their allies' moves.
+        Combine these into legion moves, and score those again, using
+        branch and bound to skip legion moves that can't beat the best one
+        so far, then take the best legion move.  Finally, find the order of
+        creature moves that lets all the creatures reach their assigned hexes
+        without blocking their allies' moves.
         """
         if (game.battle_active_player is None or game.battle_active_player.name
            != self.playername):
@@ -822,14 +1365,19 @@ class CleverBot(object):
         logging.info("_find_best_creature_moves %s %s", legion, creatures)
         if not creatures:
             return None
-        movesets = []  # list of a set of hexlabels for each creature
+        # Try moves on a copy of the battle, so that the real creatures
+        # never leave their hexes while we search.  Scoring workers build
+        # their own copies from the same snapshot.
+        snapshot = ScoringPool.snapshot_battle(game, legion, creatures)
+        game, creatures = ScoringPool.restore_battle(snapshot)
+        movesets = []  # list of a best-first list of hexlabels per creature
         previous_creature = None
         moveset = None
         for creature in creatures:
             if (previous_creature and creature.name == previous_creature.name
                and creature.hexlabel == previous_creature.hexlabel):
-                # Reuse previous moveset
-                moveset = copy.deepcopy(moveset)
+                # Reuse previous moveset; nothing modifies it.
+                pass
             else:
                 moves = game.find_battle_moves(creature,
                                                ignore_mobile_allies=True)
@@ -848,44 +1396,39 @@ class CleverBot(object):
                             creature.hexlabel = creature.previous_hexlabel
                     score_moves.sort()
                     logging.info("score_moves %s %s", creature, score_moves)
-                    moveset = best7(score_moves)
+                    scores = dict((move, score) for (score, move) in
+                                  score_moves)
+                    # Best first, so the best legion moves are tried first.
+                    moveset = sorted(best7(score_moves),
+                                     key=lambda move: -scores[move])
                 else:
-                    moveset = set([creature.hexlabel])
+                    moveset = [creature.hexlabel]
             movesets.append(moveset)
             previous_creature = creature
-        best_legion_move = None
-        now = time.time()
-        legion_moves = list(self._gen_legion_moves(movesets))
-        logging.info("found %d legion_moves in %fs" % (len(legion_moves),
-                                                       time.time() - now))
-        if not legion_moves:
-            legion_moves = list(self._gen_fallback_legion_moves(movesets))
-            if not legion_moves:
-                return None
-        best_score = -maxsize
         start_time = time.time()
         finish_time = start_time + self.ai_time_limit
-        # Scramble the moves, in case we don't have time to look at them all.
-        random.shuffle(legion_moves)
-        logging.info("len(creatures) %d len(legion_moves[0]) %d" % (
-                     len(creatures), len(legion_moves[0])))
-        for legion_move in legion_moves:
+        result = None
+        if self.scoring_pool is not None:
             try:
-                for ii, creature in enumerate(creatures):
-                    move = legion_move[ii]
-                    creature.previous_hexlabel = creature.hexlabel
-                    creature.hexlabel = move
-                score = self._score_legion_move(game, creatures)
-                if score > best_score:
-                    best_legion_move = legion_move
-                    best_score = score
-                now = time.time()
-                if now > finish_time:
-                    logging.info("time limit")
-                    break
-            finally:
-                for creature in creatures:
-                    creature.hexlabel = creature.previous_hexlabel
+                result = self.scoring_pool.search_legion_moves(
+                    self, snapshot, movesets, finish_time)
+            except Exception as ex:
+                logging.info("scoring pool failed: %s", ex)
+        if result is None:
+            # Search here with whatever time is left.
+            result = self._search_legion_moves(game, creatures, movesets,
+                                               finish_time)
+        (best_legion_move, best_score, upper_bound, nodes, pruned) = result
+        now = time.time()
+        if best_legion_move is None:
+            best_legion_move = next(self._gen_fallback_legion_moves(movesets),
+                                    None)
+            if best_legion_move is None:
+                return None
+        logging.info("expanded %d nodes, pruned %d, best score %s, upper "
+                     "bound %s", nodes, pruned, best_score, upper_bound)
+        logging.info("score cache %d hits %d misses",
+                     self.score_cache.hits, self.score_cache.misses)
         logging.info("found best_legion_move %s in %fs" % (best_legion_move,
                                                            now - start_time))
         start_hexlabels = [creature.hexlabel for creature in creatures]
@@ -898,6 +1441,12 @@ class CleverBot(object):
                      ordered_creature_moves, time.time() - now))
         return ordered_creature_moves
 
+    def shutdown(self):
+        """Stop any worker processes."""
+        if self.scoring_pool is not None:
+            self.scoring_pool.shutdown()
+            self.scoring_pool = None
+
     def move_creatures(self, game):
         """Move all creatures in the legion.
 
@@ -942,230 +1491,274 @@ class CleverBot(object):
         def1 = self.user.callRemote("done_with_maneuvers", game.name)
         def1.addErrback(self.failure)
 
-    def _score_legion_move(self, game, creatures):
-        """Return a score for creatures in their current hexlabels."""
+    def _may_charge(self, game, creature):
+        """Return True unless creature is a titan early in the battle with
+        allies, which we don't encourage to charge."""
+        return (creature.name != "Titan" or game.battle_turn >= 4 or
+                len(creature.legion) == 1)
+
+    def _kill_bonus(self, enemies, total_mean_hits):
+        """Return the total sort_value of enemies that the mean hits in
+        total_mean_hits, one per enemy, are enough to kill."""
+        kill_bonus = 0
+        for enemy, hits in zip(enemies, total_mean_hits):
+            if hits >= enemy.hits_left:
+                kill_bonus += enemy.sort_value
+        return kill_bonus
+
+    def _num_adjacent_allies(self, game, creature):
+        """Return the number of living allies next to creature."""
+        battlehex = game.battlemap.hexes[creature.hexlabel]
+        neighbor_labels = set(neighbor.label for neighbor in
+                              battlehex.neighbors.values())
+        num_adjacent_allies = 0
+        for ally in creature.legion.living_creatures:
+            if ally.hexlabel in neighbor_labels:
+                num_adjacent_allies += 1
+        return num_adjacent_allies
+
+    def _score_creature(self, game, creature, matrix, ii, max_mean_hits,
+                        total_mean_damage_taken):
+        """Return the part of the score for creature in its current hexlabel
+        that does not depend on its allies' hexes, except for their effect
+        on line of sight.
+
+        matrix is a StrikeMatrix with creature in row ii, and max_mean_hits
+        and total_mean_damage_taken are its entries from the matrix.  The
+        kill bonus and the adjacent ally bonus are left to the caller.
+        """
         score = 0
         battlemap = game.battlemap
-        legion = creatures[0].legion
+        legion = creature.legion
         legion2 = game.other_battle_legion(legion)
+        melee = matrix.melee[ii]
+        engaged = any(melee)
+        engaged_with_rangestriker = any(
+            melee[jj] and enemy.rangestrikes
+            for jj, enemy in enumerate(legion2.creatures))
+        can_rangestrike = not engaged and any(matrix.strikes[ii])
+        probable_death = total_mean_damage_taken >= creature.hits_left
+
+        if engaged_with_rangestriker and not creature.rangestrikes:
+            score += self.bp.ENGAGE_RANGESTRIKER_BONUS
+            logging.info(creature, "ENGAGE_RANGESTRIKER_BONUS %s",
+                         self.bp.ENGAGE_RANGESTRIKER_BONUS)
+
+        if can_rangestrike:
+            score += self.bp.RANGESTRIKE_BONUS
+            logging.info(creature, "RANGESTRIKE_BONUS %s",
+                         self.bp.RANGESTRIKE_BONUS)
+
+        if self._may_charge(game, creature):
+            if max_mean_hits:
+                bonus = self.bp.HIT_BONUS * max_mean_hits
+                score += bonus
+                logging.info(creature, "HIT_BONUS %s", bonus)
+        if total_mean_damage_taken:
+            penalty = self.bp.DAMAGE_PENALTY * total_mean_damage_taken
+            score += penalty
+            logging.info(creature, "DAMAGE_PENALTY %s", penalty)
+        if probable_death:
+            penalty = (self.bp.DEATH_MULTIPLIER * probable_death *
+                       creature.sort_value)
+            score += penalty
+            logging.info(creature, "DEATH_PENALTY %s", penalty)
+
+        # Attacker must attack to avoid time loss
+        if legion == game.attacker_legion and self._may_charge(game,
+                                                               creature):
+            if engaged or can_rangestrike:
+                score += self.bp.ATTACKER_AGGRESSION_BONUS
+                logging.info(creature, "ATTACKER_AGGRESSION_BONUS %s",
+                             self.bp.ATTACKER_AGGRESSION_BONUS)
+            else:
+                enemy_hexlabels = [enemy.hexlabel for enemy in
+                                   legion2.living_creatures]
+                if enemy_hexlabels:
+                    min_range = min((battlemap.range(creature.hexlabel,
+                                                     enemy_hexlabel)
+                                     for enemy_hexlabel in
+                                     enemy_hexlabels))
+                    penalty = min_range * self.bp.ATTACKER_DISTANCE_PENALTY
+                    score += penalty
+                    logging.info(creature, "ATTACKER_DISTANCE_PENALTY %s",
+                                 penalty)
 
-        # For each enemy, figure out the average damage we could do to it if
-        # everyone concentrated on hitting it, and if that's enough to kill it,
-        # give every creature a kill bonus.
-        # (This is not quite right because each creature can only hit one enemy
-        # (ignoring carries), but it's a start.)
-        kill_bonus = 0
-        for enemy in legion2.creatures:
-            total_mean_hits = 0
-            for creature in creatures:
-                if (enemy in creature.engaged_enemies or
-                   (not creature.engaged and enemy in
-                        creature.rangestrike_targets)):
-                    dice = creature.number_of_dice(enemy)
-                    strike_number = creature.strike_number(enemy)
-                    mean_hits = dice * (7. - strike_number) / 6
-                    total_mean_hits += mean_hits
-            if total_mean_hits >= enemy.hits_left:
-                kill_bonus += enemy.sort_value
+        battlehex = battlemap.hexes[creature.hexlabel]
+        terrain = battlehex.terrain
 
-        for creature in creatures:
-            can_rangestrike = False
-            engaged = creature.engaged_enemies
-            max_mean_hits = 0.0
-            total_mean_damage_taken = 0.0
-            engaged_with_rangestriker = False
-            # melee
-            for enemy in engaged:
-                # Damage we can do.
-                dice = creature.number_of_dice(enemy)
-                strike_number = creature.strike_number(enemy)
-                mean_hits = dice * (7. - strike_number) / 6
-                max_mean_hits = max(mean_hits, max_mean_hits)
-                # Damage we can take.
-                dice = enemy.number_of_dice(creature)
-                strike_number = enemy.strike_number(creature)
-                mean_hits = dice * (7. - strike_number) / 6
-                total_mean_damage_taken += mean_hits
-                if enemy.rangestrikes:
-                    engaged_with_rangestriker = True
-            # inbound rangestriking
-            for enemy in legion2.creatures:
-                if enemy not in engaged:
-                    if creature in enemy.potential_rangestrike_targets:
-                        dice = enemy.number_of_dice(creature)
-                        strike_number = enemy.strike_number(creature)
-                        mean_hits = dice * (7. - strike_number) / 6
-                        total_mean_damage_taken += mean_hits
-            probable_death = total_mean_damage_taken >= creature.hits_left
-
-            if engaged_with_rangestriker and not creature.rangestrikes:
-                score += self.bp.ENGAGE_RANGESTRIKER_BONUS
-                logging.info(creature, "ENGAGE_RANGESTRIKER_BONUS %s",
-                             self.bp.ENGAGE_RANGESTRIKER_BONUS)
-
-            # rangestriking
-            if not engaged:
-                targets = creature.rangestrike_targets
-                for enemy in targets:
-                    # Damage we can do
-                    dice = creature.number_of_dice(enemy)
-                    strike_number = creature.strike_number(enemy)
-                    mean_hits = dice * (7. - strike_number) / 6
-                    max_mean_hits = max(mean_hits, max_mean_hits)
-                    can_rangestrike = True
-            if can_rangestrike:
-                score += self.bp.RANGESTRIKE_BONUS
-                logging.info(creature, "RANGESTRIKE_BONUS %s",
-                             self.bp.RANGESTRIKE_BONUS)
-
-            # Don't encourage titans to charge early.
-            if (creature.name != "Titan" or game.battle_turn >= 4 or
-               len(legion) == 1):
-                if max_mean_hits:
-                    bonus = self.bp.HIT_BONUS * max_mean_hits
-                    score += bonus
-                    logging.info(creature, "HIT_BONUS %s", bonus)
-                if kill_bonus:
-                    bonus = self.bp.KILL_MULTIPLIER * kill_bonus
-                    score += bonus
-                    logging.info(creature, "KILL_BONUS %s", bonus)
-            if total_mean_damage_taken:
-                penalty = self.bp.DAMAGE_PENALTY * total_mean_damage_taken
+        # Make titans hang back early.
+        if (creature.is_titan and game.battle_turn < 4 and
+           terrain != "Tower"):
+            if legion == game.attacker_legion:
+                entrance = "ATTACKER"
+            else:
+                entrance = "DEFENDER"
+            distance = battlemap.range(creature.hexlabel, entrance,
+                                       allow_entrance=True) - 2
+            penalty = distance * self.bp.TITAN_FORWARD_PENALTY
+            if penalty:
                 score += penalty
-                logging.info(creature, "DAMAGE_PENALTY %s", penalty)
-            if probable_death:
-                penalty = (self.bp.DEATH_MULTIPLIER * probable_death *
-                           creature.sort_value)
+                logging.info(creature, "TITAN_FORWARD_PENALTY %s", penalty)
+
+        # Make defenders hang back early.
+        if (legion == game.defender_legion and game.battle_turn < 4 and
+           terrain != "Tower"):
+            entrance = "DEFENDER"
+            distance = battlemap.range(creature.hexlabel, entrance,
+                                       allow_entrance=True) - 2
+            penalty = distance * self.bp.DEFENDER_FORWARD_PENALTY
+            if penalty:
                 score += penalty
-                logging.info(creature, "DEATH_PENALTY %s", penalty)
-
-            # Attacker must attack to avoid time loss
-            # Don't encourage titans to charge early.
-            if legion == game.attacker_legion and (creature.name != "Titan"
-                                                   or game.battle_turn >= 4
-                                                   or len(legion) == 1):
-                if engaged or targets:
-                    score += self.bp.ATTACKER_AGGRESSION_BONUS
-                    logging.info(creature, "ATTACKER_AGGRESSION_BONUS %s",
-                                 self.bp.ATTACKER_AGGRESSION_BONUS)
-                else:
-                    enemy_hexlabels = [enemy.hexlabel for enemy in
-                                       legion2.living_creatures]
-                    if enemy_hexlabels:
-                        min_range = min((battlemap.range(creature.hexlabel,
-                                                         enemy_hexlabel)
-                                         for enemy_hexlabel in
-                                         enemy_hexlabels))
-                        penalty = min_range * self.bp.ATTACKER_DISTANCE_PENALTY
-                        score += penalty
-                        logging.info(creature, "ATTACKER_DISTANCE_PENALTY %s",
-                                     penalty)
-
-            battlehex = battlemap.hexes[creature.hexlabel]
-            terrain = battlehex.terrain
-
-            # Make titans hang back early.
-            if (creature.is_titan and game.battle_turn < 4 and
-               terrain != "Tower"):
-                if legion == game.attacker_legion:
-                    entrance = "ATTACKER"
+                logging.info(creature, "DEFENDER_FORWARD_PENALTY %s",
+                             penalty)
+
+        # terrain
+        if battlehex.elevation:
+            bonus = battlehex.elevation * self.bp.ELEVATION_BONUS
+            score += bonus
+            logging.info(creature, "ELEVATION_BONUS %s", bonus)
+        if terrain == "Bramble":
+            if creature.is_native(terrain):
+                score += self.bp.NATIVE_BRAMBLE_BONUS
+                logging.info(creature, "NATIVE_BRAMBLE_BONUS %s",
+                             self.bp.NATIVE_BRAMBLE_BONUS)
+            else:
+                score += self.bp.NON_NATIVE_BRAMBLE_PENALTY
+                logging.info(creature, "NON_NATIVE_BRAMBLE_PENALTY %s",
+                             self.bp.NON_NATIVE_BRAMBLE_PENALTY)
+        elif terrain == "Tower":
+            # XXX Hardcoded to default Tower map
+            logging.info("%s TOWER_BONUS", creature)
+            score += self.bp.TOWER_BONUS
+            if battlehex.elevation == 2:
+                if creature.is_titan:
+                    score += self.bp.TITAN_IN_CENTER_OF_TOWER_BONUS
+                    logging.info("%s TITAN_IN_CENTER_OF_TOWER_BONUS %s",
+                                 creature,
+                                 self.bp.TITAN_IN_CENTER_OF_TOWER_BONUS)
                 else:
-                    entrance = "DEFENDER"
-                distance = battlemap.range(creature.hexlabel, entrance,
-                                           allow_entrance=True) - 2
-                penalty = distance * self.bp.TITAN_FORWARD_PENALTY
-                if penalty:
-                    score += penalty
-                    logging.info(creature, "TITAN_FORWARD_PENALTY %s", penalty)
+                    score += self.bp.CENTER_OF_TOWER_BONUS
+                    logging.info("%s CENTER_OF_TOWER_BONUS %s",
+                                 creature, self.bp.CENTER_OF_TOWER_BONUS)
+            elif (legion == game.defender_legion and
+                  creature.name != "Titan" and battlehex.label in
+                  ["C3", "D3"]):
+                score += self.bp.FRONT_OF_TOWER_BONUS
+                logging.info("%s FRONT_OF_TOWER_BONUS %s",
+                             creature, self.bp.FRONT_OF_TOWER_BONUS)
+            elif (legion == game.defender_legion and
+                  creature.name != "Titan" and battlehex.label in
+                  ["C4", "E3"]):
+                score += self.bp.MIDDLE_OF_TOWER_BONUS
+                logging.info("%s MIDDLE_OF_TOWER_BONUS %s",
+                             creature, self.bp.MIDDLE_OF_TOWER_BONUS)
+        elif terrain == "Drift":
+            if not creature.is_native(terrain):
+                score += self.bp.NON_NATIVE_DRIFT_PENALTY
+                logging.info("%s NON_NATIVE_DRIFT_PENALTY %s",
+                             creature, self.bp.NON_NATIVE_DRIFT_PENALTY)
+        elif terrain == "Volcano":
+            score += self.bp.NATIVE_VOLCANO_BONUS
+            logging.info("%s NATIVE_VOLCANO_BONUS %s",
+                         creature, self.bp.NATIVE_VOLCANO_BONUS)
+
+        if "Slope" in battlehex.borders:
+            if creature.is_native("Slope"):
+                score += self.bp.NATIVE_SLOPE_BONUS
+                logging.info("%s NATIVE_SLOPE_BONUS %s",
+                             creature, self.bp.NATIVE_SLOPE_BONUS)
+            else:
+                score += self.bp.NON_NATIVE_SLOPE_PENALTY
+                logging.info("%s NON_NATIVE_SLOPE_PENALTY %s",
+                             creature, self.bp.NON_NATIVE_SLOPE_PENALTY)
+        if "Dune" in battlehex.borders:
+            if creature.is_native("Dune"):
+                score += self.bp.NATIVE_DUNE_BONUS
+                logging.info("%s NATIVE_DUNE_BONUS %s",
+                             creature, self.bp.NATIVE_DUNE_BONUS)
+            else:
+                score += self.bp.NON_NATIVE_DUNE_PENALTY
+                logging.info("%s NON_NATIVE_DUNE_PENALTY %s",
+                             creature, self.bp.NON_NATIVE_DUNE_PENALTY)
 
-            # Make defenders hang back early.
-            if (legion == game.defender_legion and game.battle_turn < 4 and
-               terrain != "Tower"):
-                entrance = "DEFENDER"
-                distance = battlemap.range(creature.hexlabel, entrance,
-                                           allow_entrance=True) - 2
-                penalty = distance * self.bp.DEFENDER_FORWARD_PENALTY
-                if penalty:
-                    score += penalty
-                    logging.info(creature, "DEFENDER_FORWARD_PENALTY %s",
-                                 penalty)
+        return score
+
+    def _battle_position_feature(self, role, creature):
+        """Return the feature of creature, in the legion with role, for
+        _battle_position_hash.  ("scored",) is prepended for creatures
+        being scored."""
+        return (role, creature.name, creature.hexlabel, creature.hits,
+                creature.power)
+
+    def _battle_position_hash(self, game, creatures):
+        """Return a Zobrist.CountedHash of everything _score_legion_move
+        looks at to score creatures: the battle map, turn, and phase, and
+        the name, hex, hits, and power of each creature in both battle
+        legions and of each of creatures.
+
+        Nothing identifies the game, so positions that come up in more than
+        one game share cache entries."""
+        battlemap = game.battlemap
+        position = Zobrist.CountedHash([
+            ("battlemap", battlemap.mterrain, battlemap.entry_side),
+            ("battle_turn", game.battle_turn),
+            ("battle_phase", str(game.battle_phase))])
+        roles = {}
+        for role, legion in [("attacker", game.attacker_legion),
+                             ("defender", game.defender_legion)]:
+            roles[legion.markerid] = role
+            for creature in legion.creatures:
+                position.add(self._battle_position_feature(role, creature))
+        for creature in creatures:
+            position.add(("scored",) + self._battle_position_feature(
+                roles.get(creature.legion.markerid), creature))
+        return position
+
+    def _score_legion_move(self, game, creatures):
+        """Return a score for creatures in their current hexlabels.
+
+        Scores are cached by battle position, since the same positions
+        come up again and again.
+        """
+        key = self._battle_position_hash(game, creatures).value
+        score = self.score_cache.get(key)
+        if score is None:
+            score = self._compute_legion_move_score(game, creatures)
+            self.score_cache.put(key, score)
+        return score
+
+    def _compute_legion_move_score(self, game, creatures):
+        """Return a score for creatures in their current hexlabels, without
+        looking in the cache."""
+        score = 0
+        legion = creatures[0].legion
+        legion2 = game.other_battle_legion(legion)
 
-            # terrain
-            if battlehex.elevation:
-                bonus = battlehex.elevation * self.bp.ELEVATION_BONUS
+        matrix = StrikeMatrix.StrikeMatrix(creatures, legion2.creatures)
+
+        # For each enemy, figure out the average damage we could do to it if
+        # everyone concentrated on hitting it, and if that's enough to kill it,
+        # give every creature a kill bonus.
+        # (This is not quite right because each creature can only hit one enemy
+        # (ignoring carries), but it's a start.)
+        kill_bonus = self._kill_bonus(legion2.creatures,
+                                      matrix.total_mean_hits())
+
+        all_max_mean_hits = matrix.max_mean_hits()
+        all_total_mean_damage_taken = matrix.total_mean_damage_taken()
+        for ii, creature in enumerate(creatures):
+            score += self._score_creature(game, creature, matrix, ii,
+                                          all_max_mean_hits[ii],
+                                          all_total_mean_damage_taken[ii])
+            if kill_bonus and self._may_charge(game, creature):
+                bonus = self.bp.KILL_MULTIPLIER * kill_bonus
                 score += bonus
-                logging.info(creature, "ELEVATION_BONUS %s", bonus)
-            if terrain == "Bramble":
-                if creature.is_native(terrain):
-                    score += self.bp.NATIVE_BRAMBLE_BONUS
-                    logging.info(creature, "NATIVE_BRAMBLE_BONUS %s",
-                                 self.bp.NATIVE_BRAMBLE_BONUS)
-                else:
-                    score += self.bp.NON_NATIVE_BRAMBLE_PENALTY
-                    logging.info(creature, "NON_NATIVE_BRAMBLE_PENALTY %s",
-                                 self.bp.NON_NATIVE_BRAMBLE_PENALTY)
-            elif terrain == "Tower":
-                # XXX Hardcoded to default Tower map
-                logging.info("%s TOWER_BONUS", creature)
-                score += self.bp.TOWER_BONUS
-                if battlehex.elevation == 2:
-                    if creature.is_titan:
-                        score += self.bp.TITAN_IN_CENTER_OF_TOWER_BONUS
-                        logging.info("%s TITAN_IN_CENTER_OF_TOWER_BONUS %s",
-                                     creature,
-                                     self.bp.TITAN_IN_CENTER_OF_TOWER_BONUS)
-                    else:
-                        score += self.bp.CENTER_OF_TOWER_BONUS
-                        logging.info("%s CENTER_OF_TOWER_BONUS %s",
-                                     creature, self.bp.CENTER_OF_TOWER_BONUS)
-                elif (legion == game.defender_legion and
-                      creature.name != "Titan" and battlehex.label in
-                      ["C3", "D3"]):
-                    score += self.bp.FRONT_OF_TOWER_BONUS
-                    logging.info("%s FRONT_OF_TOWER_BONUS %s",
-                                 creature, self.bp.FRONT_OF_TOWER_BONUS)
-                elif (legion == game.defender_legion and
-                      creature.name != "Titan" and battlehex.label in
-                      ["C4", "E3"]):
-                    score += self.bp.MIDDLE_OF_TOWER_BONUS
-                    logging.info("%s MIDDLE_OF_TOWER_BONUS %s",
-                                 creature, self.bp.MIDDLE_OF_TOWER_BONUS)
-            elif terrain == "Drift":
-                if not creature.is_native(terrain):
-                    score += self.bp.NON_NATIVE_DRIFT_PENALTY
-                    logging.info("%s NON_NATIVE_DRIFT_PENALTY %s",
-                                 creature, self.bp.NON_NATIVE_DRIFT_PENALTY)
-            elif terrain == "Volcano":
-                score += self.bp.NATIVE_VOLCANO_BONUS
-                logging.info("%s NATIVE_VOLCANO_BONUS %s",
-                             creature, self.bp.NATIVE_VOLCANO_BONUS)
-
-            if "Slope" in battlehex.borders:
-                if creature.is_native("Slope"):
-                    score += self.bp.NATIVE_SLOPE_BONUS
-                    logging.info("%s NATIVE_SLOPE_BONUS %s",
-                                 creature, self.bp.NATIVE_SLOPE_BONUS)
-                else:
-                    score += self.bp.NON_NATIVE_SLOPE_PENALTY
-                    logging.info("%s NON_NATIVE_SLOPE_PENALTY %s",
-                                 creature, self.bp.NON_NATIVE_SLOPE_PENALTY)
-            if "Dune" in battlehex.borders:
-                if creature.is_native("Dune"):
-                    score += self.bp.NATIVE_DUNE_BONUS
-                    logging.info("%s NATIVE_DUNE_BONUS %s",
-                                 creature, self.bp.NATIVE_DUNE_BONUS)
-                else:
-                    score += self.bp.NON_NATIVE_DUNE_PENALTY
-                    logging.info("%s NON_NATIVE_DUNE_PENALTY %s",
-                                 creature, self.bp.NON_NATIVE_DUNE_PENALTY)
+                logging.info(creature, "KILL_BONUS %s", bonus)
 
             # allies
-            num_adjacent_allies = 0
-            for neighbor in battlehex.neighbors.values():
-                for ally in legion.living_creatures:
-                    if ally.hexlabel == neighbor.label:
-                        num_adjacent_allies += 1
-            adjacent_allies_bonus = (num_adjacent_allies *
+            adjacent_allies_bonus = (self._num_adjacent_allies(game,
+                                                               creature) *
                                      self.bp.ADJACENT_ALLY_BONUS)
             if adjacent_allies_bonus:
                 score += adjacent_allies_bonus
@@ -1201,28 +1794,31 @@ class CleverBot(object):
                     return
 
         # Then do the ones that have to choose a target.
-        target_to_total_mean_hits = collections.defaultdict(float)
+        legion2 = game.other_battle_legion(legion)
+        matrix = StrikeMatrix.StrikeMatrix(legion.sorted_creatures,
+                                           legion2.creatures,
+                                           unstruck_only=True)
+        target_stats = []
+        for jj, (total_mean_hits, kill_probability) in enumerate(zip(
+                matrix.total_mean_hits(),
+                matrix.combined_kill_probabilities())):
+            if any(row[jj] for row in matrix.strikes):
+                target_stats.append((matrix.enemies[jj], total_mean_hits,
+                                     kill_probability))
         best_target = None
-        for striker in legion.sorted_creatures:
-            if striker.can_strike:
-                hexlabels = striker.find_target_hexlabels()
-                for hexlabel in hexlabels:
-                    target = game.creatures_in_battle_hex(hexlabel).pop()
-                    num_dice = striker.number_of_dice(target)
-                    strike_number = striker.strike_number(target)
-                    mean_hits = num_dice * (7. - strike_number) / 6
-                    target_to_total_mean_hits[target] += mean_hits
-        # First find the best target we can kill.
-        for target, total_mean_hits in target_to_total_mean_hits.items():
-            if total_mean_hits >= target.hits_left:
-                if (best_target is None or target.sort_value >
-                   best_target.sort_value):
+        # First find the target we can most profitably kill, if everyone
+        # who can hit it does.
+        best_value = 0
+        for target, total_mean_hits, kill_probability in target_stats:
+            if kill_probability >= KILL_PROBABILITY:
+                value = kill_probability * target.sort_value
+                if best_target is None or value > best_value:
                     best_target = target
+                    best_value = value
         # If we can't kill anything, go after the target we can hurt most.
         if best_target is None:
             max_total_mean_hits = 0
-            for target, total_mean_hits in \
-                    target_to_total_mean_hits.items():
+            for target, total_mean_hits, kill_probability in target_stats:
                 if total_mean_hits >= max_total_mean_hits:
                     best_target = target
                     max_total_mean_hits = total_mean_hits
@@ -1269,25 +1865,30 @@ class CleverBot(object):
         # If there's only one carry target, it's easy.
         if len(carry_targets) == 1:
             best_target = carry_targets[0]
-        # First find the best target we can kill.
+        # First find the best target we can kill.  Carries are hits that
+        # have already been rolled, so there is no luck involved.
         if best_target is None:
             for carry_target in carry_targets:
-                if carries >= target.hits_left:
+                if carries >= carry_target.hits_left:
                     if (best_target is None or carry_target.sort_value >
                        best_target.sort_value):
                         best_target = carry_target
-        # If we can't kill anything then go after the hardest target to hit.
+        # If we can't kill anything then wound the target where the carries
+        # most improve the odds of the creatures that have not struck yet
+        # killing it, or failing that the one with the fewest hits left.
         if best_target is None:
-            best_num_dice = None
-            best_strike_number = None
-            for carry_target in carry_targets:
-                num_dice2 = striker.number_of_dice(carry_target)
-                strike_number2 = striker.strike_number(carry_target)
-                if (best_target is None or num_dice2 < best_num_dice
-                   or strike_number2 > best_strike_number):
+            matrix = StrikeMatrix.StrikeMatrix(striker.legion.sorted_creatures,
+                                               carry_targets,
+                                               unstruck_only=True)
+            gains = [after - before for (after, before) in zip(
+                matrix.combined_kill_probabilities(carries),
+                matrix.combined_kill_probabilities())]
+            best_key = None
+            for carry_target, gain in zip(carry_targets, gains):
+                key = (gain, -carry_target.hits_left, carry_target.sort_value)
+                if best_key is None or key > best_key:
                     best_target = carry_target
-                    best_num_dice = num_dice2
-                    best_strike_number = strike_number2
+                    best_key = key
         def1 = self.user.callRemote("carry", game.name,
                                     best_target.name, best_target.hexlabel,
                                     carries)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+"""Evolve BotParams a generation at a time, off the server.
+
+Each generation is a fixed population of AIs, saved along with any new
+children before play starts, who play a batch of games against each other
+in parallel worker processes.  When the whole batch is done, its results
+and TrueSkill updates are saved in one transaction, so an interrupted run
+replays the unfinished generation with the same population.  Then the best
+AIs survive, and the rest are replaced by children bred from the survivors.
+"""
+
+
+import argparse
+import logging
+import multiprocessing
+import random
+
+from slugathon.ai import BotParams, Tournament
+from slugathon.net import Results, config
+from slugathon.util import Dice
+
+
+# AIs in each generation
+DEFAULT_POPULATION_SIZE = Results.GENERATION_SIZE
+
+# AIs that survive into the next generation
+DEFAULT_NUM_SURVIVORS = Results.GENERATION_SIZE // 2
+
+# Games played by each generation
+DEFAULT_GAMES_PER_GENERATION = 2 * Results.GENERATION_SIZE
+
+
+class Evolution(object):
+
+    """Runs generations of AI games, and breeds the next generation from
+    the winners of each.
+
+    The AIs are stored in results like any others, so the server can pick
+    them as opponents too.
+    """
+
+    def __init__(self, results, population_size, num_survivors,
+                 games_per_generation, min_players, max_players,
+                 ai_time_limit, num_workers,
+                 game_time_limit=Tournament.DEFAULT_GAME_TIME_LIMIT):
+        if not 2 <= num_survivors <= population_size:
+            raise AssertionError("need 2 to %d survivors" % population_size)
+        self.results = results
+        self.population_size = population_size
+        self.num_survivors = num_survivors
+        self.games_per_generation = games_per_generation
+        self.min_players = min_players
+        self.max_players = min(max_players, population_size)
+        self.ai_time_limit = ai_time_limit
+        self.num_workers = num_workers
+        self.game_time_limit = game_time_limit
+
+    def _initial_population(self):
+        """Return (player_ids, bps) for a first generation: the existing
+        AIs with the highest mu, and BotParams for new mutants of the
+        default AI to fill it out."""
+        player_data = [data for data in self.results.get_player_data()
+                       if data["class"] == "CleverBot"]
+        player_data.sort(key=lambda data: data["mu"], reverse=True)
+        player_ids = [data["player_id"] for data in
+                      player_data[:self.population_size]]
+        bps = [BotParams.default_bot_params.mutate_all_fields() for unused
+               in range(self.population_size - len(player_ids))]
+        return player_ids, bps
+
+    def _next_population(self, player_ids):
+        """Return (player_ids, bps) for the generation after player_ids:
+        the survivors with the highest conservative skill estimate, and
+        BotParams for their children."""
+        rankings = self.results.get_rankings(player_ids)
+        survivors = sorted(player_ids, key=lambda player_id:
+                           rankings[player_id].mu -
+                           3 * rankings[player_id].sigma,
+                           reverse=True)[:self.num_survivors]
+        logging.info("survivors %s", survivors)
+        bps = dict((player_id, BotParams.BotParams.fromstring(
+            self.results.get_player_info(player_id)))
+            for player_id in survivors)
+        children = []
+        while len(survivors) + len(children) < self.population_size:
+            parents = [(rankings[player_id].mu, player_id)
+                       for player_id in survivors]
+            tup1 = Dice.weighted_random_choice(parents)
+            parents.remove(tup1)
+            tup2 = Dice.weighted_random_choice(parents)
+            bp = bps[tup1[1]].cross(bps[tup2[1]]).mutate_random_field()
+            logging.info("bred %s from %s and %s", bp, tup1[1], tup2[1])
+            children.append(bp)
+        return survivors, children
+
+    def _schedule(self, generation, player_ids):
+        """Return a list of play_game arguments for one generation's games.
+
+        Each game takes the AIs who have the fewest games so far, so that
+        everyone plays about equally often.
+        """
+        player_infos = dict((player_id,
+                             self.results.get_player_info(player_id))
+                            for player_id in player_ids)
+        num_games = dict((player_id, 0) for player_id in player_ids)
+        game_args = []
+        for game_num in range(self.games_per_generation):
+            num_players = random.randint(self.min_players, self.max_players)
+            candidates = list(player_ids)
+            random.shuffle(candidates)
+            candidates.sort(key=lambda player_id: num_games[player_id])
+            players = []
+            for player_id in candidates[:num_players]:
+                num_games[player_id] += 1
+                players.append(("ai%d" % player_id, player_infos[player_id]))
+            game_name = "gen%d_%d" % (generation, game_num + 1)
+            game_args.append((game_name, players, self.ai_time_limit,
+                              self.game_time_limit))
+        return game_args
+
+    def run(self, num_generations):
+        """Run num_generations more generations, after the last one saved
+        in results."""
+        (generation, player_ids,
+         finished) = self.results.get_latest_generation()
+        if player_ids:
+            logging.info("resuming at generation %d, finished %s",
+                         generation, finished)
+        executor = Tournament.make_executor(self.num_workers)
+        try:
+            for unused in range(num_generations):
+                # Breed at the start of each generation rather than the end
+                # of the last, so that a resumed run breeds only once.
+                if finished:
+                    if player_ids:
+                        player_ids, bps = self._next_population(player_ids)
+                    else:
+                        player_ids, bps = self._initial_population()
+                    generation += 1
+                    player_ids = self.results.add_generation(generation,
+                                                             player_ids, bps)
+                # Otherwise the last run stopped during this generation,
+                # before saving its games, so play them again.
+                logging.info("generation %d population %s", generation,
+                             player_ids)
+                game_args = self._schedule(generation, player_ids)
+                games = [Tournament.result_game(result) for result in
+                         Tournament.play_games(game_args, executor,
+                                               self.num_workers)
+                         if result is not None]
+                logging.info("generation %d finished %d of %d games",
+                             generation, len(games), len(game_args))
+                self.results.save_games(games, generation)
+                finished = True
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+
+def add_arguments(parser):
+    parser.add_argument("--generations", type=int, default=10)
+    parser.add_argument("--population", type=int,
+                        default=DEFAULT_POPULATION_SIZE)
+    parser.add_argument("--survivors", type=int,
+                        default=DEFAULT_NUM_SURVIVORS)
+    parser.add_argument("--games-per-generation", type=int,
+                        default=DEFAULT_GAMES_PER_GENERATION)
+    parser.add_argument("--min-players", type=int, default=2)
+    parser.add_argument("--max-players", type=int, default=6)
+    parser.add_argument("--ai-time-limit", type=float,
+                        default=config.DEFAULT_AI_TIME_LIMIT)
+    parser.add_argument("--game-time-limit", type=float,
+                        default=Tournament.DEFAULT_GAME_TIME_LIMIT)
+    # Games to play at once, each in its own process
+    parser.add_argument("--workers", type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument("--db-path", type=str, default=Results.DB_PATH)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args, extras = parser.parse_known_args()
+    logging.basicConfig(level=logging.INFO)
+    results = Results.Results(args.db_path)
+    evolution = Evolution(results, args.population, args.survivors,
+                          args.games_per_generation, args.min_players,
+                          args.max_players, args.ai_time_limit, args.workers,
+                          args.game_time_limit)
+    evolution.run(args.generations)
+
+
+if __name__ == "__main__":
+    main()
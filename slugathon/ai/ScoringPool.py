@@ -0,0 +1,142 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+"""A pool of worker processes that share CleverBot's search for the best
+legion move in battle."""
+
+
+import logging
+import multiprocessing
+import time
+
+from slugathon.game import GameState
+
+
+# Seconds to wait for workers past the time limit before giving up
+GRACE_TIME = 1.0
+
+
+def snapshot_battle(game, legion, creatures):
+    """Return a picklable snapshot of the battle in game, with creatures,
+    a list of Creatures from legion.
+
+    The snapshot is (battle_state, markerid, creature_indexes), where
+    battle_state is a GameState.BattleState and creature_indexes picks out
+    creatures by their indexes into legion.creatures.
+    """
+    creature_indexes = []
+    for creature in creatures:
+        for ii, creature2 in enumerate(legion.creatures):
+            if creature2 is creature:
+                creature_indexes.append(ii)
+                break
+    return (GameState.snapshot_battle(game), legion.markerid,
+            tuple(creature_indexes))
+
+
+def restore_battle(snapshot):
+    """Return (game, creatures) rebuilt from snapshot_battle's snapshot."""
+    battle_state, markerid, creature_indexes = snapshot
+    game = GameState.restore_battle(battle_state)
+    legion = game.find_legion(markerid)
+    creatures = [legion.creatures[ii] for ii in creature_indexes]
+    return game, creatures
+
+
+# {(playername, bot_params): CleverBot} in each worker, so that workers
+# keep their score caches between searches
+_worker_bots = {}
+
+
+def _search_legion_moves(playername, bot_params, finish_time, snapshot,
+                         movesets):
+    """Run CleverBot._search_legion_moves in a worker process."""
+    # Imported here because CleverBot imports this module.
+    from slugathon.ai import CleverBot
+    key = (playername, bot_params)
+    bot = _worker_bots.get(key)
+    if bot is None:
+        bot = _worker_bots[key] = CleverBot.CleverBot(playername, 0,
+                                                      bot_params)
+    game, creatures = restore_battle(snapshot)
+    return bot._search_legion_moves(game, creatures, movesets, finish_time)
+
+
+class ScoringPool(object):
+
+    """Splits CleverBot's branch and bound search for the best legion move
+    across num_workers processes.
+
+    The moves of one creature are dealt out among the workers, and each
+    worker searches the legion moves that use its share, on a game
+    rebuilt from a snapshot of the battle.  Workers do not share their best
+    scores, so they prune less than one search would, but together they
+    cover the same legion moves.
+    """
+
+    def __init__(self, num_workers):
+        self.num_workers = num_workers
+        self.pool = self._make_pool()
+
+    def _make_pool(self):
+        # Workers are started fresh rather than forked, so they do not
+        # inherit the parent's reactor or open connections.
+        return multiprocessing.get_context("spawn").Pool(self.num_workers)
+
+    def shutdown(self):
+        """Stop the workers, without waiting for their searches."""
+        self.pool.terminate()
+        self.pool.join()
+
+    def search_legion_moves(self, bot, snapshot, movesets, finish_time):
+        """Return the same (best_legion_move, best_score, upper_bound,
+        nodes, pruned) as bot._search_legion_moves would for the game and
+        creatures restored from snapshot, a snapshot from snapshot_battle,
+        searched in parallel until finish_time.
+
+        If some workers have not finished GRACE_TIME seconds after that,
+        they are stopped, and the result merges only the workers that did
+        finish, with upper_bound None because nothing bounds the moves the
+        others did not search.  Raise TimeoutError if no worker finished.
+        """
+        # Deal out the moves of the creature with the most of them.
+        split = max(range(len(movesets)), key=lambda ii: len(movesets[ii]))
+        num_parts = min(self.num_workers, len(movesets[split]))
+        async_results = []
+        for part in range(num_parts):
+            movesets2 = list(movesets)
+            movesets2[split] = movesets[split][part::num_parts]
+            async_results.append(self.pool.apply_async(
+                _search_legion_moves, (bot.playername, bot.bp, finish_time,
+                                       snapshot, movesets2)))
+        results = []
+        for async_result in async_results:
+            async_result.wait(max(finish_time + GRACE_TIME - time.time(), 0))
+            if async_result.ready():
+                results.append(async_result.get())
+        if len(results) < num_parts:
+            # Running searches can't be cancelled, so replace the workers
+            # rather than leave them busy for the next search.
+            logging.info("%d of %d scoring workers timed out",
+                         num_parts - len(results), num_parts)
+            self.pool.terminate()
+            self.pool = self._make_pool()
+            if not results:
+                raise TimeoutError("scoring workers timed out")
+        for result in results:
+            logging.info("worker found %s score %s upper bound %s",
+                         *result[:3])
+        best_legion_move = None
+        best_score = max(result[1] for result in results)
+        for result in results:
+            if result[0] is not None and result[1] == best_score:
+                best_legion_move = result[0]
+                break
+        if len(results) < num_parts:
+            upper_bound = None
+        else:
+            upper_bound = max(result[2] for result in results)
+        nodes = sum(result[3] for result in results)
+        pruned = sum(result[4] for result in results)
+        return best_legion_move, best_score, upper_bound, nodes, pruned
@@ -0,0 +1,271 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+"""Expected damage between the creatures of two battle legions, for the AI."""
+
+
+from math import comb
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Largest number of dice in the precomputed tables.  Bigger strikes, which
+# only very large titans can make, are computed when needed.
+MAX_DICE = 20
+
+
+def _compute_at_least(num_dice, strike_number):
+    """Return a list of the probability of at least k hits with num_dice
+    dice at strike_number, indexed by k from 0 to num_dice + 1."""
+    sides = 7 - min(max(strike_number, 1), 7)
+    exact = [comb(num_dice, hits) * sides ** hits *
+             (6 - sides) ** (num_dice - hits) / 6. ** num_dice
+             for hits in range(num_dice + 1)]
+    at_least = [0.] * (num_dice + 2)
+    for hits in range(num_dice, -1, -1):
+        at_least[hits] = at_least[hits + 1] + exact[hits]
+    at_least[0] = 1.
+    return at_least
+
+
+def _compute_at_least_tables():
+    """Return a dict of strike_number: list, indexed by number of dice, of
+    lists of the probability of at least k hits."""
+    tables = {}
+    for strike_number in range(1, 7):
+        tables[strike_number] = [_compute_at_least(num_dice, strike_number)
+                                 for num_dice in range(MAX_DICE + 1)]
+    return tables
+
+
+_at_least_tables = _compute_at_least_tables()
+
+
+def hit_probabilities(num_dice, strike_number):
+    """Return a list of the probability of scoring at least k hits with
+    num_dice dice at strike_number, indexed by k from 0 to num_dice + 1.
+
+    Do not modify the returned list; it is shared.
+    """
+    strike_number = max(strike_number, 1)
+    if num_dice <= MAX_DICE and strike_number <= 6:
+        return _at_least_tables[strike_number][num_dice]
+    return _compute_at_least(num_dice, strike_number)
+
+
+def kill_probability(num_dice, strike_number, hits_left):
+    """Return the probability that num_dice dice at strike_number score at
+    least hits_left hits."""
+    if hits_left <= 0:
+        return 1.0
+    if num_dice < hits_left:
+        return 0.0
+    return hit_probabilities(num_dice, strike_number)[hits_left]
+
+
+def combined_kill_probability(strikes, hits_left):
+    """Return the probability that strikes, a list of (num_dice,
+    strike_number) tuples rolled separately, score at least hits_left hits
+    in total."""
+    if hits_left <= 0:
+        return 1.0
+    if len(strikes) == 1:
+        num_dice, strike_number = strikes[0]
+        return kill_probability(num_dice, strike_number, hits_left)
+    # distribution[k] is the chance of exactly k total hits so far, with
+    # everything at or above hits_left lumped together in the last slot.
+    distribution = [1.] + [0.] * hits_left
+    for num_dice, strike_number in strikes:
+        at_least = hit_probabilities(num_dice, strike_number)
+        new_distribution = [0.] * (hits_left + 1)
+        for total, prob in enumerate(distribution):
+            if not prob:
+                continue
+            if total == hits_left:
+                new_distribution[hits_left] += prob
+                continue
+            needed = hits_left - total
+            for hits in range(min(needed, num_dice + 1)):
+                new_distribution[total + hits] += prob * (at_least[hits] -
+                                                          at_least[hits + 1])
+            if needed <= num_dice:
+                new_distribution[hits_left] += prob * at_least[needed]
+        distribution = new_distribution
+    return distribution[hits_left]
+
+
+class StrikeMatrix(object):
+
+    """Dice, strike numbers, mean hits, and kill probabilities for every
+    creature in creatures striking every creature in enemies, and for every
+    enemy striking back, with all creatures in their current hexes.
+
+    Row i is creatures[i] and column j is enemies[j].  Pairs that cannot
+    strike have strikes[i][j] False, 0 dice, and 0 mean hits.  The numeric
+    matrices are numpy arrays if numpy is available, else lists of lists,
+    so index them as m[i][j].
+
+    If unstruck_only is True, creatures that have already struck this phase
+    get no outbound strikes.
+    """
+
+    def __init__(self, creatures, enemies, unstruck_only=False):
+        self.creatures = list(creatures)
+        self.enemies = list(enemies)
+        num_rows = len(self.creatures)
+        num_cols = len(self.enemies)
+        dice = [[0] * num_cols for unused in range(num_rows)]
+        strike_numbers = [[0] * num_cols for unused in range(num_rows)]
+        enemy_dice = [[0] * num_cols for unused in range(num_rows)]
+        enemy_strike_numbers = [[0] * num_cols for unused in range(num_rows)]
+        # [[bool]] of whether creatures[i] is engaged with enemies[j]
+        self.melee = [[False] * num_cols for unused in range(num_rows)]
+        # [[bool]] of whether creatures[i] can strike enemies[j]
+        self.strikes = [[False] * num_cols for unused in range(num_rows)]
+        # Membership in these sets is by identity, like the sets of
+        # creatures returned by Creature.
+        col = dict((id(enemy), jj) for jj, enemy in enumerate(self.enemies))
+        enemy_melee_targets = []
+        enemy_rangestrike_targets = []
+        for enemy in self.enemies:
+            enemy_melee_targets.append(set(map(id, enemy.engaged_enemies)))
+            enemy_rangestrike_targets.append(set(map(
+                id, enemy.potential_rangestrike_targets)))
+        for ii, creature in enumerate(self.creatures):
+            engaged = creature.engaged_enemies
+            for enemy in engaged:
+                jj = col.get(id(enemy))
+                if jj is not None:
+                    self.melee[ii][jj] = True
+            if not unstruck_only or not creature.struck:
+                if engaged:
+                    for enemy in engaged:
+                        jj = col.get(id(enemy))
+                        if jj is not None:
+                            self.strikes[ii][jj] = True
+                            dice[ii][jj] = creature.number_of_dice(enemy,
+                                                                   True)
+                            strike_numbers[ii][jj] = creature.strike_number(
+                                enemy, True)
+                else:
+                    for enemy in creature.rangestrike_targets:
+                        jj = col.get(id(enemy))
+                        if jj is not None:
+                            self.strikes[ii][jj] = True
+                            dice[ii][jj] = creature.number_of_dice(enemy,
+                                                                   False)
+                            strike_numbers[ii][jj] = creature.strike_number(
+                                enemy, False)
+            for jj, enemy in enumerate(self.enemies):
+                if not (self.melee[ii][jj] or
+                        id(creature) in enemy_rangestrike_targets[jj]):
+                    continue
+                if id(creature) in enemy_melee_targets[jj]:
+                    melee = True
+                elif id(creature) in enemy_rangestrike_targets[jj]:
+                    melee = False
+                else:
+                    # A dead creature is not struck.
+                    continue
+                enemy_dice[ii][jj] = enemy.number_of_dice(creature, melee)
+                enemy_strike_numbers[ii][jj] = enemy.strike_number(creature,
+                                                                   melee)
+        self.hits_left = [creature.hits_left for creature in self.creatures]
+        self.enemy_hits_left = [enemy.hits_left for enemy in self.enemies]
+        self._use_numpy = bool(numpy is not None and num_rows and num_cols)
+        if self._use_numpy:
+            self.dice = numpy.array(dice)
+            self.strike_numbers = numpy.array(strike_numbers)
+            self.enemy_dice = numpy.array(enemy_dice)
+            self.enemy_strike_numbers = numpy.array(enemy_strike_numbers)
+            self.mean_hits = self.dice * (7. - self.strike_numbers) / 6
+            self.mean_hits_taken = (self.enemy_dice *
+                                    (7. - self.enemy_strike_numbers) / 6)
+        else:
+            self.dice = dice
+            self.strike_numbers = strike_numbers
+            self.enemy_dice = enemy_dice
+            self.enemy_strike_numbers = enemy_strike_numbers
+            self.mean_hits = [[dice[ii][jj] * (7. - strike_numbers[ii][jj]) /
+                               6 for jj in range(num_cols)]
+                              for ii in range(num_rows)]
+            self.mean_hits_taken = [[enemy_dice[ii][jj] *
+                                     (7. - enemy_strike_numbers[ii][jj]) / 6
+                                     for jj in range(num_cols)]
+                                    for ii in range(num_rows)]
+        self._kill_probabilities = None
+
+    @property
+    def kill_probabilities(self):
+        """Return a matrix of the probability that creatures[i] kills
+        enemies[j] with one strike.  Computed on first use."""
+        if self._kill_probabilities is None:
+            rows = []
+            for ii in range(len(self.creatures)):
+                row = []
+                for jj in range(len(self.enemies)):
+                    if self.strikes[ii][jj]:
+                        row.append(kill_probability(
+                            int(self.dice[ii][jj]),
+                            int(self.strike_numbers[ii][jj]),
+                            self.enemy_hits_left[jj]))
+                    else:
+                        row.append(0.0)
+                rows.append(row)
+            if self._use_numpy:
+                rows = numpy.array(rows)
+            self._kill_probabilities = rows
+        return self._kill_probabilities
+
+    def combined_kill_probabilities(self, wounds=0):
+        """Return a list of the probability that each enemy dies if every
+        creature that can strike it does, after taking wounds more hits
+        first."""
+        result = []
+        for jj in range(len(self.enemies)):
+            strikes = [(int(self.dice[ii][jj]),
+                        int(self.strike_numbers[ii][jj]))
+                       for ii in range(len(self.creatures))
+                       if self.strikes[ii][jj]]
+            if strikes:
+                result.append(combined_kill_probability(
+                    strikes, self.enemy_hits_left[jj] - wounds))
+            else:
+                result.append(0.)
+        return result
+
+    def total_mean_hits(self):
+        """Return a list of the mean hits on each enemy if every creature
+        that can strike it does."""
+        if self._use_numpy:
+            return self.mean_hits.sum(axis=0).tolist()
+        totals = [0.] * len(self.enemies)
+        for row in self.mean_hits:
+            for jj, mean_hits in enumerate(row):
+                totals[jj] += mean_hits
+        return totals
+
+    def max_mean_hits(self):
+        """Return a list of the most mean hits each creature can do to a
+        single enemy."""
+        if self._use_numpy:
+            return self.mean_hits.max(axis=1).tolist()
+        return [max(row) if row else 0. for row in self.mean_hits]
+
+    def total_mean_damage_taken(self):
+        """Return a list of the mean hits each creature takes if every enemy
+        that can strike it does."""
+        if self._use_numpy:
+            # Sum in order, like the pure Python version; numpy sums long
+            # rows pairwise, which rounds differently.
+            return [sum(row) for row in self.mean_hits_taken.tolist()]
+        return [sum(row) for row in self.mean_hits_taken]
+
+    def targets(self, ii):
+        """Return a list of the enemies creatures[ii] can strike."""
+        return [enemy for jj, enemy in enumerate(self.enemies)
+                if self.strikes[ii][jj]]
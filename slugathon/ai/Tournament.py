@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+"""Play AI-only games inside one process, with no server process, network
+connections, or reactor, to train the AI faster.
+
+Each game has the usual Server, User, and AIClient objects, but they talk
+through LocalReferences instead of Perspective Broker, and everything that
+would wait on the reactor waits on a twisted.internet.task.Clock that is
+advanced as soon as nothing is left to do at the current time.  Games run
+in parallel in a pool of worker processes, and the results are saved from
+the parent process, since sqlite does not like several writers.
+"""
+
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import copy
+import logging
+import multiprocessing
+import os
+import random
+import time
+
+from twisted.internet import defer, task
+from twisted.python import log
+
+from slugathon.ai import AIClient, BotParams
+from slugathon.game import Game
+from slugathon.net import Server, User, Results, config
+
+
+# Wall-clock seconds a game may take before it is abandoned
+DEFAULT_GAME_TIME_LIMIT = 3600
+
+
+class LocalReference(object):
+
+    """Stands in for a pb.RemoteReference to an object in this process.
+
+    callRemote(name, *args) calls obj.<prefix><name>(*args) the next time
+    clock runs, with copies of args, and returns a Deferred that fires
+    with the result, just as it would over the network.
+    """
+
+    def __init__(self, obj, prefix, clock):
+        self.obj = obj
+        self.prefix = prefix
+        self.clock = clock
+
+    def callRemote(self, method_name, *args):
+        def1 = defer.Deferred()
+        method = getattr(self.obj, self.prefix + method_name)
+        self.clock.callLater(0, self._call, def1, method, copy.deepcopy(args))
+        return def1
+
+    def _call(self, def1, method, args):
+        defer.maybeDeferred(method, *args).chainDeferred(def1)
+
+
+class LocalServer(Server.Server):
+
+    """A Server for games played with LocalReferences.
+
+    Finished games are kept in finished_games instead of saved, for the
+    caller to save.
+    """
+
+    def __init__(self, clock):
+        Server.Server.__init__(self, True, None, None, None, clock=clock,
+                               setup_logging=False)
+        self.finished_games = []
+
+    def _finish_with_game(self, game):
+        game.remove_observer(self)
+        if game in self.games:
+            self.finished_games.append(game)
+            self.games.remove(game)
+
+
+class LocalAIClient(AIClient.AIClient):
+
+    """An AIClient that plays through LocalReferences.
+
+    Exiting just stops it from listening, rather than ending the process.
+    """
+
+    def __init__(self, playername, game_name, ai_time_limit,
+                 player_time_limit, num_players, bot_params, clock):
+        AIClient.AIClient.__init__(self, playername, "", None, None, 0,
+                                   game_name, None, ai_time_limit,
+                                   player_time_limit, False, num_players,
+                                   num_players, bot_params=bot_params)
+        self.clock = clock
+        self.exited = False
+
+    def remote_update(self, action, names):
+        if not self.exited:
+            AIClient.AIClient.remote_update(self, action, names)
+
+    def exit_unconditionally(self, returncode):
+        logging.info("%s exiting %s", self.playername, returncode)
+        self.exited = True
+        self.ai.shutdown()
+
+
+def play_game(game_name, players, ai_time_limit,
+              game_time_limit=DEFAULT_GAME_TIME_LIMIT):
+    """Play one game in this process and return its result, or None if it
+    did not finish within game_time_limit wall-clock seconds.
+
+    players is a list of (playername, player_info) for CleverBots, where
+    player_info is a BotParams string.
+
+    The result is (game_name, start_time, finish_time, players,
+    finish_order), where finish_order is a list of tuples of playernames,
+    like Game.finish_order.
+    """
+    # Deferred debugging saves a traceback for every Deferred, which is
+    # most of the time spent in a local game.
+    defer.setDebugging(False)
+    clock = task.Clock()
+    server = LocalServer(clock)
+    num_players = len(players)
+    (owner_name, owner_info) = players[0]
+    error = server.form_game(owner_name, game_name, num_players, num_players,
+                             ai_time_limit, ai_time_limit, "CleverBot",
+                             owner_info)
+    if error:
+        raise AssertionError(error)
+    for playername, player_info in players[1:]:
+        if not server.join_game(playername, game_name, "CleverBot",
+                                player_info):
+            raise AssertionError("%s could not join %s" %
+                                 (playername, game_name))
+    game = server.name_to_game(game_name)
+    for playername, player_info in players:
+        aiclient = LocalAIClient(playername, game_name, ai_time_limit,
+                                 ai_time_limit, num_players,
+                                 BotParams.BotParams.fromstring(player_info),
+                                 clock)
+        user = User.User(playername, server,
+                         LocalReference(aiclient, "remote_", clock))
+        aiclient.user = aiclient.ai.user = LocalReference(user,
+                                                          "perspective_",
+                                                          clock)
+        aiclient.add_game(game.info_tuple)
+    server.start_game(owner_name, game_name)
+
+    finish_time = time.time() + game_time_limit
+    while not server.finished_games:
+        calls = clock.getDelayedCalls()
+        if not calls:
+            logging.warning("game %s stalled", game_name)
+            return None
+        if time.time() > finish_time:
+            logging.warning("game %s timed out", game_name)
+            return None
+        next_time = min(call.getTime() for call in calls)
+        try:
+            clock.advance(max(next_time - clock.seconds(), 0))
+        except Exception:
+            # The reactor would log this and carry on, so do the same.
+            log.err()
+    finish_order = [tuple(player.name for player in tup)
+                    for tup in game.finish_order]
+    return (game_name, game.start_time, game.finish_time, players,
+            finish_order)
+
+
+def result_game(result):
+    """Return a finished Game, for Results.save_game, from a play_game
+    result."""
+    (game_name, start_time, finish_time, players, finish_order) = result
+    (owner_name, owner_info) = players[0]
+    game = Game.Game(game_name, owner_name, start_time, start_time,
+                     len(players), len(players), started=True,
+                     player_class="CleverBot", player_info=owner_info,
+                     finish_time=finish_time)
+    for playername, player_info in players[1:]:
+        game.add_player(playername, "CleverBot", player_info)
+    game.finish_order = [tuple(game.get_player_by_name(playername)
+                               for playername in tup)
+                         for tup in finish_order]
+    return game
+
+
+def make_executor(num_workers):
+    """Return a pool of num_workers processes for play_games, or None to
+    play games in this process."""
+    if num_workers <= 1:
+        return None
+    # Workers are started fresh rather than forked, so they do not
+    # inherit the parent's database connection.
+    return ProcessPoolExecutor(num_workers,
+                               mp_context=multiprocessing.get_context("spawn"))
+
+
+def play_games(game_args, executor=None, num_pending=1):
+    """Play a game for each tuple of play_game arguments in game_args, on
+    executor if it is not None, and yield each result as it finishes.
+
+    game_args may be an iterator; it is read only as games are started,
+    with up to num_pending games in play at once.
+    """
+    game_args = iter(game_args)
+    if executor is None:
+        for args in game_args:
+            yield play_game(*args)
+        return
+    futures = set()
+    for args in game_args:
+        futures.add(executor.submit(play_game, *args))
+        if len(futures) >= num_pending:
+            break
+    while futures:
+        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+            args = next(game_args, None)
+            if args is not None:
+                futures.add(executor.submit(play_game, *args))
+
+
+class Tournament(object):
+
+    """Plays num_games games among AIs from results, num_workers at a
+    time, and saves each result as it comes in.
+
+    Players are picked for each game the same way the server picks AIs,
+    so that the results can breed new AIs as the tournament goes on.
+    """
+
+    def __init__(self, results, num_games, min_players, max_players,
+                 ai_time_limit, num_workers,
+                 game_time_limit=DEFAULT_GAME_TIME_LIMIT):
+        self.results = results
+        self.num_games = num_games
+        self.min_players = min_players
+        self.max_players = max_players
+        self.ai_time_limit = ai_time_limit
+        self.num_workers = num_workers
+        self.game_time_limit = game_time_limit
+        self.games_started = 0
+        self.games_finished = 0
+        self.games_abandoned = 0
+
+    def _pick_players(self):
+        """Return a list of (playername, player_info) for a new game."""
+        num_players = random.randint(self.min_players, self.max_players)
+        player_ids = []
+        for unused in range(num_players):
+            player_id = self.results.get_weighted_random_player_id(
+                excludes=player_ids)
+            player_ids.append(player_id)
+        return [("ai%d" % player_id, self.results.get_player_info(player_id))
+                for player_id in player_ids]
+
+    def _next_game(self):
+        """Return the play_game arguments for the next game."""
+        self.games_started += 1
+        game_name = "tournament_%d_%d" % (os.getpid(), self.games_started)
+        return (game_name, self._pick_players(), self.ai_time_limit,
+                self.game_time_limit)
+
+    def _save(self, result):
+        if result is None:
+            self.games_abandoned += 1
+        else:
+            self.results.save_game(result_game(result))
+            self.games_finished += 1
+        logging.info("finished %d abandoned %d of %d games",
+                     self.games_finished, self.games_abandoned,
+                     self.num_games)
+
+    def _game_args(self):
+        while self.games_started < self.num_games:
+            yield self._next_game()
+
+    def run(self):
+        executor = make_executor(self.num_workers)
+        try:
+            for result in play_games(self._game_args(), executor,
+                                     self.num_workers):
+                self._save(result)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+
+def add_arguments(parser):
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--min-players", type=int, default=2)
+    parser.add_argument("--max-players", type=int, default=6)
+    parser.add_argument("--ai-time-limit", type=float,
+                        default=config.DEFAULT_AI_TIME_LIMIT)
+    parser.add_argument("--game-time-limit", type=float,
+                        default=DEFAULT_GAME_TIME_LIMIT)
+    # Games to play at once, each in its own process
+    parser.add_argument("--workers", type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument("--db-path", type=str, default=Results.DB_PATH)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args, extras = parser.parse_known_args()
+    logging.basicConfig(level=logging.INFO)
+    results = Results.Results(args.db_path)
+    tournament = Tournament(results, args.games, args.min_players,
+                            args.max_players, args.ai_time_limit,
+                            args.workers, args.game_time_limit)
+    tournament.run()
+
+
+if __name__ == "__main__":
+    main()
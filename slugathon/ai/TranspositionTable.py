@@ -0,0 +1,50 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+"""A bounded cache of position evaluations for the AI."""
+
+
+from collections import OrderedDict
+
+
+class TranspositionTable(object):
+
+    """Map position hashes to scores, dropping the least recently used
+    entry once there are more than size of them.
+
+    hits and misses count lookups that did and did not find a score.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def get(self, key):
+        """Return the score for key, or None if it's not cached."""
+        score = self._scores.get(key)
+        if score is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._scores.move_to_end(key)
+        return score
+
+    def put(self, key, score):
+        """Cache score for key."""
+        self._scores[key] = score
+        self._scores.move_to_end(key)
+        if len(self._scores) > self.size:
+            self._scores.popitem(last=False)
+
+    def clear(self):
+        self._scores.clear()
+
+    def __repr__(self):
+        return "TranspositionTable(%d/%d, hits=%d, misses=%d)" % (
+            len(self._scores), self.size, self.hits, self.misses)
@@ -5,91 +5,146 @@ __license__ = "GNU GPL v2"
 """Split prediction for the AI."""
 
 
-import copy
-import itertools
+from collections import Counter, defaultdict
+import logging
+import math
 
 from slugathon.game.Creature import Creature
 
 
+# Most hypotheses kept for each node in probabilistic mode
+MAX_HYPOTHESES = 100
+
+# Hypotheses less likely than this fraction of the total are pruned
+MIN_PROBABILITY = 0.0001
+
+# creature name: sort_value, filled in as needed
+_sort_values = {}
+
+# creature name: combat_value, filled in as needed
+_combat_values = {}
+
+
+def sort_value(creature_name):
+    """Return Creature.sort_value for creature_name."""
+    value = _sort_values.get(creature_name)
+    if value is None:
+        value = _sort_values[creature_name] = Creature(
+            creature_name).sort_value
+    return value
+
+
+def combat_value(creature_name):
+    """Return Creature.combat_value for creature_name."""
+    value = _combat_values.get(creature_name)
+    if value is None:
+        value = _combat_values[creature_name] = Creature(
+            creature_name).combat_value
+    return value
+
+
+def creature_sort_key(creature_name):
+    """Sort by sort_value descending, then by name."""
+    return (-sort_value(creature_name), creature_name)
+
+
 def superset(big, little):
-    """Return True if list big is a superset of list little."""
-    for el in little:
-        if big.count(el) < little.count(el):
+    """Return True if Counter big contains at least as many of each
+    creature as Counter little."""
+    for name, count in little.items():
+        if big[name] < count:
             return False
     return True
 
 
-def subtract_lists(big, little):
-    """Return the elements of big, minus the elements of little.
+def subtract_counts(big, little):
+    """Return Counter big minus Counter little.
 
     If big is not a superset of little, raise an exception.
     """
     assert superset(big, little)
-    li = big[:]
-    for el in little:
-        li.remove(el)
-    return li
+    return big - little
 
 
-def num_creature(li, creature_name):
-    """Return the number of elements of the list with .name creature_name."""
-    count = 0
-    for ci in li:
-        if ci.name == creature_name:
-            count += 1
-    return count
+def min_count(counts_list, name):
+    """Return the minimum number of times name appears in any of the
+    Counters in the list."""
+    return min(counts[name] for counts in counts_list)
 
 
-def get_creature_info(li, creature_name):
-    """Return the first CreatureInfo that matches the passed name.
+def max_count(counts_list, name):
+    """Return the maximum number of times name appears in any of the
+    Counters in the list."""
+    return max(counts[name] for counts in counts_list)
 
-    Return None if no matching CreatureInfo is found.
-    """
-    for ci in li:
-        if ci.name == creature_name:
-            return ci
-    return None
 
+def sub_counts(counts, size):
+    """Yield each distinct Counter of size creatures drawn from Counter
+    counts, once each."""
+    names = sorted(counts, key=creature_sort_key)
+    # Number of creatures from names[ii] onward
+    available = [0] * (len(names) + 1)
+    for ii in range(len(names) - 1, -1, -1):
+        available[ii] = available[ii + 1] + counts[names[ii]]
 
-def get_creature_names(li):
-    """Return .name for each element in the list."""
-    return [ci.name for ci in li]
+    def _sub_counts(ii, size):
+        if size == 0:
+            yield Counter()
+            return
+        if available[ii] < size:
+            return
+        name = names[ii]
+        for num in range(min(counts[name], size), -1, -1):
+            for rest in _sub_counts(ii + 1, size - num):
+                if num:
+                    rest[name] = num
+                yield rest
 
+    return _sub_counts(0, size)
 
-def remove_last_uncertain_creature(li):
-    """Remove the last uncertain creature from the list.
 
-    Raise if there are no uncertain creatures.
-    """
-    try:
-        li.reverse()
-        for ii, ci in enumerate(li):
-            if not ci.certain:
-                del li[ii]    # li.remove(ci) can remove the wrong one
-                return
-    finally:
-        li.reverse()
-    raise ValueError("No uncertain creatures")
+def expand(counts):
+    """Return a list of names from a Counter, in creature sort order."""
+    return sorted(counts.elements(), key=creature_sort_key)
 
 
-def min_count(lili, name):
-    """Return the minimum number of times name appears in any of the lists
-    contained in the list of lists."""
-    return min([li.count(name) for li in lili])
+def counts_key(counts):
+    """Return a hashable key for Counter counts."""
+    return tuple(sorted((+counts).items()))
 
 
-def max_count(lili, name):
-    """Return the maximum number of times name appears in any of the lists
-    contained in the list of lists."""
-    return max([li.count(name) for li in lili])
+def multiplicity(counts, sub):
+    """Return the number of ways to pick the creatures in Counter sub out
+    of the creatures in Counter counts, telling apart creatures with the
+    same name."""
+    result = 1
+    for name, num in sub.items():
+        result *= math.comb(counts[name], num)
+    return result
 
 
-class CreatureInfo(Creature):
+def most_likely(weights):
+    """Return a hypotheses dict of the most likely keys in dict weights.
 
-    """A Creature with some extra attributes for split prediction."""
+    At most MAX_HYPOTHESES keys are kept, and none below MIN_PROBABILITY
+    of the total weight, to bound memory.
+    """
+    threshold = MIN_PROBABILITY * sum(weights.values())
+    keys = sorted(weights, key=lambda key: (-weights[key], key))
+    return dict((key, 1.0) for key in keys[:MAX_HYPOTHESES]
+                if weights[key] >= threshold)
+
+
+class CreatureInfo(object):
+
+    """A creature name with some extra attributes for split prediction.
+
+    Nodes keep counts rather than CreatureInfo objects, so these are only
+    used to show and build Nodes.
+    """
 
     def __init__(self, name, certain, at_split):
-        Creature.__init__(self, name)
+        self.name = name
         self.certain = certain
         self.at_split = at_split
 
@@ -101,24 +156,51 @@ class CreatureInfo(Creature):
             st += "*"
         return st
 
-    def __hash__(self):
-        """Two CreatureInfo objects match if the names match."""
-        return self.name
+    @property
+    def sort_value(self):
+        return sort_value(self.name)
 
     def sort_key(self):
         """Sort by sort_value descending, then by name."""
-        return (-self.sort_value, self.name)
+        return creature_sort_key(self.name)
 
 
 class Node(object):
 
-    """A view of a Legion at a point in time."""
+    """A view of a Legion at a point in time.
+
+    Creatures are kept as Counters of creature names, in three disjoint
+    groups: certain and uncertain creatures that were there when the
+    legion split off, and creatures added since, which are always certain.
+
+    In probabilistic mode, a node also keeps hypotheses: a dict of every
+    likely key (see counts_key) for its contents when it was created, to
+    a weight for what was revealed before its children were forgotten.
+    Reveals drop the hypotheses that do not fit, and adds and removes are
+    kept in two more Counters, so current contents are a hypothesis plus
+    added minus lost.  A split_table ties each parent hypothesis to the
+    children's, with the chance of that split, so that a reveal in one
+    legion changes the odds for its relatives.
+    """
 
     def __init__(self, markerid, turn_created, creatures, parent):
         self.markerid = markerid     # Not unique!
         self.turn_created = turn_created
-        self.creatures = creatures   # list of CreatureInfo
-        self.removed = []            # list of CreatureInfo, only if at_split
+        self.certain = Counter()     # certain, at_split
+        self.uncertain = Counter()   # uncertain, at_split
+        self.after_split = Counter()  # certain, added after the split
+        self.removed = Counter()     # removed, only if at_split
+        self.added = Counter()       # all added since creation
+        self.lost = Counter()        # all removed since creation
+        self.hypotheses = None       # None unless probabilistic
+        self.detached = False        # True if hypotheses ignore the parent
+        for ci in creatures:
+            if not ci.certain:
+                self.uncertain[ci.name] += 1
+            elif ci.at_split:
+                self.certain[ci.name] += 1
+            else:
+                self.after_split[ci.name] += 1
         self.parent = parent
         self.clear_children()
 
@@ -129,6 +211,9 @@ class Node(object):
         self.child1 = None     # child1 is the presumed "better" legion
         self.child2 = None
         self.turn_split = -1
+        self.split_inputs = None  # what the children were predicted from
+        # (key, child1 key, child2 key, probability) in probabilistic mode
+        self.split_table = None
 
     @property
     def _full_name(self):
@@ -137,18 +222,39 @@ class Node(object):
 
     def __repr__(self):
         """Show a string with both current and removed creatures."""
-        self.creatures.sort(key=CreatureInfo.sort_key)
         st = self._full_name + ":"
         for ci in self.creatures:
             st += " " + str(ci)
-        for ci in self.removed:
-            st += " " + str(ci) + "-"
+        for name in expand(self.removed):
+            st += " " + name + "-"
         return st
 
     def sort_key(self):
         """Sort by turn_created then by markerid."""
         return (self.turn_created, self.markerid)
 
+    @property
+    def creatures(self):
+        """Return a list of CreatureInfo, in creature sort order."""
+        cil = ([CreatureInfo(name, True, True) for name in
+                self.certain.elements()] +
+               [CreatureInfo(name, False, True) for name in
+                self.uncertain.elements()] +
+               [CreatureInfo(name, True, False) for name in
+                self.after_split.elements()])
+        cil.sort(key=CreatureInfo.sort_key)
+        return cil
+
+    @property
+    def counts(self):
+        """Return a Counter of all creature names."""
+        return self.certain + self.uncertain + self.after_split
+
+    @property
+    def certain_counts(self):
+        """Return a Counter of certain creature names."""
+        return self.certain + self.after_split
+
     @property
     def certain_creatures(self):
         """Return list of CreatureInfo where certain is true."""
@@ -157,20 +263,17 @@ class Node(object):
     @property
     def num_certain_creatures(self):
         """Return number of certain creatures."""
-        return len(self.certain_creatures)
+        return len(self) - self.num_uncertain_creatures
 
     @property
     def num_uncertain_creatures(self):
         """Return number of uncertain creatures."""
-        return len(self) - self.num_certain_creatures
+        return sum(self.uncertain.values())
 
     @property
     def all_certain(self):
         """Return True if all creatures are certain."""
-        for ci in self.creatures:
-            if not ci.certain:
-                return False
-        return True
+        return not self.num_uncertain_creatures
 
     @property
     def has_split(self):
@@ -199,17 +302,10 @@ class Node(object):
         return True
 
     @property
-    def after_split_creatures(self):
-        """Return list of CreatureInfo where at_split is false."""
-        return [ci for ci in self.creatures if not ci.at_split]
-
-    @property
-    def certain_at_split_or_removed_creatures(self):
-        """Return list of CreatureInfo where both certain and at_split are
-        true, plus removed creatures."""
-        alive = [ci for ci in self.creatures if ci.certain and ci.at_split]
-        dead = self.removed[:]
-        return alive + dead
+    def certain_at_split_or_removed(self):
+        """Return a Counter of creatures that were certainly here at the
+        split, including removed ones."""
+        return self.certain + self.removed
 
     @property
     def other_child_markerid(self):
@@ -221,82 +317,254 @@ class Node(object):
         return None
 
     def __len__(self):
-        return len(self.creatures)
+        return (sum(self.certain.values()) + sum(self.uncertain.values()) +
+                sum(self.after_split.values()))
 
     @property
     def creature_names(self):
         """Return this node's creatures' names, in sorted order."""
-        return sorted((creature.name for creature in self.creatures))
+        return sorted(self.counts.elements())
 
     def reveal_creatures(self, cnl):
         """Reveal all creatures in the creature name list as certain.
 
         Return True iff new information was sent to this legion's parent.
         """
-        if ((not cnl) or
-           (superset(get_creature_names(self.certain_creatures), cnl)
-                and (self.all_descendents_certain))):
-            return False
+        revealed = Counter(cnl)
+        consistent = self._observe(revealed)
+        told_parent = self._reveal(revealed)
+        if not consistent:
+            self._restart_hypotheses()
+        return told_parent
 
-        cil = [CreatureInfo(name, True, True) for name in cnl]
+    def _reveal(self, revealed):
+        """Reveal all creatures in Counter revealed as certain.
 
-        # Use a copy rather than the original so we can remove
-        # creatures as we check for multiples.
-        dupe = copy.deepcopy(cil)
+        Return True iff new information was sent to this legion's parent.
+        """
+        if ((not revealed) or
+           (superset(self.certain_counts, revealed) and
+                self.all_descendents_certain)):
+            return False
 
         # Confirm that all creatures that were certain still fit
         # along with the revealed creatures.
-        count = len(dupe)
-        for ci in self.certain_creatures:
-            if ci in dupe:
-                dupe.remove(ci)
-            else:
-                count += 1
-
+        count = sum((self.certain_counts | revealed).values())
         assert len(self) >= count, \
             "Certainty error in reveal_creatures count=%d height=%d" \
             % (count, len(self))
 
-        # Then mark passed creatures as certain and then
+        # Then add any missing revealed creatures as certain, and
         # communicate this to the parent, to adjust other legions.
-
-        dupe = copy.deepcopy(cil)
-        count = 0
-        for ci in dupe:
-            ci.certain = True
-            ci.at_split = True   # If not at_split, would be certain.
-            if num_creature(self.creatures, ci.name) < num_creature(dupe,
-                                                                    ci.name):
-                self.creatures.append(ci)
-                count += 1
-
-        # Ensure that the creatures in cnl are now marked as certain
-        dupe = copy.deepcopy(cil)
-        for ci in self.certain_creatures:
-            if ci in dupe:
-                dupe.remove(ci)
-        for ci in dupe:
-            for ci2 in self.creatures:
-                if not ci2.certain and ci2.name == ci.name:
-                    ci2.certain = True
-                    break
-
-        # Need to remove count uncertain creatures.
-        for unused in range(count):
-            remove_last_uncertain_creature(self.creatures)
+        counts = self.counts
+        added = 0
+        for name, num in revealed.items():
+            if counts[name] < num:
+                # If not at_split, would be certain.
+                self.certain[name] += num - counts[name]
+                added += num - counts[name]
+
+        # Ensure that the revealed creatures are now marked as certain.
+        certain_counts = self.certain_counts
+        for name, num in revealed.items():
+            num_to_mark = min(num - certain_counts[name], self.uncertain[name])
+            if num_to_mark > 0:
+                self.uncertain[name] -= num_to_mark
+                self.certain[name] += num_to_mark
+        self.uncertain += Counter()
+
+        # Need to remove the least valuable uncertain creatures to make
+        # room for the added ones.
+        for unused in range(added):
+            if not self.uncertain:
+                raise ValueError("No uncertain creatures")
+            name = max(self.uncertain, key=creature_sort_key)
+            self.uncertain[name] -= 1
+            self.uncertain += Counter()
         if self.parent is None:
             return False
         else:
             self.parent.update_child_contents()
             return True
 
+    def _current(self, key):
+        """Return a Counter of this node's current contents, if its contents
+        when created were hypothesis key."""
+        return Counter(dict(key)) + self.added - self.lost
+
+    def _observe(self, revealed):
+        """Drop the hypotheses that do not contain Counter revealed.
+
+        Return False if no hypothesis would be left.
+        """
+        if self.hypotheses is None or not revealed:
+            return True
+        hypotheses = dict((key, weight) for key, weight in
+                          self.hypotheses.items()
+                          if superset(self._current(key), revealed))
+        if not hypotheses:
+            return False
+        self.hypotheses = hypotheses
+        return True
+
+    def _restart_hypotheses(self):
+        """Replace this node's hypotheses with its predicted contents, and
+        cut it loose from its relatives' hypotheses.
+
+        Used when the hypotheses cannot explain what was revealed, which
+        can only happen if pruning dropped the right one.
+        """
+        logging.info("restarting hypotheses for %s", self._full_name)
+        self.hypotheses = {counts_key(self.certain + self.uncertain +
+                                      self.removed): 1.0}
+        self.detached = True
+        for child in self.children:
+            child.detached = True
+        self.split_table = None
+
+    @staticmethod
+    def _child_likelihood(child, key, likelihoods):
+        """Return the likelihood of child hypothesis key."""
+        if child.detached:
+            return 1.0
+        return likelihoods[child].get(key, 0.0)
+
+    def _likelihoods(self, likelihoods):
+        """Fill in dict likelihoods with node: {key: likelihood} for this
+        node and its descendents, where likelihood is how well hypothesis
+        key explains everything revealed in the subtree."""
+        for child in self.children:
+            child._likelihoods(likelihoods)
+        if self.split_table is None:
+            likelihoods[self] = dict(self.hypotheses)
+            return
+        sums = defaultdict(float)
+        for key, keep_key, split_key, prob in self.split_table:
+            sums[key] += (prob *
+                          self._child_likelihood(self.child1, keep_key,
+                                                 likelihoods) *
+                          self._child_likelihood(self.child2, split_key,
+                                                 likelihoods))
+        likelihoods[self] = dict((key, weight * sums[key]) for key, weight in
+                                 self.hypotheses.items())
+
+    def hypothesis_weights(self):
+        """Return a dict of this node's hypothesis keys to their
+        probabilities given everything revealed so far.
+
+        Return an empty dict if not in probabilistic mode, or if the
+        hypotheses contradict each other.
+        """
+        if self.hypotheses is None:
+            return {}
+        path = [self]
+        while path[-1].parent is not None and not path[-1].detached:
+            path.append(path[-1].parent)
+        path.reverse()
+        likelihoods = {}
+        path[0]._likelihoods(likelihoods)
+        # Pass the odds down from the top, using each sibling's likelihoods.
+        priors = dict.fromkeys(path[0].hypotheses, 1.0)
+        for parent, node in zip(path, path[1:]):
+            node_priors = defaultdict(float)
+            for key, keep_key, split_key, prob in parent.split_table:
+                if node is parent.child1:
+                    own_key, sibling, sibling_key = (keep_key, parent.child2,
+                                                     split_key)
+                else:
+                    own_key, sibling, sibling_key = (split_key, parent.child1,
+                                                     keep_key)
+                node_priors[own_key] += (
+                    priors.get(key, 0.0) * parent.hypotheses.get(key, 0.0) *
+                    prob * self._child_likelihood(sibling, sibling_key,
+                                                  likelihoods))
+            priors = node_priors
+        weights = dict((key, priors.get(key, 0.0) * likelihood) for
+                       key, likelihood in likelihoods[self].items())
+        total = sum(weights.values())
+        if not total:
+            return {}
+        return dict((key, weight / total) for key, weight in weights.items()
+                    if weight)
+
+    def _split_hypotheses(self, child_size, weights):
+        """Fill in the children's hypotheses and this node's split_table,
+        from dict weights of this node's hypotheses before the split.
+
+        Every way to split off child_size of the creatures is equally
+        likely, except that a turn 1 splitoff has exactly one lord.
+        """
+        if not weights:
+            for child in self.children:
+                child._restart_hypotheses()
+            return
+        split_table = []
+        keep_weights = defaultdict(float)
+        split_weights = defaultdict(float)
+        for key, weight in weights.items():
+            current = self._current(key)
+            size = sum(current.values())
+            splits = []
+            for splitoff in sub_counts(current, child_size):
+                if size != 8 or splitoff["Titan"] + splitoff["Angel"] == 1:
+                    splits.append((splitoff,
+                                   multiplicity(current, splitoff)))
+            total = sum(num for splitoff, num in splits)
+            for splitoff, num in splits:
+                prob = num / total
+                keep_key = counts_key(current - splitoff)
+                split_key = counts_key(splitoff)
+                split_table.append((key, keep_key, split_key, prob))
+                keep_weights[keep_key] += weight * prob
+                split_weights[split_key] += weight * prob
+        self.child1.hypotheses = most_likely(keep_weights)
+        self.child2.hypotheses = most_likely(split_weights)
+        self.split_table = [entry for entry in split_table
+                            if entry[1] in self.child1.hypotheses and
+                            entry[2] in self.child2.hypotheses]
+
+    def _fold_children(self):
+        """Keep what this node's children revealed, added, and lost, before
+        they are forgotten."""
+        likelihoods = {}
+        self._likelihoods(likelihoods)
+        for child in self.children:
+            self.added += child.added
+            self.lost += child.lost
+        weights = likelihoods[self]
+        top = max(weights.values()) if weights else 0.0
+        if top:
+            self.hypotheses = dict((key, weight / top) for key, weight in
+                                   weights.items() if weight)
+        else:
+            self._restart_hypotheses()
+
+    def get_distribution(self):
+        """Return a list of (creature names, probability) tuples for this
+        legion's possible current contents, most likely first.
+
+        If not in probabilistic mode, return the predicted contents.
+        """
+        weights = self.hypothesis_weights()
+        if not weights:
+            return [(tuple(self.creature_names), 1.0)]
+        distribution = [(tuple(sorted(self._current(key).elements())),
+                         weight) for key, weight in weights.items()]
+        distribution.sort(key=lambda tup: (-tup[1], tup[0]))
+        return distribution
+
+    def expected_combat_value(self):
+        """Return the total combat_value of this legion's creatures,
+        averaged over its possible contents."""
+        return sum(prob * sum(combat_value(name) for name in names)
+                   for names, prob in self.get_distribution())
+
     def update_child_contents(self):
         """Tell this parent legion the updated contents of its children."""
-        names = []
+        counts = Counter()
         for child in self.children:
-            names.extend(get_creature_names(
-                         child.certain_at_split_or_removed_creatures))
-        told_parent = self.reveal_creatures(names)
+            counts += child.certain_at_split_or_removed
+        told_parent = self._reveal(counts)
         if not told_parent:
             self.split(self.child_size2, self.other_child_markerid)
 
@@ -305,72 +573,73 @@ class Node(object):
         """Return True if this Node is a valid turn 1 splitoff."""
         if len(self) != 4:
             return False
-        names = self.creature_names
-        return (names.count("Titan") + names.count("Angel") == 1)
+        counts = self.counts
+        return (counts["Titan"] + counts["Angel"] == 1)
 
     def _find_all_possible_splits(self, child_size, known_keep, known_split):
-        """Return a list of lists of all legal combinations of splitoff names.
+        """Return a list of Counters of all legal combinations of splitoff
+        names.
 
         Raise if the combination of known_keep and known_split contains
         uncertain creatures.
         """
         # Sanity checks
-        assert child_size >= len(known_split), \
+        assert child_size >= sum(known_split.values()), \
             "More known splitoffs than splitoffs"
         assert len(self) <= 8
+        counts = self.counts
         if len(self) == 8:
             assert child_size == 4
-            assert "Titan" in get_creature_names(self.creatures)
-            assert "Angel" in get_creature_names(self.creatures)
+            assert "Titan" in counts
+            assert "Angel" in counts
 
         known_combo = known_split + known_keep
-        certain = get_creature_names(self.certain_creatures)
-        assert superset(certain, known_combo), \
+        assert superset(self.certain_counts, known_combo), \
             "known_combo contains uncertain creatures"
 
-        unknowns = get_creature_names(self.creatures)
-        for name in known_combo:
-            unknowns.remove(name)
+        unknowns = counts - known_combo
+        num_unknowns_to_split = child_size - sum(known_split.values())
 
-        num_unknowns_to_split = child_size - len(known_split)
-
-        unknown_combos = itertools.combinations(unknowns,
-                                                num_unknowns_to_split)
-        possible_splits_set = set()
-        for combo in unknown_combos:
-            pos = tuple(known_split + list(combo))
-            if len(self) != 8:
-                possible_splits_set.add(pos)
-            else:
-                cil = [CreatureInfo(name, False, True) for name in pos]
-                pos_node = Node(self.markerid, -1, cil, self)
-                if pos_node.is_legal_initial_splitoff:
-                    possible_splits_set.add(pos)
-        possible_splits = [list(pos2) for pos2 in possible_splits_set]
-        return possible_splits
+        combos = []
+        for combo in sub_counts(unknowns, num_unknowns_to_split):
+            # A turn 1 splitoff has exactly one lord.
+            if (len(self) != 8 or combo["Titan"] + combo["Angel"] +
+                    known_split["Titan"] + known_split["Angel"] == 1):
+                combos.append(combo)
+        # Keep ties in _choose_creatures_to_split_out deterministic.
+        combos.sort(key=expand)
+        return [known_split + combo for combo in combos]
 
     def _choose_creatures_to_split_out(self, possible_splits):
-        """Decide how to split this legion, and return a list of creature
-        names to remove.
+        """Decide how to split this legion, and return a Counter of
+        creature names to remove.
 
-        Return empty list on error.
+        Return an empty Counter on error.
         """
-        maximize = (2 * len(possible_splits[0]) > len(self))
+        maximize = (2 * sum(possible_splits[0].values()) > len(self))
 
         best_sort_value = None
-        creatures_to_remove = []
-        for li in possible_splits:
-            total_sort_value = 0
-            for name in li:
-                creature = Creature(name)
-                total_sort_value += creature.sort_value
+        creatures_to_remove = Counter()
+        for counts in possible_splits:
+            total_sort_value = sum(sort_value(name) * num
+                                   for name, num in counts.items())
             if ((best_sort_value is None) or
                (maximize and total_sort_value > best_sort_value) or
                (not maximize and total_sort_value < best_sort_value)):
                 best_sort_value = total_sort_value
-                creatures_to_remove = li
+                creatures_to_remove = counts
         return creatures_to_remove
 
+    def _get_split_inputs(self, child_size):
+        """Return everything that split reads from this node and its
+        children, to tell whether re-predicting would change anything."""
+        inputs = [child_size, Counter(self.certain), Counter(self.uncertain),
+                  Counter(self.after_split)]
+        for child in self.children:
+            inputs.append(Counter(child.certain))
+            inputs.append(Counter(child.removed))
+        return inputs
+
     def _split_children(self):
         """Recursively split this node's children."""
         for child in self.children:
@@ -386,106 +655,98 @@ class Node(object):
         else:
             self.turn_split = turn   # New split
 
+        # If nothing this split reads has changed since the last
+        # prediction, the prediction would not change either, so only
+        # check further down the tree.  Otherwise every reveal would
+        # re-predict every split in the tree.
+        if (self.has_split and
+                self._get_split_inputs(child_size) == self.split_inputs):
+            self._split_children()
+            return
+
         if self.has_split:
-            known_keep1 = get_creature_names(
-                self.child1.certain_at_split_or_removed_creatures)
-            known_split1 = get_creature_names(
-                self.child2.certain_at_split_or_removed_creatures)
+            known_keep1 = self.child1.certain_at_split_or_removed
+            known_split1 = self.child2.certain_at_split_or_removed
         else:
-            known_keep1 = []
-            known_split1 = []
+            known_keep1 = Counter()
+            known_split1 = Counter()
         known_combo = known_keep1 + known_split1
-        certain = get_creature_names(self.certain_creatures)
+        certain = self.certain_counts
         if not superset(certain, known_combo):
             # We need to abort this split and trust that it will be redone
             # after the certainty information percolates up to the parent.
             return
-        all_names = get_creature_names(self.creatures)
-        uncertain = subtract_lists(all_names, certain)
+        all_counts = self.counts
+        uncertain = self.uncertain
 
         possible_splits = self._find_all_possible_splits(child_size,
                                                          known_keep1,
                                                          known_split1)
-        splitoff_names = self._choose_creatures_to_split_out(possible_splits)
+        splitoff = self._choose_creatures_to_split_out(possible_splits)
 
-        possible_keeps = [subtract_lists(all_names, names) for names in
+        possible_keeps = [subtract_counts(all_counts, counts) for counts in
                           possible_splits]
 
         def find_certain_child(certain, uncertain, possibles):
-            """Return a list of names that are certainly in the child node."""
-            li = []
-            for name in set(certain):
-                min_ = min_count(possibles, name) - uncertain.count(name)
-                li.extend(min_ * [name])
-            return li
+            """Return a Counter of names that are certainly in the child
+            node."""
+            counts = Counter()
+            for name in certain:
+                min_ = min_count(possibles, name) - uncertain[name]
+                if min_ > 0:
+                    counts[name] = min_
+            return counts
 
         known_keep2 = find_certain_child(certain, uncertain, possible_keeps)
         known_split2 = find_certain_child(certain, uncertain, possible_splits)
 
-        def merge_knowns(known1, known2):
-            """Return a merged list of names from the two lists."""
-            all_names = set(known1 + known2)
-            li = []
-            for name in all_names:
-                max_ = max_count([known1, known2], name)
-                li.extend(max_ * [name])
-            return li
-
-        known_keep = merge_knowns(known_keep1, known_keep2)
-        known_split = merge_knowns(known_split1, known_split2)
+        known_keep = known_keep1 | known_keep2
+        known_split = known_split1 | known_split2
 
         def _inherit_parent_certainty(certain, known, other):
-            """If one of the child legions is fully known, assign the
-            creatures in the other child legion the same certainty they
-            have in the parent.
+            """If one of the child legions is fully known, return the
+            creatures in the other child legion with the same certainty
+            they have in the parent.
             """
-            all_names = certain[:]
-            assert superset(all_names, known)
-            for name in known:
-                all_names.remove(name)
-            assert superset(all_names, other)
-            for name in all_names:
-                if all_names.count(name) > other.count(name):
-                    other.append(name)
-
-        if len(known_split) == child_size:
-            _inherit_parent_certainty(certain, known_split, known_keep)
-        elif len(known_keep) == len(self) - child_size:
-            _inherit_parent_certainty(certain, known_keep, known_split)
-
-        # lists of CreatureInfo
-        strong_list = []
-        weak_list = []
-        for ci in self.creatures:
-            name = ci.name
-            new_info = CreatureInfo(name, False, True)
-            if name in splitoff_names:
-                weak_list.append(new_info)
-                splitoff_names.remove(name)
-                # If in known_split, set certain
-                if name in known_split:
-                    known_split.remove(name)
-                    new_info.certain = True
-            else:
-                strong_list.append(new_info)
-                # If in known_keep, set certain
-                if name in known_keep:
-                    known_keep.remove(name)
-                    new_info.certain = True
+            rest = subtract_counts(certain, known)
+            assert superset(rest, other)
+            return other | rest
+
+        if sum(known_split.values()) == child_size:
+            known_keep = _inherit_parent_certainty(certain, known_split,
+                                                   known_keep)
+        elif sum(known_keep.values()) == len(self) - child_size:
+            known_split = _inherit_parent_certainty(certain, known_keep,
+                                                    known_split)
+
+        strong = all_counts - splitoff
+        weak = splitoff
+        strong_certain = strong & known_keep
+        weak_certain = weak & known_split
 
         if self.has_split:
-            strong_list += self.child1.after_split_creatures
-            for ci in self.child1.removed:
-                strong_list.remove(ci)
-            weak_list += self.child2.after_split_creatures
-            for ci in self.child2.removed:
-                weak_list.remove(ci)
-            self.child1.creatures = strong_list
-            self.child2.creatures = weak_list
+            for child, certain2, all2 in [(self.child1, strong_certain,
+                                           strong),
+                                          (self.child2, weak_certain, weak)]:
+                # Removed creatures were certain.
+                from_certain = certain2 & child.removed
+                from_uncertain = subtract_counts(child.removed, from_certain)
+                child.certain = certain2 - from_certain
+                child.uncertain = subtract_counts(all2 - certain2,
+                                                  from_uncertain)
         else:
-            self.child1 = Node(self.markerid, turn, strong_list, self)
-            self.child2 = Node(other_markerid, turn, weak_list, self)
+            # Weigh this node's hypotheses while it is still a leaf.
+            weights = self.hypothesis_weights()
+            self.child1 = Node(self.markerid, turn, [], self)
+            self.child1.certain = strong_certain
+            self.child1.uncertain = strong - strong_certain
+            self.child2 = Node(other_markerid, turn, [], self)
+            self.child2.certain = weak_certain
+            self.child2.uncertain = weak - weak_certain
             self.child_size2 = len(self.child2)
+            if self.hypotheses is not None:
+                self._split_hypotheses(child_size, weights)
+        self.split_inputs = self._get_split_inputs(child_size)
 
         self._split_children()
 
@@ -499,6 +760,8 @@ class Node(object):
         """
         parent = self.parent
         assert parent == other.parent
+        if parent.hypotheses is not None:
+            parent._fold_children()
         if (parent.markerid == self.markerid or
            parent.markerid == other.markerid):
             # Remove self and other from parent, as if the split never
@@ -514,25 +777,26 @@ class Node(object):
         # Allow adding to 7-high legion, to support the case of summoning
         # into a legion that has lost creatures whose removal has not
         # been noted yet.
-        ci = CreatureInfo(creature_name, True, False)
-        self.creatures.append(ci)
+        self.after_split[creature_name] += 1
+        self.added[creature_name] += 1
 
     def remove_creature(self, creature_name):
         """Remove a Creature by its name."""
         if not self:
             raise ValueError("Tried removing from 0-high legion")
         self.reveal_creatures([creature_name])
-        ci = get_creature_info(self.certain_creatures, creature_name)
-        assert ci is not None
 
         # Only need to track the removed creature for future parent split
         # predictions if it was here at the time of the split.
-        if ci.at_split:
-            self.removed.append(ci)
-        for (ii, creature) in enumerate(self.creatures):
-            if creature == ci and creature.certain:
-                del self.creatures[ii]
-                break
+        if self.certain[creature_name]:
+            self.certain[creature_name] -= 1
+            self.certain += Counter()
+            self.removed[creature_name] += 1
+        else:
+            assert self.after_split[creature_name]
+            self.after_split[creature_name] -= 1
+            self.after_split += Counter()
+        self.lost[creature_name] += 1
 
     def remove_creatures(self, creature_names):
         """Remove Creatures by their names."""
@@ -543,13 +807,20 @@ class Node(object):
 
 class PredictSplits(object):
 
-    """Split predictor."""
+    """Split predictor.
 
-    def __init__(self, playername, root_id, creature_names):
+    If probabilistic, also keep weighted hypotheses about each legion's
+    contents, for get_distribution and expected_combat_value.
+    """
+
+    def __init__(self, playername, root_id, creature_names,
+                 probabilistic=False):
         self.playername = playername
         # All creatures in root legion must be known
         creatures = [CreatureInfo(name, True, True) for name in creature_names]
         self.root = Node(root_id, 0, creatures, None)
+        if probabilistic:
+            self.root.hypotheses = {counts_key(self.root.counts): 1.0}
 
     def get_nodes(self, root=None):
         """Return all nodes in subtree starting from root."""
@@ -619,6 +890,22 @@ class PredictSplits(object):
                 return leaf
         return None
 
+    def get_distribution(self, markerid):
+        """Return the possible contents of the leaf with markerid and their
+        probabilities, or None."""
+        leaf = self.get_leaf(markerid)
+        if leaf is None:
+            return None
+        return leaf.get_distribution()
+
+    def expected_combat_value(self, markerid):
+        """Return the expected combat value of the leaf with markerid, or
+        None."""
+        leaf = self.get_leaf(markerid)
+        if leaf is None:
+            return None
+        return leaf.expected_combat_value()
+
     @property
     def num_uncertain_legions(self):
         """Return the number of uncertain legions."""
@@ -644,6 +931,32 @@ class AllPredictSplits(list):
                 return leaf
         return None
 
+    def get_relatives(self, markerid):
+        """Return all leaves in the same tree as the leaf with markerid,
+        including it, or an empty list."""
+        for ps in self:
+            leaves = ps.get_leaves()
+            for leaf in leaves:
+                if leaf.markerid == markerid:
+                    return leaves
+        return []
+
+    def get_distribution(self, markerid):
+        """Return the possible contents of the leaf with markerid and their
+        probabilities, or None."""
+        leaf = self.get_leaf(markerid)
+        if leaf is None:
+            return None
+        return leaf.get_distribution()
+
+    def expected_combat_value(self, markerid):
+        """Return the expected combat value of the leaf with markerid, or
+        None."""
+        leaf = self.get_leaf(markerid)
+        if leaf is None:
+            return None
+        return leaf.expected_combat_value()
+
     def print_leaves(self):
         """Print all leaf nodes."""
         print()
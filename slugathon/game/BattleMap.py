@@ -19,6 +19,25 @@ all_labels = frozenset([
     "ATTACKER", "DEFENDER",
 ])
 
+# Integer ids for battle hexes, for bitmasks.  Onboard hexes come first, so
+# entrances are the two highest bits.
+id_to_hexlabel = (sorted(all_labels - set(["ATTACKER", "DEFENDER"])) +
+                  ["ATTACKER", "DEFENDER"])
+hexlabel_to_id = dict((hexlabel, ii) for ii, hexlabel in
+                      enumerate(id_to_hexlabel))
+hexlabel_to_bit = dict((hexlabel, 1 << ii) for ii, hexlabel in
+                       enumerate(id_to_hexlabel))
+
+
+def mask_to_hexlabels(mask):
+    """Return a list of the hexlabels whose bits are set in mask."""
+    hexlabels = []
+    while mask:
+        bit = mask & -mask
+        hexlabels.append(id_to_hexlabel[bit.bit_length() - 1])
+        mask ^= bit
+    return hexlabels
+
 
 def label_to_coords(label, entry_side, down=False):
     """Convert a hex label to a tuple of X and Y coordinates, starting at the
@@ -134,6 +153,25 @@ def is_obstacle(border):
     return bool(border)
 
 
+# (mterrain, entry_side) to (ranges, los_blocks, bramble_counts), shared by
+# all BattleMaps with that terrain and entry side, since they never change.
+_mterrain_entry_side_to_tables = {}
+
+
+class _OccupiedHexes(object):
+
+    """Stand-in for a Game with creatures in only the given battle hexes.
+
+    Used to find which hexes can block a line of sight.
+    """
+
+    def __init__(self, hexlabels):
+        self.hexlabels = hexlabels
+
+    def is_battle_hex_occupied(self, hexlabel):
+        return hexlabel in self.hexlabels
+
+
 class BattleMap(object):
 
     """A logical battle map.  No GUI code.
@@ -162,6 +200,33 @@ class BattleMap(object):
         for hex1 in self.hexes.values():
             hex1.init_neighbors()
         self.startlist = battlemapdata.startlist.get(mterrain)
+        key = (mterrain, entry_side)
+        tables = _mterrain_entry_side_to_tables.get(key)
+        if tables is None:
+            tables = self._compute_tables()
+            _mterrain_entry_side_to_tables[key] = tables
+        # {(hexlabel1, hexlabel2, allow_entrance): range}
+        # {(hexlabel1, hexlabel2): [(terrain_blocked, creature_hexlabels)]}
+        # {(hexlabel1, hexlabel2): bramble count if line of sight is clear}
+        (self.ranges, self.los_blocks, self.bramble_counts) = tables
+        # Indexed by hex id.  Cliffs on either side of a hexside stop
+        # adjacent creatures from engaging.
+        self.neighbor_masks = [0] * len(id_to_hexlabel)
+        self.cliff_masks = [0] * len(id_to_hexlabel)
+        self.engagement_masks = [0] * len(id_to_hexlabel)
+        for hexlabel, hex1 in self.hexes.items():
+            ii = hexlabel_to_id[hexlabel]
+            for hexside, hex2 in hex1.neighbors.items():
+                bit = hexlabel_to_bit[hex2.label]
+                self.neighbor_masks[ii] |= bit
+                if (hex1.borders[hexside] == "Cliff" or
+                        hex2.borders[(hexside + 3) % 6] == "Cliff"):
+                    self.cliff_masks[ii] |= bit
+            self.engagement_masks[ii] = (self.neighbor_masks[ii] &
+                                         ~self.cliff_masks[ii])
+        # {str creature name: [[(int hex id2, int entry_cost,
+        # int move_cost)]]}, indexed by hex id, filled in lazily by Game
+        self.move_costs = {}
 
     @property
     def hex_width(self):
@@ -183,6 +248,31 @@ class BattleMap(object):
             spun[(key + delta) % 6] = val
         return spun
 
+    def _compute_tables(self):
+        """Return (ranges, los_blocks, bramble_counts) for this map.
+
+        These only depend on the terrain, so range, is_los_blocked, and
+        count_bramble_hexes can look them up instead of walking the map.
+        Creatures are handled by recording, for each line of sight, the
+        hexes that block it if occupied.
+        """
+        ranges = {}
+        los_blocks = {}
+        bramble_counts = {}
+        for hexlabel1, hex1 in self.hexes.items():
+            for hexlabel2, hex2 in self.hexes.items():
+                for allow_entrance in (False, True):
+                    ranges[(hexlabel1, hexlabel2, allow_entrance)] = \
+                        self._compute_range(hexlabel1, hexlabel2,
+                                            allow_entrance)
+                if hex1.entrance or hex2.entrance or hexlabel1 == hexlabel2:
+                    continue
+                los_blocks[(hexlabel1, hexlabel2)] = self._find_los_blocks(
+                    hex1, hex2)
+                bramble_counts[(hexlabel1, hexlabel2)] = \
+                    self._count_bramble_hexes_unblocked(hex1, hex2)
+        return ranges, los_blocks, bramble_counts
+
     def range(self, hexlabel1, hexlabel2, allow_entrance=False):
         """Return the range from hexlabel1 to hexlabel2.
 
@@ -192,10 +282,16 @@ class BattleMap(object):
         If either hex is an entrance, return a huge number, unless
         allow_entrance is True, in which case return the normal range.
         """
-        if hexlabel1 not in self.hexes or hexlabel2 not in self.hexes:
+        result = self.ranges.get((hexlabel1, hexlabel2, allow_entrance))
+        if result is None:
             logging.info("BattleMap.range invalid hexlabel %s %s %s" %
                          (hexlabel1, hexlabel2, allow_entrance))
             return maxsize
+        return result
+
+    def _compute_range(self, hexlabel1, hexlabel2, allow_entrance):
+        """Return the range from hexlabel1 to hexlabel2, by searching
+        outward from hexlabel1."""
         if hexlabel1 == hexlabel2:
             return 1
         hex1 = self.hexes[hexlabel1]
@@ -415,6 +511,46 @@ class BattleMap(object):
                                         mid_cliff, mid_chit,
                                         total_obstacles, total_walls, game)
 
+    def _los_lefts(self, hex1, hex2):
+        """Return the values of left to try for the line of sight from hex1
+        to hex2.  Both sides of a hexspine must be blocked to block it."""
+        x1, y1 = label_to_coords(hex1.label, self.entry_side, True)
+        x2, y2 = label_to_coords(hex2.label, self.entry_side, True)
+        delta_x = x2 - x1
+        delta_y = y2 - y1
+        if close(delta_y, 0) or close(abs(delta_y), 1.5 * abs(delta_x)):
+            return (True, False)
+        else:
+            return (self._to_left(delta_x, delta_y),)
+
+    def _find_los_blocks(self, hex1, hex2):
+        """Return a list of (terrain_blocked, creature_hexlabels) tuples, one
+        for each side of the line of sight from hex1 to hex2.
+
+        That side is blocked if terrain_blocked is True or if there is a
+        creature in any of creature_hexlabels.
+        """
+        strike_elevation = min(hex1.elevation, hex2.elevation)
+        los_blocks = []
+        for left in self._los_lefts(hex1, hex2):
+            terrain_blocked = self._is_los_blocked_dir(
+                hex1, hex1, hex2, left, strike_elevation)
+            creature_hexlabels = []
+            if not terrain_blocked:
+                hex3 = hex1
+                while True:
+                    direction = self._get_direction(hex3, hex2, left)
+                    hex3 = hex3.neighbors[direction]
+                    if hex3 == hex2:
+                        break
+                    game = _OccupiedHexes(set([hex3.label]))
+                    if self._is_los_blocked_dir(hex1, hex1, hex2, left,
+                                                strike_elevation,
+                                                game=game):
+                        creature_hexlabels.append(hex3.label)
+            los_blocks.append((terrain_blocked, tuple(creature_hexlabels)))
+        return los_blocks
+
     def is_los_blocked(self, hexlabel1, hexlabel2, game):
         """Return True iff the line of sight from hexlabel1 to
         hexlabel2 is blocked by terrain or creatures.
@@ -424,27 +560,19 @@ class BattleMap(object):
         assert hexlabel1 in self.hexes and hexlabel2 in self.hexes
         if hexlabel1 == hexlabel2:
             return False
-        x1, y1 = label_to_coords(hexlabel1, self.entry_side, True)
-        x2, y2 = label_to_coords(hexlabel2, self.entry_side, True)
-        delta_x = x2 - x1
-        delta_y = y2 - y1
-        hex1 = self.hexes[hexlabel1]
-        hex2 = self.hexes[hexlabel2]
-        strike_elevation = min(hex1.elevation, hex2.elevation)
-        if close(delta_y, 0) or close(abs(delta_y), 1.5 * abs(delta_x)):
-            return (self._is_los_blocked_dir(
-                hex1, hex1, hex2, True, strike_elevation, game=game)
-                and
-                self._is_los_blocked_dir(hex1, hex1, hex2, False,
-                                         strike_elevation, game=game))
-        else:
-            return self._is_los_blocked_dir(
-                hex1,
-                hex1,
-                hex2,
-                self._to_left(delta_x, delta_y),
-                strike_elevation,
-                game=game)
+        los_blocks = self.los_blocks.get((hexlabel1, hexlabel2))
+        # Offboard hexes are not allowed.
+        assert los_blocks is not None
+        for terrain_blocked, creature_hexlabels in los_blocks:
+            if not terrain_blocked:
+                if game is None:
+                    return False
+                for hexlabel in creature_hexlabels:
+                    if game.is_battle_hex_occupied(hexlabel):
+                        break
+                else:
+                    return False
+        return True
 
     def _count_bramble_hexes_dir(self, hex1, hex2, left, count):
         """Return the number of intervening bramble hexes.
@@ -477,11 +605,13 @@ class BattleMap(object):
             logging.info("count_bramble_hexes %s %s los blocked" % (hexlabel1,
                                                                     hexlabel2))
             return 0
-        hex1 = self.hexes[hexlabel1]
-        hex2 = self.hexes[hexlabel2]
-        if hex1.entrance or hex2.entrance:
-            logging.info("count_bramble_hexes entrance hex")
-            return 0
+        return self.bramble_counts[(hexlabel1, hexlabel2)]
+
+    def _count_bramble_hexes_unblocked(self, hex1, hex2):
+        """Return the minimum number of intervening bramble hexes between
+        hex1 and hex2, assuming the line of sight is not blocked."""
+        hexlabel1 = hex1.label
+        hexlabel2 = hex2.label
         x1, y1 = label_to_coords(hexlabel1, self.entry_side, True)
         x2, y2 = label_to_coords(hexlabel2, self.entry_side, True)
         delta_x = x2 - x1
@@ -9,6 +9,7 @@ import logging
 
 from slugathon.data import creaturedata
 from slugathon.game import Creature
+from slugathon.util import Zobrist
 
 
 class Caretaker(object):
@@ -19,12 +20,41 @@ class Caretaker(object):
         self.counts = {}
         self.max_counts = {}
         self.graveyard = {}
+        # XOR of the Zobrist keys of counts and graveyard, kept current as
+        # they change.
+        self.zobrist_hash = 0
         for creature_name in creaturedata.data:
             creature = Creature.Creature(creature_name)
             if not creature.is_unknown:
-                self.counts[creature.name] = creature.max_count
                 self.max_counts[creature.name] = creature.max_count
-                self.graveyard[creature.name] = 0
+                self._set_count(creature.name, creature.max_count)
+                self._set_graveyard(creature.name, 0)
+
+    def _set_count(self, creature_name, count):
+        old_count = self.counts.get(creature_name)
+        if old_count is not None:
+            self.zobrist_hash ^= Zobrist.key("caretaker", creature_name,
+                                             old_count)
+        self.counts[creature_name] = count
+        self.zobrist_hash ^= Zobrist.key("caretaker", creature_name, count)
+
+    def _set_graveyard(self, creature_name, count):
+        old_count = self.graveyard.get(creature_name)
+        if old_count is not None:
+            self.zobrist_hash ^= Zobrist.key("graveyard", creature_name,
+                                             old_count)
+        self.graveyard[creature_name] = count
+        self.zobrist_hash ^= Zobrist.key("graveyard", creature_name, count)
+
+    def compute_zobrist_hash(self):
+        """Return the Zobrist hash of counts and graveyard, computed from
+        scratch."""
+        result = 0
+        for creature_name, count in self.counts.items():
+            result ^= Zobrist.key("caretaker", creature_name, count)
+        for creature_name, count in self.graveyard.items():
+            result ^= Zobrist.key("graveyard", creature_name, count)
+        return result
 
     def num_left(self, creature_name):
         """Return the number of creature_name left in the stacks."""
@@ -34,7 +64,7 @@ class Caretaker(object):
         """Take one of creature_name off the stack.  Need to ensure that one
         remains before calling this."""
         if self.counts[creature_name] >= 1:
-            self.counts[creature_name] -= 1
+            self._set_count(creature_name, self.counts[creature_name] - 1)
         else:
             raise AssertionError("No %s left to take" % creature_name)
 
@@ -45,16 +75,17 @@ class Caretaker(object):
             return
         if self.counts[creature_name] >= creature.max_count:
             logging.info("Tried to put too many %s back" % creature_name)
-            self.counts[creature_name] = self.max_counts[creature_name]
+            self._set_count(creature_name, self.max_counts[creature_name])
         else:
-            self.counts[creature_name] += 1
+            self._set_count(creature_name, self.counts[creature_name] + 1)
 
     def kill_one(self, creature_name):
         """If creature_name is mortal, put it in the graveyard.  Otherwise put
         it back onto the stack."""
         creature = Creature.Creature(creature_name)
         if creature.is_creature:
-            self.graveyard[creature_name] += 1
+            self._set_graveyard(creature_name,
+                                self.graveyard[creature_name] + 1)
         else:
             self.put_one_back(creature_name)
 
@@ -75,12 +75,55 @@ class Creature(object):
         self.rangestrikes = bool(rangestrikes)
         self.magicmissile = (rangestrikes == 2)
         self.acquirable = bool(self.acquirable_every)
-        self.hits = 0
+        self._hits = 0
         self.moved = False
         self.struck = False
-        self.hexlabel = None
-        self.previous_hexlabel = None
         self.legion = None
+        self._hexlabel = None
+        self.previous_hexlabel = None
+
+    @property
+    def hexlabel(self):
+        return self._hexlabel
+
+    @hexlabel.setter
+    def hexlabel(self, hexlabel):
+        """Move this creature to battle hex hexlabel, keeping the game's
+        index of creatures by battle hex and Zobrist hash current."""
+        legion = self.legion
+        if (hexlabel != self._hexlabel and legion is not None and
+                legion.player is not None):
+            game = legion.player.game
+            if game is not None:
+                if game.is_battle_legion(legion):
+                    game.move_creature_in_battle_index(self, self._hexlabel,
+                                                       hexlabel)
+                if legion.zobrist_features is not None:
+                    self._hexlabel = hexlabel
+                    game.rehash_creature(self)
+                    return
+        self._hexlabel = hexlabel
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @hits.setter
+    def hits(self, hits):
+        """Set the damage on this creature, keeping the game's Zobrist hash
+        current."""
+        legion = self.legion
+        if (hits != self._hits and legion is not None and
+                legion.zobrist_features is not None):
+            self._hits = hits
+            legion.player.game.rehash_creature(self)
+        else:
+            self._hits = hits
+
+    def zobrist_feature(self, markerid):
+        """Return the feature this creature adds to the game's Zobrist hash
+        as a member of legion markerid."""
+        return ("creature", markerid, self.name, self._hexlabel, self._hits)
 
     @property
     def power(self):
@@ -145,6 +188,15 @@ class Creature(object):
     def terrain_combat_value(self):
         """Return a rough indication of creature combat value, considering its
         legion's current terrain."""
+        if (self.legion is None or self.legion.player is None or
+           self.legion.hexlabel is None):
+            return self.combat_value
+        return self.combat_value_in(self.legion.player.game.board.hexes[
+            self.legion.hexlabel].terrain)
+
+    def combat_value_in(self, terrain):
+        """Return a rough indication of creature combat value in a masterhex
+        of type terrain."""
         TOWER_BONUS = 0.25
         BRUSH_BONUS = 0.1
         JUNGLE_BONUS = 0.1
@@ -155,11 +207,6 @@ class Creature(object):
         MOUNTAINS_BONUS = 0.1
         TUNDRA_BONUS = 0.1
         base_value = self.combat_value
-        if (self.legion is None or self.legion.player is None or
-           self.legion.hexlabel is None):
-            return base_value
-        terrain = self.legion.player.game.board.hexes[
-            self.legion.hexlabel].terrain
         if terrain == "Tower":
             return (1 + TOWER_BONUS) * base_value
         elif terrain == "Brush":
@@ -205,59 +252,33 @@ class Creature(object):
     def is_unknown(self):
         return self.character_type == "unknown"
 
-    def _hexlabel_to_enemy(self):
-        """Return a dict of hexlabel: live enemy Creature"""
-        hexlabel_to_enemy = {}
-        game = self.legion.player.game
-        legion2 = game.other_battle_legion(self.legion)
-        for creature in legion2.creatures:
-            if not creature.dead and not creature.offboard:
-                hexlabel_to_enemy[creature.hexlabel] = creature
-        return hexlabel_to_enemy
-
-    def _hexlabel_to_dead_enemy(self):
-        """Return a dict of hexlabel: dead enemy Creature"""
-        hexlabel_to_enemy = {}
+    def _adjacent_enemies(self, dead):
+        """Return a set of enemy Creatures in adjacent hexes that are not
+        across a cliff, either dead or alive depending on dead."""
+        enemies = set()
+        if self.offboard or self.hexlabel is None:
+            return enemies
         game = self.legion.player.game
-        legion2 = game.other_battle_legion(self.legion)
-        for creature in legion2.creatures:
-            if creature.dead and not creature.offboard:
-                hexlabel_to_enemy[creature.hexlabel] = creature
-        return hexlabel_to_enemy
+        adjacent = game.battle_adjacent_enemies_of(self)
+        if adjacent is None:
+            adjacent = game.find_adjacent_enemies(self.hexlabel,
+                                                  self.legion).values()
+        for creature in adjacent:
+            if creature.dead == dead:
+                enemies.add(creature)
+        return enemies
 
     @property
     def engaged_enemies(self):
         """Return a set of live enemy Creatures this Creature is engaged
         with."""
-        enemies = set()
-        if self.offboard or self.hexlabel is None:
-            return enemies
-        game = self.legion.player.game
-        hex1 = game.battlemap.hexes[self.hexlabel]
-        hexlabel_to_enemy = self._hexlabel_to_enemy()
-        for hexside, hex2 in hex1.neighbors.items():
-            if hex2.label in hexlabel_to_enemy:
-                if (hex1.borders[hexside] != "Cliff" and
-                   hex2.borders[(hexside + 3) % 6] != "Cliff"):
-                    enemies.add(hexlabel_to_enemy[hex2.label])
-        return enemies
+        return self._adjacent_enemies(False)
 
     @property
     def dead_adjacent_enemies(self):
         """Return a set of dead enemy Creatures this Creature is engaged
         with."""
-        enemies = set()
-        if self.offboard or self.hexlabel is None:
-            return enemies
-        game = self.legion.player.game
-        hex1 = game.battlemap.hexes[self.hexlabel]
-        hexlabel_to_enemy = self._hexlabel_to_dead_enemy()
-        for hexside, hex2 in hex1.neighbors.items():
-            if hex2.label in hexlabel_to_enemy:
-                if (hex1.borders[hexside] != "Cliff" and
-                   hex2.borders[(hexside + 3) % 6] != "Cliff"):
-                    enemies.add(hexlabel_to_enemy[hex2.label])
-        return enemies
+        return self._adjacent_enemies(True)
 
     def has_los_to(self, hexlabel):
         """Return True iff this creature has line of sight to the
@@ -275,14 +296,37 @@ class Creature(object):
         if (self.offboard or self.hexlabel is None or not self.rangestrikes
            or self.dead_adjacent_enemies):
             return enemies
-        hexlabel_to_enemy = self._hexlabel_to_enemy()
+        entry = game.battle_rangestrike_candidates.get(id(self))
+        if entry is not None and entry[0] is self:
+            candidates = entry[1]
+        else:
+            candidates = self._find_rangestrike_candidates()
+            if id(self) in game.battle_adjacent_enemies:
+                game.battle_rangestrike_candidates[id(self)] = (self,
+                                                                candidates)
+        for enemy in candidates:
+            if not enemy.dead:
+                enemies.add(enemy)
+        return enemies
+
+    def _find_rangestrike_candidates(self):
+        """Return a list of onboard enemy Creatures, living or dead, that
+        are within range and line of sight of this Creature.
+
+        These only change when creatures move, so Game caches them.
+        """
+        game = self.legion.player.game
+        legion2 = game.other_battle_legion(self.legion)
         map1 = game.battlemap
-        for hexlabel, enemy in hexlabel_to_enemy.items():
-            if (map1.range(self.hexlabel, hexlabel) <= self.skill and
+        candidates = []
+        for enemy in legion2.creatures:
+            hexlabel = enemy.hexlabel
+            if (hexlabel is not None and not enemy.offboard and
+               map1.range(self.hexlabel, hexlabel) <= self.skill and
                (self.magicmissile or self.has_los_to(hexlabel)) and
                (self.magicmissile or not enemy.is_lord)):
-                enemies.add(enemy)
-        return enemies
+                candidates.append(enemy)
+        return candidates
 
     @property
     def rangestrike_targets(self):
@@ -376,12 +420,24 @@ class Creature(object):
         """Return True iff this creature can rangestrike an enemy."""
         return bool(self.rangestrike_targets)
 
-    def number_of_dice(self, target):
-        """Return the number of dice to use if striking target."""
+    def number_of_dice(self, target, melee=None):
+        """Return the number of dice to use if striking target.
+
+        If melee is None, find out whether target is engaged with this
+        creature or could be rangestruck; callers that already know can pass
+        True or False to skip that.
+        """
         map1 = self.legion.player.game.battlemap
         hex1 = map1.hexes[self.hexlabel]
         hex2 = map1.hexes[target.hexlabel]
-        if target in self.engaged_enemies:
+        if melee is None:
+            if target in self.engaged_enemies:
+                melee = True
+            elif target in self.potential_rangestrike_targets:
+                melee = False
+            else:
+                return 0
+        if melee:
             dice = self.power
             if hex1.terrain == "Volcano" and self.is_native(hex1.terrain):
                 dice += 2
@@ -394,23 +450,27 @@ class Creature(object):
             border2 = hex1.opposite_border(hexside)
             if border2 == "Dune" and not self.is_native(border2):
                 dice -= 1
-        elif target in self.potential_rangestrike_targets:
+        else:
             dice = int(self.power / 2)
             if hex1.terrain == "Volcano" and self.is_native(hex1.terrain):
                 dice += 2
-        else:
-            dice = 0
         return dice
 
-    def strike_number(self, target):
-        """Return the strike number to use if striking target."""
+    def strike_number(self, target, melee=None):
+        """Return the strike number to use if striking target.
+
+        If melee is None, find out whether target is engaged with this
+        creature.
+        """
         game = self.legion.player.game
         map1 = game.battlemap
         hex1 = map1.hexes[self.hexlabel]
         hex2 = map1.hexes[target.hexlabel]
         skill1 = self.skill
         skill2 = target.skill
-        if target in self.engaged_enemies:
+        if melee is None:
+            melee = target in self.engaged_enemies
+        if melee:
             hexside = hex1.neighbor_to_hexside(hex2)
             border = hex1.borders[hexside]
             border2 = hex1.opposite_border(hexside)
@@ -434,7 +494,7 @@ class Creature(object):
                 skill1 -= map1.count_walls(self.hexlabel, target.hexlabel,
                                            game)
         strike_number = 4 - skill1 + skill2
-        if target in self.engaged_enemies:
+        if melee:
             if (hex2.terrain == "Bramble" and not self.is_native(hex2.terrain)
                and target.is_native(hex2.terrain)):
                 strike_number += 1
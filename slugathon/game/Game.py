@@ -3,6 +3,9 @@ __license__ = "GNU GPL v2"
 
 
 from sys import maxsize
+import enum
+import heapq
+import operator
 import os
 import time
 from collections import defaultdict, Counter
@@ -12,24 +15,137 @@ from twisted.internet import reactor
 from zope.interface import implementer
 
 from slugathon.game import (Player, MasterBoard, Action, Phase, Caretaker,
-                            Creature, History, BattleMap)
+                            Creature, History, BattleMap, Legion)
 from slugathon.data import playercolordata
 from slugathon.util.Observed import Observed
 from slugathon.util.Observer import IObserver
-from slugathon.util import prefs, Dice
+from slugathon.util import prefs, Dice, Zobrist
 from slugathon.net import config
 
 
 # Movement constants
-ARCHES_AND_ARROWS = -1
-ARROWS_ONLY = -2
+ARCHES_AND_ARROWS = MasterBoard.ARCHES_AND_ARROWS
+ARROWS_ONLY = MasterBoard.ARROWS_ONLY
 
 # Entry side constants
 TELEPORT = "TELEPORT"
 
-
-def opposite(direction):
-    return (direction + 3) % 6
+opposite = MasterBoard.opposite
+
+
+# Movement rules, shared by Game and GameState.  Each takes the hexlabels
+# of the legions in the way as sets, rather than a Game.
+
+def normal_moves(board, hexlabel, roll, enemy_hexlabels, friendly_hexlabels,
+                 ally_hexlabels, block=None, came_from=None):
+    """Return a set of (hexlabel, entry_side) tuples for the non-teleport
+    moves from hexlabel.
+
+    enemy_hexlabels and friendly_hexlabels hold enemy and friendly legions,
+    and ally_hexlabels friendly legions other than the moving one.  block
+    and came_from are as for MasterBoard.find_paths.
+    """
+    moves = set()
+    for path in board.find_paths(hexlabel, roll, block, came_from):
+        for hexlabel2, entry_side in path:
+            # If there is an enemy legion and no friendly legion, mark
+            # the hex as a legal move, and stop.
+            if hexlabel2 in enemy_hexlabels:
+                if hexlabel2 not in friendly_hexlabels:
+                    moves.add((hexlabel2, entry_side))
+                break
+        else:
+            # Final destination
+            # Do not add this hex if already occupied by another
+            # friendly legion.
+            if hexlabel2 not in ally_hexlabels:
+                moves.add((hexlabel2, entry_side))
+    return moves
+
+
+def nearby_empty_hexes(masterhex, roll, came_from, occupied_hexlabels):
+    """Recursively find hexes not in occupied_hexlabels within roll hexes
+    of masterhex, for tower teleport."""
+    hexlabel = masterhex.label
+    moves = set()
+    if hexlabel not in occupied_hexlabels:
+        moves.add((hexlabel, TELEPORT))
+    if roll > 0:
+        for direction, gate in enumerate(masterhex.exits):
+            if direction != came_from:
+                neighbor = masterhex.neighbors[direction]
+                if neighbor and (
+                        gate != "NONE" or
+                        neighbor.exits[opposite(direction)] != "NONE"):
+                    moves.update(nearby_empty_hexes(neighbor, roll - 1,
+                                                    opposite(direction),
+                                                    occupied_hexlabels))
+    return moves
+
+
+def tower_teleport_moves(board, masterhex, num_lords, occupied_hexlabels):
+    """Return set of (hexlabel, TELEPORT) describing where a legion with
+    num_lords lords can tower teleport from masterhex."""
+    moves = set()
+    if masterhex.tower and num_lords:
+        moves.update(nearby_empty_hexes(masterhex, 6, None,
+                                        occupied_hexlabels))
+        for hexlabel in board.get_tower_labels():
+            if (hexlabel != masterhex.label and
+                    hexlabel not in occupied_hexlabels):
+                moves.add((hexlabel, TELEPORT))
+    return moves
+
+
+def titan_teleport_moves(can_titan_teleport, has_titan, enemy_hexlabels,
+                         friendly_hexlabels):
+    """Return set of (hexlabel, TELEPORT) describing where a legion can
+    titan teleport."""
+    moves = set()
+    if can_titan_teleport and has_titan:
+        for hexlabel in enemy_hexlabels:
+            if hexlabel not in friendly_hexlabels:
+                moves.add((hexlabel, TELEPORT))
+    return moves
+
+
+def can_teleport(roll, teleported):
+    """Return True iff a legion can teleport on movement roll roll, where
+    teleported is whether its player has teleported already this turn."""
+    return roll == 6 and not teleported
+
+
+# Game attributes that are part of the Zobrist hash
+HASHED_ATTRIBUTES = ("turn", "phase", "active_player", "attacker_legion",
+                     "defender_legion", "battlemap", "battle_turn",
+                     "battle_phase", "battle_active_legion")
+
+
+def _zobrist_value(value):
+    """Return a plain value standing for value in a Zobrist feature."""
+    if isinstance(value, enum.Enum):
+        return str(value)
+    elif isinstance(value, Player.Player):
+        return value.name
+    elif isinstance(value, Legion.Legion):
+        return value.markerid
+    elif isinstance(value, BattleMap.BattleMap):
+        return (value.mterrain, value.entry_side)
+    return value
+
+
+def _hashed_attribute(name):
+    """Return a property for Game attribute name that keeps the Zobrist
+    hash current when it is set."""
+    private = "_" + name
+
+    def fset(self, value):
+        self.remove_zobrist_feature((name, _zobrist_value(getattr(self,
+                                                                  private))))
+        setattr(self, private, value)
+        self.add_zobrist_feature((name, _zobrist_value(value)))
+
+    return property(operator.attrgetter(private), fset)
 
 
 @implementer(IObserver)
@@ -37,13 +153,30 @@ class Game(Observed):
 
     """Central class holding information about one game"""
 
+    turn = _hashed_attribute("turn")
+    phase = _hashed_attribute("phase")
+    active_player = _hashed_attribute("active_player")
+    attacker_legion = _hashed_attribute("attacker_legion")
+    defender_legion = _hashed_attribute("defender_legion")
+    battlemap = _hashed_attribute("battlemap")
+    battle_turn = _hashed_attribute("battle_turn")
+    battle_phase = _hashed_attribute("battle_phase")
+    battle_active_legion = _hashed_attribute("battle_active_legion")
+
     def __init__(self, name, owner, create_time, start_time, min_players,
                  max_players, started=False, master=False,
                  ai_time_limit=config.DEFAULT_AI_TIME_LIMIT,
                  player_time_limit=config.DEFAULT_PLAYER_TIME_LIMIT,
                  player_class="Human",
-                 player_info="", finish_time=None):
+                 player_info="", finish_time=None, board=None):
         Observed.__init__(self)
+        # Zobrist hash of everything but the caretaker, kept current as the
+        # game changes, and {feature: int} counts of the features in it.
+        self._zobrist_hash = 0
+        self._zobrist_counts = {}
+        for attribute in HASHED_ATTRIBUTES:
+            setattr(self, "_" + attribute, None)
+            self.add_zobrist_feature((attribute, None))
         self.name = name
         self.create_time = create_time
         self.start_time = start_time
@@ -51,9 +184,16 @@ class Game(Observed):
         self.min_players = min_players
         self.max_players = max_players
         self.started = started
+        # {int hexlabel: {str markerid: Legion}}, kept current by Player
+        # and Legion so that finding the legions in a hex is cheap.
+        self.hexlabel_to_legions = {}
         self.players = []
         self.add_player(owner, player_class, player_info)
-        self.board = MasterBoard.MasterBoard()
+        # The board never changes, so games can share one rather than pay
+        # for building it.
+        if board is None:
+            board = MasterBoard.MasterBoard()
+        self.board = board
         self.turn = 1
         self.phase = Phase.PhaseMaster.SPLIT
         self.active_player = None
@@ -70,6 +210,23 @@ class Game(Observed):
         self.battle_turn = None
         self.battle_phase = None
         self.battle_active_legion = None
+        # {hexlabel: [Creature]} for creatures in the current battle, kept
+        # current by Creature and Legion so that finding the creatures in
+        # a battle hex is cheap.
+        self.battle_hexlabel_to_creatures = {}
+        # {str markerid: int bitmask of BattleMap hex ids} of the hexes
+        # holding each battle legion's creatures, living or dead, kept
+        # alongside battle_hexlabel_to_creatures.
+        self.battle_markerid_to_mask = {}
+        # {id(Creature): {id(Creature): Creature}} of the enemies, living or
+        # dead, adjacent to each onboard battle creature and not across a
+        # cliff.  Edges are updated as creatures move, so engagement checks
+        # only touch a creature's own neighbors.
+        self.battle_adjacent_enemies = {}
+        # {id(Creature): (Creature, [Creature])} of enemies within range and
+        # line of sight, filled in lazily and dropped whenever a battle
+        # creature changes hex.
+        self.battle_rangestrike_candidates = {}
         self.first_attacker_kill = None
         self.attacker_entered = False
         self.pending_carry = None
@@ -78,6 +235,8 @@ class Game(Observed):
         self.master = master
         self.ai_time_limit = ai_time_limit
         self.player_time_limit = player_time_limit
+        # Schedules delayed calls; replaced to run games off the reactor.
+        self.clock = reactor
         # list of tuples of Player like [(winner,), (tied1, tied2), (loser,)]
         self.finish_order = []
 
@@ -97,19 +256,23 @@ class Game(Observed):
         except AttributeError:
             return None
 
-    def _init_battle(self, attacker_legion, defender_legion):
+    def _init_battle(self, attacker_legion, defender_legion,
+                     battlemap=None):
         self.attacker_legion = attacker_legion
         self.defender_legion = defender_legion
         assert defender_legion.hexlabel == attacker_legion.hexlabel
         self.battle_masterhex = self.board.hexes[attacker_legion.hexlabel]
         self.battle_entry_side = attacker_legion.entry_side
-        self.battlemap = BattleMap.BattleMap(self.battle_masterhex.terrain,
-                                             self.battle_entry_side)
+        if battlemap is None:
+            battlemap = BattleMap.BattleMap(self.battle_masterhex.terrain,
+                                            self.battle_entry_side)
+        self.battlemap = battlemap
         self.battle_turn = 1
         self.battle_phase = Phase.PhaseBattle.MANEUVER
         self.battle_active_legion = self.defender_legion
         self.defender_legion.enter_battle("DEFENDER")
         self.attacker_legion.enter_battle("ATTACKER")
+        self.reindex_battle_creatures()
         self.first_attacker_kill = None
         self.attacker_entered = False
         self.pending_carry = None
@@ -128,6 +291,10 @@ class Game(Observed):
         self.battle_turn = None
         self.battle_phase = None
         self.battle_active_legion = None
+        self.battle_hexlabel_to_creatures = {}
+        self.battle_markerid_to_mask = {}
+        self.battle_adjacent_enemies = {}
+        self.battle_rangestrike_candidates = {}
         self.first_attacker_kill = None
         self.attacker_entered = False
         self.pending_carry = None
@@ -312,9 +479,8 @@ class Game(Observed):
 
         Only call this after towers are assigned.
         """
-        def starting_tower_desc(a, b):
-            return b.starting_tower - a.starting_tower
-        self.players.sort(starting_tower_desc)
+        self.players.sort(key=lambda player: player.starting_tower,
+                          reverse=True)
         self.active_player = self.players[0]
 
     @property
@@ -388,13 +554,142 @@ class Game(Observed):
     def all_legions(self, hexlabel=None):
         """Return a set of all legions in hexlabel, or in the whole
         game if hexlabel is None"""
+        if hexlabel is not None:
+            return set([legion for legion in self.legions_in_hex(hexlabel)
+                        if len(legion)])
         legions = set()
         for player in self.players:
             for legion in player.legions:
-                if hexlabel in (None, legion.hexlabel) and len(legion):
+                if len(legion):
                     legions.add(legion)
         return legions
 
+    def legions_in_hex(self, hexlabel):
+        """Return a list of all legions in hexlabel, including empty ones."""
+        markerid_to_legion = self.hexlabel_to_legions.get(hexlabel)
+        if not markerid_to_legion:
+            return []
+        return list(markerid_to_legion.values())
+
+    def add_legion_to_hex(self, legion, hexlabel):
+        """Record that legion is in hexlabel."""
+        markerid_to_legion = self.hexlabel_to_legions.get(hexlabel)
+        if markerid_to_legion is None:
+            markerid_to_legion = self.hexlabel_to_legions[hexlabel] = {}
+        markerid_to_legion[legion.markerid] = legion
+        self.add_zobrist_feature(("legion", legion.markerid, hexlabel))
+
+    def remove_legion_from_hex(self, legion, hexlabel):
+        """Record that legion is no longer in hexlabel."""
+        markerid_to_legion = self.hexlabel_to_legions.get(hexlabel)
+        if (markerid_to_legion is not None and
+                markerid_to_legion.get(legion.markerid) is legion):
+            del markerid_to_legion[legion.markerid]
+            if not markerid_to_legion:
+                del self.hexlabel_to_legions[hexlabel]
+            self.remove_zobrist_feature(("legion", legion.markerid, hexlabel))
+
+    def check_legion_index(self):
+        """Raise AssertionError if hexlabel_to_legions does not match the
+        players' legions."""
+        expected = {}
+        for player in self.players:
+            for legion in player.legions:
+                expected.setdefault(legion.hexlabel, {})[legion.markerid] = \
+                    legion
+        if set(expected) != set(self.hexlabel_to_legions):
+            raise AssertionError("legion index has wrong hexes",
+                                 sorted(expected, key=str),
+                                 sorted(self.hexlabel_to_legions, key=str))
+        for hexlabel, markerid_to_legion in expected.items():
+            indexed = self.hexlabel_to_legions[hexlabel]
+            if (set(indexed) != set(markerid_to_legion) or
+                    any(indexed[markerid] is not legion for markerid, legion
+                        in markerid_to_legion.items())):
+                raise AssertionError("legion index wrong in hex", hexlabel,
+                                     markerid_to_legion, indexed)
+
+    @property
+    def zobrist_hash(self):
+        """Return a 64-bit Zobrist hash of this game's position: where the
+        legions are, their creatures with battle hexes and hits, the
+        caretaker's counts, the turn and phase, and the battle state.
+
+        It is kept current as the game changes, so reading it is cheap, and
+        it is the same in every process that has the same position.
+        """
+        return self._zobrist_hash ^ self.caretaker.zobrist_hash
+
+    def add_zobrist_feature(self, feature):
+        """Add feature, a tuple of strings and numbers, to the Zobrist
+        hash."""
+        count = self._zobrist_counts.get(feature, 0)
+        self._zobrist_counts[feature] = count + 1
+        self._zobrist_hash ^= Zobrist.key(count, *feature)
+
+    def remove_zobrist_feature(self, feature):
+        """Remove feature, which must have been added, from the Zobrist
+        hash."""
+        count = self._zobrist_counts[feature] - 1
+        if count:
+            self._zobrist_counts[feature] = count
+        else:
+            del self._zobrist_counts[feature]
+        self._zobrist_hash ^= Zobrist.key(count, *feature)
+
+    def hash_legion_creatures(self, legion):
+        """Add the creatures of legion, which is coming into play, to the
+        Zobrist hash."""
+        features = {}
+        for creature in legion.creatures:
+            feature = creature.zobrist_feature(legion.markerid)
+            features[id(creature)] = feature
+            self.add_zobrist_feature(feature)
+        legion.zobrist_features = features
+
+    def unhash_legion_creatures(self, legion):
+        """Remove the creatures of legion, which is leaving play, from the
+        Zobrist hash."""
+        if legion.zobrist_features is not None:
+            for feature in legion.zobrist_features.values():
+                self.remove_zobrist_feature(feature)
+            legion.zobrist_features = None
+
+    def rehash_creature(self, creature):
+        """Update the Zobrist hash after creature moved or took hits."""
+        legion = creature.legion
+        features = legion.zobrist_features
+        old_feature = features.get(id(creature))
+        if old_feature is not None:
+            feature = creature.zobrist_feature(legion.markerid)
+            features[id(creature)] = feature
+            self.remove_zobrist_feature(old_feature)
+            self.add_zobrist_feature(feature)
+
+    def compute_zobrist_hash(self):
+        """Return the Zobrist hash computed from scratch."""
+        features = []
+        for attribute in HASHED_ATTRIBUTES:
+            features.append((attribute,
+                             _zobrist_value(getattr(self, attribute))))
+        for player in self.players:
+            for legion in player.legions:
+                features.append(("legion", legion.markerid, legion.hexlabel))
+                for creature in legion.creatures:
+                    features.append(creature.zobrist_feature(legion.markerid))
+        result = self.caretaker.compute_zobrist_hash()
+        for key in Zobrist.counted_keys(features):
+            result ^= key
+        return result
+
+    def check_zobrist_hash(self):
+        """Raise AssertionError if the incremental Zobrist hash does not
+        match the one computed from scratch."""
+        expected = self.compute_zobrist_hash()
+        if self.zobrist_hash != expected:
+            raise AssertionError("Zobrist hash wrong", hex(expected),
+                                 hex(self.zobrist_hash))
+
     def find_legion(self, markerid):
         """Return the legion called markerid, or None."""
         for player in self.players:
@@ -449,113 +744,61 @@ class Game(Observed):
 
     def find_normal_moves(self, legion, masterhex, roll, block=None,
                           came_from=None):
-        """Recursively find non-teleport moves for legion from masterhex.
+        """Find non-teleport moves for legion from masterhex.
 
         If block >= 0, go only that way.
         If block == ARCHES_AND_ARROWS, use arches and arrows.
         If block == ARROWS_ONLY, use only arrows.
         Return a set of (hexlabel, entry_side) tuples.
+
+        The terrain-only paths come from the board's precomputed tables,
+        so this just has to check legion positions along each path.
         """
-        if block is None:
-            block = masterhex.find_block()
-            if block is None:
-                block = ARCHES_AND_ARROWS
-        moves = set()
-        hexlabel = masterhex.label
         player = legion.player
-        # If there is an enemy legion and no friendly legion, mark the hex
-        # as a legal move, and stop.
-        if player.enemy_legions(hexlabel):
-            if not player.friendly_legions(hexlabel):
-                moves.add((hexlabel, masterhex.find_entry_side(came_from)))
-        elif roll == 0:
-            # Final destination
-            # Do not add this hex if already occupied by another friendly
-            # legion.
-            allies = set(player.friendly_legions(hexlabel))
-            allies.discard(legion)
-            if not allies:
-                moves.add((hexlabel, masterhex.find_entry_side(came_from)))
-        elif block >= 0:
-            moves.update(self.find_normal_moves(legion,
-                                                masterhex.neighbors[
-                                                    block],
-                                                roll - 1,
-                                                ARROWS_ONLY,
-                                                opposite(block)))
-        elif block == ARCHES_AND_ARROWS:
-            for direction, gate in enumerate(masterhex.exits):
-                if gate in ("ARCH", "ARROW", "ARROWS") and (direction !=
-                                                            came_from):
-                    moves.update(self.find_normal_moves(legion,
-                                                        masterhex.neighbors[
-                                                            direction],
-                                                        roll - 1,
-                                                        ARROWS_ONLY,
-                                                        opposite(direction)))
-        elif block == ARROWS_ONLY:
-            for direction, gate in enumerate(masterhex.exits):
-                if gate in ("ARROW", "ARROWS") and (direction != came_from):
-                    moves.update(self.find_normal_moves(legion,
-                                                        masterhex.neighbors[
-                                                            direction],
-                                                        roll - 1,
-                                                        ARROWS_ONLY,
-                                                        opposite(direction)))
-        return moves
+        friends = player.friendly_legions()
+        enemy_hexlabels = set(enemy.hexlabel for enemy in
+                              player.enemy_legions())
+        friendly_hexlabels = set(friend.hexlabel for friend in friends)
+        ally_hexlabels = set(friend.hexlabel for friend in friends
+                             if friend is not legion)
+        return normal_moves(self.board, masterhex.label, roll,
+                            enemy_hexlabels, friendly_hexlabels,
+                            ally_hexlabels, block, came_from)
+
+    def _occupied_hexlabels(self):
+        """Return a set of the hexlabels that hold non-empty legions."""
+        return set(legion.hexlabel for legion in self.all_legions())
 
     def find_nearby_empty_hexes(self, legion, masterhex, roll, came_from):
         """Recursively find empty hexes within roll hexes, for tower
         teleport"""
-        hexlabel = masterhex.label
-        moves = set()
-        if not self.all_legions(hexlabel):
-            moves.add((hexlabel, TELEPORT))
-        if roll > 0:
-            for direction, gate in enumerate(masterhex.exits):
-                if direction != came_from:
-                    neighbor = masterhex.neighbors[direction]
-                    if neighbor and (
-                            gate != "NONE" or
-                            neighbor.exits[opposite(direction)] != "NONE"):
-                        moves.update(self.find_nearby_empty_hexes(
-                                     legion,
-                                     neighbor,
-                                     roll - 1,
-                                     opposite(direction)))
-        return moves
+        return nearby_empty_hexes(masterhex, roll, came_from,
+                                  self._occupied_hexlabels())
 
     def find_tower_teleport_moves(self, legion, masterhex):
         """Return set of (hexlabel, TELEPORT) describing where legion can tower
         teleport."""
-        moves = set()
-        if masterhex.tower and legion.num_lords:
-            moves.update(self.find_nearby_empty_hexes(legion, masterhex, 6,
-                                                      None))
-            for hexlabel in self.board.get_tower_labels():
-                if hexlabel != masterhex.label and not self.all_legions(
-                        hexlabel):
-                    moves.add((hexlabel, TELEPORT))
-        return moves
+        return tower_teleport_moves(self.board, masterhex, legion.num_lords,
+                                    self._occupied_hexlabels())
 
     def find_titan_teleport_moves(self, legion):
         """Return set of (hexlabel, TELEPORT) describing where legion can titan
         teleport."""
         player = legion.player
-        moves = set()
-        if player.can_titan_teleport and "Titan" in legion.creature_names:
-            for legion in player.enemy_legions():
-                hexlabel = legion.hexlabel
-                if not player.friendly_legions(hexlabel):
-                    moves.add((hexlabel, TELEPORT))
-        return moves
+        enemy_hexlabels = set(enemy.hexlabel for enemy in
+                              player.enemy_legions())
+        friendly_hexlabels = set(friend.hexlabel for friend in
+                                 player.friendly_legions())
+        return titan_teleport_moves(player.can_titan_teleport,
+                                    "Titan" in legion.creature_names,
+                                    enemy_hexlabels, friendly_hexlabels)
 
     def find_all_teleport_moves(self, legion, masterhex, roll):
         """Return set of (hexlabel, TELEPORT) tuples describing where legion
         can teleport."""
         player = legion.player
         moves = set()
-        if roll != 6 or player.teleported:
+        if not can_teleport(roll, player.teleported):
             return moves
         moves.update(self.find_tower_teleport_moves(legion, masterhex))
         moves.update(self.find_titan_teleport_moves(legion))
@@ -912,7 +1155,7 @@ class Game(Observed):
         if (self.is_battle_over and not self.pending_summon and not
                 self.pending_reinforcement):
             self._cleanup_battle()
-        reactor.callLater(1, self._end_dead_player_turn)
+        self.clock.callLater(1, self._end_dead_player_turn)
 
     def do_not_acquire_angels(self, playername, markerid):
         """Called from Server."""
@@ -965,7 +1208,7 @@ class Game(Observed):
             self.pending_reinforcement = False
             if self.is_battle_over and not self.pending_acquire:
                 self._cleanup_battle()
-        reactor.callLater(1, self._end_dead_player_turn)
+        self.clock.callLater(1, self._end_dead_player_turn)
 
     def undo_recruit(self, playername, markerid):
         """Called from Server and update."""
@@ -1009,7 +1252,7 @@ class Game(Observed):
         self.pending_summon = False
         if self.is_battle_over and not self.pending_acquire:
             self._cleanup_battle()
-        reactor.callLater(1, self._end_dead_player_turn)
+        self.clock.callLater(1, self._end_dead_player_turn)
 
     def do_not_summon_angel(self, playername, markerid):
         """Called from Server."""
@@ -1019,7 +1262,7 @@ class Game(Observed):
         if legion is None:
             return
         player.do_not_summon_angel(legion)
-        reactor.callLater(1, self._end_dead_player_turn)
+        self.clock.callLater(1, self._end_dead_player_turn)
 
     def _do_not_summon_angel(self, playername, markerid):
         """Called from update."""
@@ -1027,7 +1270,7 @@ class Game(Observed):
         self.pending_summon = False
         if self.is_battle_over and not self.pending_acquire:
             self._cleanup_battle()
-        reactor.callLater(1, self._end_dead_player_turn)
+        self.clock.callLater(1, self._end_dead_player_turn)
 
     def do_not_reinforce(self, playername, markerid):
         """Called from Server."""
@@ -1037,7 +1280,7 @@ class Game(Observed):
         if legion is None:
             return
         player.do_not_reinforce(legion)
-        reactor.callLater(1, self._end_dead_player_turn)
+        self.clock.callLater(1, self._end_dead_player_turn)
 
     def _do_not_reinforce(self, playername, markerid):
         """Called from update."""
@@ -1046,7 +1289,7 @@ class Game(Observed):
             self.pending_reinforcement = False
             if self.is_battle_over and not self.pending_acquire:
                 self._cleanup_battle()
-        reactor.callLater(1, self._end_dead_player_turn)
+        self.clock.callLater(1, self._end_dead_player_turn)
 
     def _unreinforce(self, playername, markerid):
         """Called from update."""
@@ -1154,17 +1397,186 @@ class Game(Observed):
 
         If name is not None, then return only creatures with that name.
         """
-        creatures = set()
-        for legion in self.battle_legions:
-            for creature in legion.creatures:
-                if creature.hexlabel == hexlabel:
-                    if name is None or creature.name == name:
-                        creatures.add(creature)
-        return creatures
+        if hexlabel is None:
+            creatures = [creature for legion in self.battle_legions
+                         for creature in legion.creatures
+                         if creature.hexlabel is None]
+        else:
+            creatures = self.battle_hexlabel_to_creatures.get(hexlabel, ())
+        if name is None:
+            return set(creatures)
+        return set([creature for creature in creatures
+                    if creature.name == name])
 
     def is_battle_hex_occupied(self, hexlabel):
         """Return True iff there's a creature in the hex with hexlabel."""
-        return bool(self.creatures_in_battle_hex(hexlabel))
+        if hexlabel is None:
+            return bool(self.creatures_in_battle_hex(hexlabel))
+        return bool(self.battle_hexlabel_to_creatures.get(hexlabel))
+
+    def is_battle_legion(self, legion):
+        """Return True iff legion is one of the legions in battle."""
+        return (self.defender_legion is not None and
+                (legion == self.defender_legion or
+                 legion == self.attacker_legion))
+
+    def battle_legion_mask(self, legion):
+        """Return a bitmask of the battle hexes holding legion's creatures,
+        living or dead."""
+        return self.battle_markerid_to_mask.get(legion.markerid, 0)
+
+    @property
+    def battle_occupied_mask(self):
+        """Return a bitmask of the occupied battle hexes."""
+        mask = 0
+        for mask2 in self.battle_markerid_to_mask.values():
+            mask |= mask2
+        return mask
+
+    def reindex_battle_creatures(self):
+        """Rebuild battle_hexlabel_to_creatures and battle_markerid_to_mask
+        from the battle legions.
+
+        Needed when creatures are added to or removed from a legion in
+        battle; creature moves are tracked as they happen.
+        """
+        self.battle_hexlabel_to_creatures = {}
+        self.battle_markerid_to_mask = {}
+        for legion in self.battle_legions:
+            mask = 0
+            for creature in legion.creatures:
+                if creature.hexlabel is not None:
+                    self.battle_hexlabel_to_creatures.setdefault(
+                        creature.hexlabel, []).append(creature)
+                    mask |= BattleMap.hexlabel_to_bit[creature.hexlabel]
+            self.battle_markerid_to_mask[legion.markerid] = mask
+        self.invalidate_battle_engagements()
+
+    def find_adjacent_enemies(self, hexlabel, legion):
+        """Return a dict of id: Creature for the enemies of legion in
+        battle hexes adjacent to hexlabel and not across a cliff."""
+        enemies = {}
+        if hexlabel in (None, "ATTACKER", "DEFENDER"):
+            return enemies
+        for legion2 in self.battle_legions:
+            if legion2.markerid != legion.markerid:
+                mask = (self.battlemap.engagement_masks[
+                        BattleMap.hexlabel_to_id[hexlabel]] &
+                        self.battle_markerid_to_mask.get(legion2.markerid, 0))
+                for hexlabel2 in BattleMap.mask_to_hexlabels(mask):
+                    for creature2 in self.battle_hexlabel_to_creatures[
+                            hexlabel2]:
+                        if creature2.legion != legion:
+                            enemies[id(creature2)] = creature2
+        return enemies
+
+    def invalidate_battle_engagements(self):
+        """Rebuild battle_adjacent_enemies from the battle index and drop
+        cached rangestrike candidates.
+
+        Creature moves are tracked as they happen, and
+        reindex_battle_creatures calls this, so it is only needed after
+        changing something the index does not see, like the battle map, or
+        after an AI plays with hypothetical positions behind its back.
+        """
+        self.battle_adjacent_enemies = {}
+        self.battle_rangestrike_candidates = {}
+        for legion in self.battle_legions:
+            for creature in legion.creatures:
+                if creature.hexlabel is not None and not creature.offboard:
+                    self.battle_adjacent_enemies[id(creature)] = \
+                        self.find_adjacent_enemies(creature.hexlabel, legion)
+
+    def battle_adjacent_enemies_of(self, creature):
+        """Return a list of the enemies, living or dead, engaged with
+        creature, or None if creature is not an onboard battle creature."""
+        enemies = self.battle_adjacent_enemies.get(id(creature))
+        if enemies is None:
+            return None
+        return list(enemies.values())
+
+    def move_creature_in_battle_index(self, creature, old_hexlabel,
+                                      new_hexlabel):
+        """Record that creature moved from old_hexlabel to new_hexlabel."""
+        markerid = creature.legion.markerid
+        self.battle_rangestrike_candidates = {}
+        enemies = self.battle_adjacent_enemies.pop(id(creature), {})
+        for key in enemies:
+            self.battle_adjacent_enemies.get(key, {}).pop(id(creature), None)
+        mask = self.battle_markerid_to_mask.get(markerid, 0)
+        creatures = self.battle_hexlabel_to_creatures.get(old_hexlabel)
+        if creatures:
+            for ii, creature2 in enumerate(creatures):
+                if creature2 is creature:
+                    del creatures[ii]
+                    break
+            if not creatures:
+                del self.battle_hexlabel_to_creatures[old_hexlabel]
+                mask &= ~BattleMap.hexlabel_to_bit[old_hexlabel]
+            else:
+                # Several creatures can share an entrance.
+                for legion in self.battle_legions:
+                    if legion.markerid == markerid:
+                        for creature2 in legion.creatures:
+                            if (creature2 is not creature and
+                                    creature2.hexlabel == old_hexlabel):
+                                break
+                        else:
+                            mask &= ~BattleMap.hexlabel_to_bit[old_hexlabel]
+        if new_hexlabel is not None:
+            self.battle_hexlabel_to_creatures.setdefault(
+                new_hexlabel, []).append(creature)
+            mask |= BattleMap.hexlabel_to_bit[new_hexlabel]
+        self.battle_markerid_to_mask[markerid] = mask
+        if new_hexlabel not in (None, "ATTACKER", "DEFENDER"):
+            enemies = self.find_adjacent_enemies(new_hexlabel,
+                                                 creature.legion)
+            self.battle_adjacent_enemies[id(creature)] = enemies
+            for key in enemies:
+                self.battle_adjacent_enemies.setdefault(key, {})[
+                    id(creature)] = creature
+
+    def check_battle_creature_index(self):
+        """Raise AssertionError if battle_hexlabel_to_creatures,
+        battle_markerid_to_mask, or battle_adjacent_enemies does not match
+        the creatures in the battle legions."""
+        expected = {}
+        expected_masks = {}
+        for legion in self.battle_legions:
+            expected_masks[legion.markerid] = 0
+            for creature in legion.creatures:
+                if creature.hexlabel is not None:
+                    expected.setdefault(creature.hexlabel, []).append(
+                        creature)
+                    expected_masks[legion.markerid] |= \
+                        BattleMap.hexlabel_to_bit[creature.hexlabel]
+        indexed = self.battle_hexlabel_to_creatures
+        if set(expected) != set(indexed):
+            raise AssertionError("battle index has wrong hexes",
+                                 sorted(expected), sorted(indexed))
+        for hexlabel, creatures in expected.items():
+            if (sorted(map(id, creatures)) !=
+                    sorted(map(id, indexed[hexlabel]))):
+                raise AssertionError("battle index wrong in hex", hexlabel,
+                                     creatures, indexed[hexlabel])
+        for markerid, mask in expected_masks.items():
+            if self.battle_markerid_to_mask.get(markerid, 0) != mask:
+                raise AssertionError("battle mask wrong for legion", markerid,
+                                     bin(mask), bin(
+                                         self.battle_markerid_to_mask.get(
+                                             markerid, 0)))
+        expected_adjacent = {}
+        for legion in self.battle_legions:
+            for creature in legion.creatures:
+                if creature.hexlabel is not None and not creature.offboard:
+                    expected_adjacent[id(creature)] = sorted(
+                        self.find_adjacent_enemies(creature.hexlabel,
+                                                   legion))
+        adjacent = dict((key, sorted(enemies)) for key, enemies in
+                        self.battle_adjacent_enemies.items())
+        if expected_adjacent != adjacent:
+            raise AssertionError("battle engagements wrong",
+                                 expected_adjacent, adjacent)
 
     def battle_hex_entry_cost(self, creature, terrain, border):
         """Return the cost for creature to enter a battle hex with terrain,
@@ -1213,60 +1625,92 @@ class Game(Observed):
                 return maxsize
         return 1
 
+    def battle_move_costs(self, creature):
+        """Return movement costs for creature's type on the current battle
+        map, as a list indexed by hex id of [(id2, entry_cost, move_cost)].
+
+        entry_cost is the cost to land in neighboring hex id2, and
+        move_cost is the cost to get into or over it, whichever is
+        cheaper.  These only depend on the map and the creature's type, so
+        they are computed once per map and cached.
+        """
+        costs = self.battlemap.move_costs.get(creature.name)
+        if costs is None:
+            costs = [[] for hexlabel in BattleMap.id_to_hexlabel]
+            for hex1 in self.battlemap.hexes.values():
+                neighbor_costs = costs[BattleMap.hexlabel_to_id[hex1.label]]
+                for hexside, hex2 in hex1.neighbors.items():
+                    if hex1.entrance:
+                        # Ignore hexside penalties from entrances.  There
+                        # aren't any on the standard boards, and this avoids
+                        # having to properly compute the real hexside.
+                        border = None
+                    else:
+                        border = hex1.opposite_border(hexside)
+                    cost = self.battle_hex_entry_cost(creature, hex2.terrain,
+                                                      border)
+                    if creature.flies:
+                        flyover_cost = self.battle_hex_flyover_cost(
+                            creature, hex2.terrain)
+                    else:
+                        flyover_cost = maxsize
+                    neighbor_costs.append((BattleMap.hexlabel_to_id[
+                                           hex2.label], cost,
+                                           min(cost, flyover_cost)))
+            self.battlemap.move_costs[creature.name] = costs
+        return costs
+
     def _find_battle_moves_inner(self, creature, hexlabel, movement_left,
                                  ignore_mobile_allies=False):
         """Return a set of all hexlabels to which creature can move,
         starting from hexlabel, with movement_left.
 
         Do not include hexlabel itself.
+
+        Reaching a hex with more movement left can never lead to fewer
+        moves, so only expand each hex once, with the most movement left
+        that it can be reached with.
         """
-        result = set()
         if movement_left <= 0:
-            return result
-        hex1 = self.battlemap.hexes[hexlabel]
-        for hexside, hex2 in hex1.neighbors.items():
-            try:
-                creature2 = self.creatures_in_battle_hex(hex2.label).pop()
-            except KeyError:
-                creature2 = None
-            if (creature.flies or not creature2 or (
-                    ignore_mobile_allies and
-                    creature2.legion == creature.legion and
-                    creature2.mobile)):
-                if hex1.entrance:
-                    # Ignore hexside penalties from entrances.  There aren't
-                    # any on the standard boards, and this avoids having to
-                    # properly compute the real hexside.
-                    border = None
+            return set()
+        costs = self.battle_move_costs(creature)
+        occupied_mask = self.battle_occupied_mask
+        # Occupied hex id to whether creature may land there anyway
+        id_to_open = {}
+        start_id = BattleMap.hexlabel_to_id[hexlabel]
+        best_movement_left = [0] * len(costs)
+        best_movement_left[start_id] = movement_left
+        result_mask = 0
+        heap = [(-movement_left, start_id)]
+        while heap:
+            negative_movement_left, id1 = heapq.heappop(heap)
+            movement_left1 = -negative_movement_left
+            if movement_left1 < best_movement_left[id1]:
+                continue
+            for id2, cost, min_cost in costs[id1]:
+                bit = 1 << id2
+                if not occupied_mask & bit:
+                    is_open = True
+                elif not ignore_mobile_allies:
+                    is_open = False
                 else:
-                    border = hex1.opposite_border(hexside)
-                cost = self.battle_hex_entry_cost(creature, hex2.terrain,
-                                                  border)
-                if cost <= movement_left:
-                    try:
+                    is_open = id_to_open.get(id2)
+                    if is_open is None:
                         creature2 = self.creatures_in_battle_hex(
-                            hex2.label).pop()
-                    except KeyError:
-                        creature2 = None
-                    if (not creature2 or (
-                            ignore_mobile_allies and
-                            creature2.legion == creature.legion and
-                            creature2.mobile)):
-                        result.add(hex2.label)
-                if creature.flies:
-                    flyover_cost = self.battle_hex_flyover_cost(creature,
-                                                                hex2.terrain)
-                else:
-                    flyover_cost = maxsize
-                min_cost = min(cost, flyover_cost)
-                if min_cost < movement_left:
-                    result.update(self._find_battle_moves_inner(
-                                  creature,
-                                  hex2.label,
-                                  movement_left - min_cost,
-                                  ignore_mobile_allies))
-        result.discard(hexlabel)
-        return result
+                            BattleMap.id_to_hexlabel[id2]).pop()
+                        is_open = (creature2.legion == creature.legion and
+                                   creature2.mobile)
+                        id_to_open[id2] = is_open
+                if creature.flies or is_open:
+                    if cost <= movement_left1 and is_open:
+                        result_mask |= bit
+                    if min_cost < movement_left1:
+                        movement_left2 = movement_left1 - min_cost
+                        if movement_left2 > best_movement_left[id2]:
+                            best_movement_left[id2] = movement_left2
+                            heapq.heappush(heap, (-movement_left2, id2))
+        result_mask &= ~(1 << start_id)
+        return set(BattleMap.mask_to_hexlabels(result_mask))
 
     def find_battle_moves(self, creature, ignore_mobile_allies=False):
         """Return a set of all hexlabels to which creature can move,
@@ -1441,7 +1885,7 @@ class Game(Observed):
             if legion.dead:
                 logging.info("%s is dead", legion)
                 return True
-        if self.battle_turn > 7:
+        if self.battle_turn is not None and self.battle_turn > 7:
             logging.info("battle_turn > 7; time loss")
             return True
         return False
@@ -1506,7 +1950,7 @@ class Game(Observed):
         if (not self.pending_summon and not self.pending_reinforcement and not
                 self.pending_acquire):
             self._cleanup_battle()
-        reactor.callLater(1, self._end_dead_player_turn)
+        self.clock.callLater(1, self._end_dead_player_turn)
 
     def _end_dead_player_turn(self):
         """If the active player is dead then advance phases if possible."""
@@ -1983,7 +2427,7 @@ class Game(Observed):
                 return
             angels = [Creature.Creature(name) for name in action.angel_names]
             legion.acquire_angels(angels)
-            reactor.callLater(1, self._end_dead_player_turn)
+            self.clock.callLater(1, self._end_dead_player_turn)
 
         elif isinstance(action, Action.DoNotAcquireAngels):
             player = self.get_player_by_name(action.playername)
@@ -1991,7 +2435,7 @@ class Game(Observed):
             if legion is None:
                 return
             legion.do_not_acquire_angels()
-            reactor.callLater(1, self._end_dead_player_turn)
+            self.clock.callLater(1, self._end_dead_player_turn)
 
         elif isinstance(action, Action.EliminatePlayer):
             winner_player = self.get_player_by_name(action.winner_playername)
@@ -2023,12 +2467,12 @@ class Game(Observed):
             self._update_finish_order(winner_player, loser_player)
             if action.check_for_victory:
                 self.check_for_victory()
-            reactor.callLater(1, self._end_dead_player_turn)
+            self.clock.callLater(1, self._end_dead_player_turn)
 
         elif isinstance(action, Action.GameOver):
             self.finish_time = action.finish_time
-            reactor.callLater(1, self._cleanup_dead_players,
-                              action.winner_names)
+            self.clock.callLater(1, self._cleanup_dead_players,
+                                 action.winner_names)
 
         elif isinstance(action, Action.Withdraw):
             if action.game_name == self.name:
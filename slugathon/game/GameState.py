@@ -0,0 +1,408 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+"""Compact, immutable snapshots of the game, for the AI to search on.
+
+Asking what would happen if a legion moved somewhere, by moving the real
+Legion and putting it back afterward, is slow, cannot be done in two
+places at once, and corrupts the game if a restore is missed.  Instead,
+take a snapshot and make changed copies of it.  A snapshot is built of
+namedtuples, and a copy shares everything that did not change.
+"""
+
+
+from collections import namedtuple
+
+from slugathon.game import (Game, Legion, Creature, Player, BattleMap,
+                            MasterBoard, Phase)
+
+
+# {(creature_name, power, mterrain): (score, sort_value, combat_value,
+#  terrain_combat_value)}
+_creature_values = {}
+
+
+def creature_values(creature_name, power, mterrain):
+    """Return (score, sort_value, combat_value, terrain_combat_value) for a
+    creature_name in a masterhex of type mterrain.
+
+    power is the Titan's power, and None for other creatures.
+    """
+    key = (creature_name, power, mterrain)
+    values = _creature_values.get(key)
+    if values is None:
+        creature = Creature.Creature(creature_name)
+        if power is not None:
+            # A Creature with no legion has its base power, so give the
+            # Titan its player's.
+            creature._power = power
+        values = _creature_values[key] = (creature.score,
+                                          creature.sort_value,
+                                          creature.combat_value,
+                                          creature.combat_value_in(mterrain))
+    return values
+
+
+class PlayerState(namedtuple("PlayerState", ["name", "score", "teleported",
+                                             "movement_roll"])):
+
+    """One player, as seen by a GameState."""
+
+    __slots__ = ()
+
+    can_titan_teleport = Player.Player.can_titan_teleport
+    titan_power = Player.Player.titan_power
+
+
+class LegionState(namedtuple("LegionState", ["markerid", "playername",
+                                             "hexlabel", "creature_names",
+                                             "moved", "recruited"])):
+
+    """One legion, as seen by a GameState.
+
+    creature_names holds only living creatures.
+    """
+
+    __slots__ = ()
+
+    @property
+    def height(self):
+        return len(self.creature_names)
+
+    @property
+    def num_lords(self):
+        return sum(1 for creature_name in self.creature_names
+                   if Creature.Creature(creature_name).is_lord)
+
+
+class GameState(namedtuple("GameState", ["board", "turn",
+                                         "active_playername", "players",
+                                         "legions", "hexlabel_to_markerids",
+                                         "caretaker_counts"])):
+
+    """The master board part of a Game.
+
+    players is {playername: PlayerState}, legions is {markerid:
+    LegionState}, hexlabel_to_markerids is {hexlabel: tuple of markerids},
+    and caretaker_counts is {creature_name: number left}.  None of them
+    may be changed in place; the methods that change the state return a
+    new GameState that copies only what changed.
+    """
+
+    __slots__ = ()
+
+    def legions_in_hex(self, hexlabel):
+        """Return a list of LegionStates in hexlabel."""
+        legions = self.legions
+        return [legions[markerid] for markerid in
+                self.hexlabel_to_markerids.get(hexlabel, ())]
+
+    def friendly_legions(self, playername, hexlabel=None):
+        """Return a list of playername's LegionStates, in hexlabel if not
+        None."""
+        if hexlabel is None:
+            legions = self.legions.values()
+        else:
+            legions = self.legions_in_hex(hexlabel)
+        return [legion for legion in legions
+                if legion.playername == playername]
+
+    def enemy_legions(self, playername, hexlabel=None):
+        """Return a list of other players' LegionStates, in hexlabel if not
+        None."""
+        if hexlabel is None:
+            legions = self.legions.values()
+        else:
+            legions = self.legions_in_hex(hexlabel)
+        return [legion for legion in legions
+                if legion.playername != playername]
+
+    def _values(self, legion, index, hexlabel=None):
+        if hexlabel is None:
+            hexlabel = legion.hexlabel
+        mterrain = self.board.hexes[hexlabel].terrain
+        titan_power = self.players[legion.playername].titan_power
+        total = 0
+        for creature_name in legion.creature_names:
+            if creature_name == "Titan":
+                power = titan_power
+            else:
+                power = None
+            total += creature_values(creature_name, power, mterrain)[index]
+        return total
+
+    def score(self, legion):
+        """Return the point value of legion."""
+        return self._values(legion, 0)
+
+    def sort_value(self, legion):
+        """Return a rough indication of legion's value."""
+        return self._values(legion, 1)
+
+    def combat_value(self, legion):
+        """Return a rough indication of legion's combat value."""
+        return self._values(legion, 2)
+
+    def terrain_combat_value(self, legion, hexlabel=None):
+        """Return a rough indication of legion's combat value, considering
+        the terrain in hexlabel, or where it is if hexlabel is None."""
+        return self._values(legion, 3, hexlabel)
+
+    def available_recruits_and_recruiters(self, legion, mterrain):
+        """Return the same list as Legion.available_recruits_and_recruiters
+        for legion in a masterhex of type mterrain."""
+        return Legion.find_recruits_and_recruiters(legion.creature_names,
+                                                   mterrain,
+                                                   self.caretaker_counts)
+
+    def available_recruits(self, legion, mterrain):
+        """Return the same list as Legion.available_recruits for legion in
+        a masterhex of type mterrain."""
+        recruits = []
+        for tup in self.available_recruits_and_recruiters(legion, mterrain):
+            recruit = tup[0]
+            if recruit not in recruits:
+                recruits.append(recruit)
+        return recruits
+
+    def _occupancy(self, legion):
+        """Return (enemy_hexlabels, friendly_hexlabels, ally_hexlabels),
+        sets of the hexlabels of legions in legion's way, for the movement
+        rules in Game."""
+        playername = legion.playername
+        enemy_hexlabels = set()
+        friendly_hexlabels = set()
+        ally_hexlabels = set()
+        for legion2 in self.legions.values():
+            if legion2.playername != playername:
+                enemy_hexlabels.add(legion2.hexlabel)
+            else:
+                friendly_hexlabels.add(legion2.hexlabel)
+                if legion2.markerid != legion.markerid:
+                    ally_hexlabels.add(legion2.hexlabel)
+        return enemy_hexlabels, friendly_hexlabels, ally_hexlabels
+
+    def find_normal_moves(self, legion, hexlabel, roll, block=None,
+                          came_from=None):
+        """Return a set of (hexlabel, entry_side) tuples for the
+        non-teleport moves of legion from hexlabel, like
+        Game.find_normal_moves."""
+        (enemy_hexlabels, friendly_hexlabels,
+         ally_hexlabels) = self._occupancy(legion)
+        return Game.normal_moves(self.board, hexlabel, roll, enemy_hexlabels,
+                                 friendly_hexlabels, ally_hexlabels, block,
+                                 came_from)
+
+    def find_tower_teleport_moves(self, legion, hexlabel):
+        """Return set of (hexlabel, TELEPORT) describing where legion can
+        tower teleport from hexlabel."""
+        return Game.tower_teleport_moves(self.board,
+                                         self.board.hexes[hexlabel],
+                                         legion.num_lords,
+                                         set(self.hexlabel_to_markerids))
+
+    def find_titan_teleport_moves(self, legion):
+        """Return set of (hexlabel, TELEPORT) describing where legion can
+        titan teleport."""
+        (enemy_hexlabels, friendly_hexlabels,
+         ally_hexlabels) = self._occupancy(legion)
+        player = self.players[legion.playername]
+        return Game.titan_teleport_moves(player.can_titan_teleport,
+                                         "Titan" in legion.creature_names,
+                                         enemy_hexlabels, friendly_hexlabels)
+
+    def find_all_teleport_moves(self, legion, hexlabel, roll):
+        """Return set of (hexlabel, TELEPORT) tuples describing where legion
+        can teleport from hexlabel."""
+        moves = set()
+        if not Game.can_teleport(roll,
+                                 self.players[legion.playername].teleported):
+            return moves
+        moves.update(self.find_tower_teleport_moves(legion, hexlabel))
+        moves.update(self.find_titan_teleport_moves(legion))
+        return moves
+
+    def find_all_moves(self, legion, hexlabel, roll):
+        """Return set of (hexlabel, entry_side) tuples describing where
+        legion can move from hexlabel."""
+        moves = self.find_normal_moves(legion, hexlabel, roll)
+        moves.update(self.find_all_teleport_moves(legion, hexlabel, roll))
+        return moves
+
+    def move_legion(self, markerid, hexlabel):
+        """Return a copy of this state with legion markerid moved to
+        hexlabel."""
+        legion = self.legions[markerid]
+        if legion.hexlabel == hexlabel:
+            return self
+        legions = dict(self.legions)
+        legions[markerid] = legion._replace(hexlabel=hexlabel)
+        hexlabel_to_markerids = dict(self.hexlabel_to_markerids)
+        markerids = tuple(markerid2 for markerid2 in
+                          hexlabel_to_markerids[legion.hexlabel]
+                          if markerid2 != markerid)
+        if markerids:
+            hexlabel_to_markerids[legion.hexlabel] = markerids
+        else:
+            del hexlabel_to_markerids[legion.hexlabel]
+        hexlabel_to_markerids[hexlabel] = (
+            hexlabel_to_markerids.get(hexlabel, ()) + (markerid,))
+        return self._replace(legions=legions,
+                             hexlabel_to_markerids=hexlabel_to_markerids)
+
+
+def snapshot(game):
+    """Return a GameState of the master board in game."""
+    players = {}
+    legions = {}
+    hexlabel_to_markerids = {}
+    for player in game.players:
+        players[player.name] = PlayerState(player.name, player.score,
+                                           player.teleported,
+                                           player.movement_roll)
+        for legion in player.legions:
+            legions[legion.markerid] = LegionState(
+                legion.markerid, player.name, legion.hexlabel,
+                tuple(legion.living_creature_names), legion.moved,
+                legion.recruited)
+            hexlabel_to_markerids[legion.hexlabel] = (
+                hexlabel_to_markerids.get(legion.hexlabel, ()) +
+                (legion.markerid,))
+    if game.active_player is None:
+        active_playername = None
+    else:
+        active_playername = game.active_player.name
+    return GameState(game.board, game.turn, active_playername, players,
+                     legions, hexlabel_to_markerids,
+                     dict(game.caretaker.counts))
+
+
+class CreatureState(namedtuple("CreatureState", ["name", "hexlabel", "hits",
+                                                 "moved", "struck"])):
+
+    """One creature, as seen by a BattleState."""
+
+    __slots__ = ()
+
+
+class BattleLegionState(namedtuple("BattleLegionState",
+                                   ["markerid", "playername", "player_score",
+                                    "creatures"])):
+
+    """One legion in a battle, as seen by a BattleState.
+
+    creatures is a tuple of CreatureStates in the same order as the
+    Legion's creatures, dead ones included.
+    """
+
+    __slots__ = ()
+
+
+class BattleState(namedtuple("BattleState", ["game_name", "masterhex_label",
+                                             "mterrain", "entry_side",
+                                             "battle_turn", "battle_phase",
+                                             "active_markerid", "attacker",
+                                             "defender"])):
+
+    """The battle part of a Game.
+
+    It holds only strings, numbers, and tuples of them, so it can be
+    pickled and sent to another process.
+    """
+
+    __slots__ = ()
+
+    def legion(self, markerid):
+        """Return the BattleLegionState for markerid."""
+        if self.attacker.markerid == markerid:
+            return self.attacker
+        elif self.defender.markerid == markerid:
+            return self.defender
+        raise AssertionError("legion %s not in battle" % markerid)
+
+    def move_creature(self, markerid, index, hexlabel):
+        """Return a copy of this state with creature index of legion
+        markerid moved to hexlabel."""
+        legion = self.legion(markerid)
+        creatures = list(legion.creatures)
+        creatures[index] = creatures[index]._replace(hexlabel=hexlabel,
+                                                     moved=True)
+        legion = legion._replace(creatures=tuple(creatures))
+        if markerid == self.attacker.markerid:
+            return self._replace(attacker=legion)
+        return self._replace(defender=legion)
+
+
+def snapshot_battle(game):
+    """Return a BattleState of the battle in game."""
+    legions = []
+    for legion in (game.attacker_legion, game.defender_legion):
+        player = legion.player
+        legions.append(BattleLegionState(
+            legion.markerid, player.name, player.score,
+            tuple(CreatureState(creature.name, creature.hexlabel,
+                                creature.hits, creature.moved,
+                                creature.struck)
+                  for creature in legion.creatures)))
+    battlemap = game.battlemap
+    return BattleState(game.name, game.attacker_legion.hexlabel,
+                       battlemap.mterrain, battlemap.entry_side,
+                       game.battle_turn, str(game.battle_phase),
+                       game.battle_active_legion.markerid, legions[0],
+                       legions[1])
+
+
+# The MasterBoard, and {(mterrain, entry_side): BattleMap}, shared by the
+# games restore_battle builds.  Neither changes during a game, and
+# building them is most of the cost of a Game.
+_board = None
+_battlemaps = {}
+
+
+def restore_battle(battle_state):
+    """Return a Game rebuilt from battle_state.
+
+    The game has just the two players and legions in the battle, which is
+    all that battle scoring looks at, and shares its board and battle map
+    with the other games restored here.
+    """
+    global _board
+    if _board is None:
+        _board = MasterBoard.MasterBoard()
+    key = (battle_state.mterrain, battle_state.entry_side)
+    battlemap = _battlemaps.get(key)
+    if battlemap is None:
+        battlemap = _battlemaps[key] = BattleMap.BattleMap(*key)
+    game = Game.Game(battle_state.game_name, battle_state.attacker.playername,
+                     0, 0, 2, 6, started=True, board=_board)
+    legions = []
+    for legion_state in (battle_state.attacker, battle_state.defender):
+        player = game.get_player_by_name(legion_state.playername)
+        if player is None:
+            game.add_player(legion_state.playername)
+            player = game.get_player_by_name(legion_state.playername)
+        player.score = legion_state.player_score
+        creatures = Creature.n2c([creature_state.name for creature_state in
+                                  legion_state.creatures])
+        legion = Legion.Legion(player, legion_state.markerid, creatures,
+                               battle_state.masterhex_label)
+        player.markerid_to_legion[legion.markerid] = legion
+        legions.append(legion)
+    legions[0].entry_side = battle_state.entry_side
+    game._init_battle(legions[0], legions[1], battlemap)
+    for legion, legion_state in zip(legions, (battle_state.attacker,
+                                              battle_state.defender)):
+        for creature, creature_state in zip(legion.creatures,
+                                            legion_state.creatures):
+            creature.hexlabel = creature_state.hexlabel
+            creature.hits = creature_state.hits
+            creature.moved = creature_state.moved
+            creature.struck = creature_state.struck
+    game.battle_turn = battle_state.battle_turn
+    for phase in Phase.PhaseBattle:
+        if str(phase) == battle_state.battle_phase:
+            game.battle_phase = phase
+    game.battle_active_legion = game.find_legion(battle_state.active_markerid)
+    game.invalidate_battle_engagements()
+    return game
@@ -4,6 +4,7 @@ __license__ = "GNU GPL v2"
 
 import logging
 from collections import Counter
+from functools import cmp_to_key
 
 from slugathon.data import recruitdata, markerdata, playercolordata
 from slugathon.game import Creature, Action
@@ -16,6 +17,107 @@ def find_picname(markerid):
     return markerdata.data[color_name][index]
 
 
+def _gen_sublists(recruits):
+    """Generate a sublist of recruits, within which up- and down-recruiting
+    is possible."""
+    sublist = []
+    for tup in recruits:
+        if tup:
+            sublist.append(tup)
+        else:
+            yield sublist
+            sublist = []
+    yield sublist
+
+
+def _max_creatures_of_one_type(counts):
+    """Return the maximum number of creatures (not lords or demi-lords) of
+    the same type in counts, a Counter of creature names."""
+    maximum = 0
+    for name, num in counts.items():
+        if (num > maximum and Creature.Creature(name).is_creature):
+            maximum = num
+    return maximum
+
+
+def _compare_recruits(tup1, tup2):
+    ii = 0
+    while True:
+        if len(tup1) < ii + 1:
+            return -1
+        if len(tup2) < ii + 1:
+            return 1
+        if tup1[ii] != tup2[ii]:
+            c1 = Creature.Creature(tup1[ii])
+            c2 = Creature.Creature(tup2[ii])
+            diff = 100 * (c1.sort_value - c2.sort_value)
+            if diff != 0:
+                return int(diff)
+        ii += 1
+
+
+def find_recruits_and_recruiters(creature_names, mterrain, caretaker_counts):
+    """Return a list of tuples with creature names and recruiters that a
+    legion of creature_names could recruit in a masterhex with terrain type
+    mterrain, with caretaker_counts creatures of each type left.
+
+    Each tuple will contain the recruit as its first element, and the
+    recruiters (if any) as its remaining elements.
+
+    The list is sorted in the same order as within recruitdata.
+    """
+    result_list = []
+    counts = Counter(creature_names)
+    recruits = recruitdata.data[mterrain]
+    for sublist in _gen_sublists(recruits):
+        names = [tup[0] for tup in sublist]
+        nums = [tup[1] for tup in sublist]
+        for ii in range(len(sublist)):
+            name = names[ii]
+            num = nums[ii]
+            if ii >= 1:
+                prev = names[ii - 1]
+            else:
+                prev = None
+            if prev == recruitdata.ANYTHING:
+                # basic tower creature
+                for jj in range(ii + 1):
+                    if nums[jj] and caretaker_counts.get(names[jj]):
+                        result_list.append((names[jj],))
+            else:
+                if (prev == recruitdata.CREATURE and
+                   _max_creatures_of_one_type(counts) >= num):
+                    # guardian
+                    recruiters = []
+                    for name2, num2 in counts.items():
+                        if (num2 >= num and Creature.Creature(
+                                name2).is_creature):
+                            recruiters.append(name2)
+                    for jj in range(ii + 1):
+                        if nums[jj] and caretaker_counts.get(names[jj]):
+                            for recruiter in recruiters:
+                                li = [names[jj]]
+                                for kk in range(num):
+                                    li.append(recruiter)
+                                tup = tuple(li)
+                                result_list.append(tup)
+                if counts[prev] >= num:
+                    # recruit up
+                    if num and caretaker_counts.get(name):
+                        li = [name]
+                        for kk in range(num):
+                            li.append(prev)
+                        tup = tuple(li)
+                        result_list.append(tup)
+                if counts[name] and num:
+                    # recruit same or down
+                    for jj in range(ii + 1):
+                        if nums[jj] and caretaker_counts.get(names[jj]):
+                            result_list.append((names[jj], name))
+    result_list.sort(key=cmp_to_key(_compare_recruits))
+    return result_list
+
+
 class Legion(Observed):
 
     def __init__(self, player, markerid, creatures, hexlabel):
@@ -26,8 +128,11 @@ class Legion(Observed):
         self.creatures = creatures
         for creature in self.creatures:
             creature.legion = self
-        self.hexlabel = hexlabel  # an int not a str
         self.player = player
+        self._hexlabel = hexlabel  # an int not a str
+        # {id(Creature): tuple} of the features this legion's creatures
+        # add to the game's Zobrist hash while it is in play, or None.
+        self.zobrist_features = None
         self.moved = False
         self.teleported = False
         self.teleporting_lord = None
@@ -39,6 +144,30 @@ class Legion(Observed):
         self._angels_pending = 0
         self._archangels_pending = 0
 
+    @property
+    def hexlabel(self):
+        return self._hexlabel
+
+    @hexlabel.setter
+    def hexlabel(self, hexlabel):
+        """Move this legion to hexlabel, keeping the game's index of
+        legions by hex current if this legion is in play."""
+        if self.in_play:
+            game = self.player.game
+            game.remove_legion_from_hex(self, self._hexlabel)
+            self._hexlabel = hexlabel
+            game.add_legion_to_hex(self, hexlabel)
+        else:
+            self._hexlabel = hexlabel
+
+    @property
+    def in_play(self):
+        """Return True iff this legion is one of its player's legions,
+        rather than a hypothetical or a leftover."""
+        player = self.player
+        return (player is not None and player.game is not None and
+                player.markerid_to_legion.get(self.markerid) is self)
+
     @property
     def dead(self):
         """Return True iff this legion has been eliminated from battle."""
@@ -184,14 +313,29 @@ class Legion(Observed):
         creature = Creature.Creature(creature_name)
         creature.legion = self
         self.creatures.append(creature)
+        self.creatures_changed()
 
     def remove_creature_by_name(self, creature_name):
         for creature in self.creatures:
             if creature.name == creature_name:
                 self.creatures.remove(creature)
+                self.creatures_changed()
                 return
         raise ValueError("tried to remove missing creature")
 
+    def creatures_changed(self):
+        """Tell the game that creatures were added to, removed from, or
+        replaced in this legion, to keep its Zobrist hash and, in case this
+        legion is in battle, its battle index current."""
+        player = self.player
+        if player is not None and player.game is not None:
+            game = player.game
+            if self.zobrist_features is not None:
+                game.unhash_legion_creatures(self)
+                game.hash_legion_creatures(self)
+            if game.is_battle_legion(self):
+                game.reindex_battle_creatures()
+
     def can_be_split(self, turn):
         if turn == 1:
             return len(self) == 8
@@ -241,12 +385,14 @@ class Legion(Observed):
                     self.creatures.append(creature)
                     creature.legion = self
                     count2 -= 1
+            self.creatures_changed()
 
     def forget_creatures(self):
         """Make all creatures Unknown."""
         self.creatures = Creature.n2c(len(self) * ["Unknown"])
         for creature in self.creatures:
             creature.legion = self
+        self.creatures_changed()
 
     def move(self, hexlabel, teleport, teleporting_lord, entry_side):
         """Move this legion on the masterboard"""
@@ -275,28 +421,6 @@ class Legion(Observed):
     def can_flee(self):
         return self.num_lords == 0
 
-    def _gen_sublists(self, recruits):
-        """Generate a sublist of recruits, within which up- and down-recruiting
-        is possible."""
-        sublist = []
-        for tup in recruits:
-            if tup:
-                sublist.append(tup)
-            else:
-                yield sublist
-                sublist = []
-        yield sublist
-
-    def _max_creatures_of_one_type(self):
-        """Return the maximum number of creatures (not lords or demi-lords) of
-        the same type in this legion."""
-        counts = Counter(self.creature_names)
-        maximum = 0
-        for name, num in counts.items():
-            if (num > maximum and Creature.Creature(name).is_creature):
-                maximum = num
-        return maximum
-
     @property
     def can_recruit(self):
         """Return True iff the legion can currently recruit, if it moved
@@ -343,72 +467,8 @@ class Legion(Observed):
 
         The list is sorted in the same order as within recruitdata.
         """
-        result_list = []
-        counts = Counter(self.living_creature_names)
-        recruits = recruitdata.data[mterrain]
-        for sublist in self._gen_sublists(recruits):
-            names = [tup[0] for tup in sublist]
-            nums = [tup[1] for tup in sublist]
-            for ii in range(len(sublist)):
-                name = names[ii]
-                num = nums[ii]
-                if ii >= 1:
-                    prev = names[ii - 1]
-                else:
-                    prev = None
-                if prev == recruitdata.ANYTHING:
-                    # basic tower creature
-                    for jj in range(ii + 1):
-                        if nums[jj] and caretaker.counts.get(names[jj]):
-                            result_list.append((names[jj],))
-                else:
-                    if (prev == recruitdata.CREATURE and
-                       self._max_creatures_of_one_type() >= num):
-                        # guardian
-                        recruiters = []
-                        for name2, num2 in counts.items():
-                            if (num2 >= num and Creature.Creature(
-                                    name2).is_creature):
-                                recruiters.append(name2)
-                        for jj in range(ii + 1):
-                            if nums[jj] and caretaker.counts.get(names[jj]):
-                                for recruiter in recruiters:
-                                    li = [names[jj]]
-                                    for kk in range(num):
-                                        li.append(recruiter)
-                                    tup = tuple(li)
-                                    result_list.append(tup)
-                    if counts[prev] >= num:
-                        # recruit up
-                        if num and caretaker.counts.get(name):
-                            li = [name]
-                            for kk in range(num):
-                                li.append(prev)
-                            tup = tuple(li)
-                            result_list.append(tup)
-                    if counts[name] and num:
-                        # recruit same or down
-                        for jj in range(ii + 1):
-                            if nums[jj] and caretaker.counts.get(names[jj]):
-                                result_list.append((names[jj], name))
-
-        def cmp_helper(tup1, tup2):
-            ii = 0
-            while True:
-                if len(tup1) < ii + 1:
-                    return -1
-                if len(tup2) < ii + 1:
-                    return 1
-                if tup1[ii] != tup2[ii]:
-                    c1 = Creature.Creature(tup1[ii])
-                    c2 = Creature.Creature(tup2[ii])
-                    diff = 100 * (c1.sort_value - c2.sort_value)
-                    if diff != 0:
-                        return int(diff)
-                ii += 1
-
-        result_list.sort(cmp=cmp_helper)
-        return result_list
+        return find_recruits_and_recruiters(self.living_creature_names,
+                                            mterrain, caretaker.counts)
 
     def recruit_creature(self, creature, recruiter_names):
         """Recruit creature."""
@@ -432,6 +492,7 @@ class Legion(Observed):
             self.creatures.append(creature)
             self.recruiter_names_list.append(recruiter_names)
             creature.legion = self
+            self.creatures_changed()
             self.reveal_creatures([creature.name] + list(recruiter_names))
             self.recruited = True
 
@@ -442,6 +503,7 @@ class Legion(Observed):
             return
         player = self.player
         creature = self.creatures.pop()
+        self.creatures_changed()
         recruiter_names = self.recruiter_names_list.pop()
         logging.info("%s clearing self.recruited", self)
         self.recruited = False
@@ -459,6 +521,7 @@ class Legion(Observed):
             return
         player = self.player
         creature = self.creatures.pop()
+        self.creatures_changed()
         recruiter_names = self.recruiter_names_list.pop()
         logging.info("%s clearing self.recruited", self)
         self.recruited = False
@@ -486,16 +549,18 @@ class Legion(Observed):
     @property
     def sorted_creatures(self):
         """Return creatures, sorted in descending order of value."""
-        li = reversed(sorted((creature.sort_value, creature)
-                             for creature in self.creatures))
+        li = reversed(sorted(((creature.sort_value, creature)
+                              for creature in self.creatures),
+                             key=lambda tup: tup[0]))
         return [tup[1] for tup in li]
 
     @property
     def sorted_living_creatures(self):
         """Return living creatures, sorted in descending order of value."""
-        li = reversed(sorted((creature.sort_value, creature)
-                             for creature in self.creatures
-                             if not creature.dead))
+        li = reversed(sorted(((creature.sort_value, creature)
+                              for creature in self.creatures
+                              if not creature.dead),
+                             key=lambda tup: tup[0]))
         return [tup[1] for tup in li]
 
     @property
@@ -636,6 +701,7 @@ class Legion(Observed):
             caretaker.take_one(angel.name)
             self.creatures.append(angel)
             angel.legion = self
+            self.creatures_changed()
         self._angels_pending = 0
         self._archangels_pending = 0
         logging.info("end of acquire_angels %s", self)
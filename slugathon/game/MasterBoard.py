@@ -6,6 +6,18 @@ from slugathon.data import boarddata
 from slugathon.game import MasterHex
 
 
+# Movement constants
+ARCHES_AND_ARROWS = -1
+ARROWS_ONLY = -2
+
+# Longest possible normal move
+MAX_ROLL = 6
+
+
+def opposite(direction):
+    return (direction + 3) % 6
+
+
 class MasterBoard(object):
     """Model of the Titan MasterBoard.  No GUI logic allowed."""
     def __init__(self):
@@ -16,6 +28,9 @@ class MasterBoard(object):
             self.init_hex(hexdata)
         for hex1 in self.hexes.values():
             hex1.connect_to_neighbors()
+        # (hexlabel, roll, block, came_from) to tuple of paths
+        self.paths = {}
+        self.compute_paths()
 
     def compute_hexes_metadata(self):
         """Find the min, max, midpoint, width, and height of the hexes."""
@@ -30,6 +45,65 @@ class MasterBoard(object):
         self.width = self.max_x - self.min_x + 1
         self.height = self.max_y - self.min_y + 1
 
+    def compute_paths(self):
+        """Precompute terrain-only move paths for every hex and roll.
+
+        The board never changes, so this only needs to happen once.
+        """
+        for hexlabel in self.hexes:
+            for roll in range(1, MAX_ROLL + 1):
+                self.find_paths(hexlabel, roll)
+
+    def find_paths(self, hexlabel, roll, block=None, came_from=None):
+        """Return a tuple of terrain-only paths moving roll hexes from
+        hexlabel.
+
+        If block >= 0, go only that way.
+        If block == ARCHES_AND_ARROWS, use arches and arrows.
+        If block == ARROWS_ONLY, use only arrows.
+        Each path is a tuple of roll + 1 (hexlabel, entry_side) tuples,
+        starting with hexlabel itself.  Legions are ignored; the caller
+        must check occupancy along each path.
+        """
+        masterhex = self.hexes[hexlabel]
+        if block is None:
+            block = masterhex.find_block()
+            if block is None:
+                block = ARCHES_AND_ARROWS
+        key = (hexlabel, roll, block, came_from)
+        paths = self.paths.get(key)
+        if paths is None:
+            paths = self._find_paths_inner(masterhex, roll, block, came_from)
+            self.paths[key] = paths
+        return paths
+
+    def _find_paths_inner(self, masterhex, roll, block, came_from):
+        if came_from is None and not masterhex.tower:
+            # Starting hex, so there is no entry side.
+            entry_side = None
+        else:
+            entry_side = masterhex.find_entry_side(came_from)
+        step = (masterhex.label, entry_side)
+        if roll == 0:
+            return ((step,),)
+        if block >= 0:
+            directions = [block]
+        else:
+            if block == ARCHES_AND_ARROWS:
+                gates = ("ARCH", "ARROW", "ARROWS")
+            else:
+                gates = ("ARROW", "ARROWS")
+            directions = [direction for direction, gate in
+                          enumerate(masterhex.exits)
+                          if gate in gates and direction != came_from]
+        paths = []
+        for direction in directions:
+            neighbor = masterhex.neighbors[direction]
+            for path in self.find_paths(neighbor.label, roll - 1,
+                                        ARROWS_ONLY, opposite(direction)):
+                paths.append((step,) + path)
+        return tuple(paths)
+
     def init_hex(self, hexdata):
         assert len(hexdata) in (6, 8, 10)
         (label, x, y, terrain) = hexdata[:4]
@@ -5,7 +5,6 @@ __license__ = "GNU GPL v2"
 import logging
 
 from collections import Counter
-from twisted.internet import reactor
 
 from slugathon.util.Observed import Observed
 from slugathon.game import Action, Creature, Legion, Phase
@@ -13,6 +12,38 @@ from slugathon.data import playercolordata, creaturedata, markerdata
 from slugathon.util import Dice
 
 
+class LegionDict(dict):
+
+    """{str markerid : Legion} for one player.
+
+    Keeps the game's hexlabel-to-legions index and Zobrist hash current as
+    legions are added and removed.
+    """
+
+    def __init__(self, player):
+        dict.__init__(self)
+        self.player = player
+
+    def __setitem__(self, markerid, legion):
+        game = self.player.game
+        if game is not None:
+            old_legion = self.get(markerid)
+            if old_legion is not None:
+                game.remove_legion_from_hex(old_legion, old_legion.hexlabel)
+                game.unhash_legion_creatures(old_legion)
+            game.add_legion_to_hex(legion, legion.hexlabel)
+            game.hash_legion_creatures(legion)
+        dict.__setitem__(self, markerid, legion)
+
+    def __delitem__(self, markerid):
+        game = self.player.game
+        if game is not None and markerid in self:
+            legion = self[markerid]
+            game.remove_legion_from_hex(legion, legion.hexlabel)
+            game.unhash_legion_creatures(legion)
+        dict.__delitem__(self, markerid)
+
+
 class Player(Observed):
 
     """A person or AI who is (or was) actively playing in a game.
@@ -46,7 +77,7 @@ class Player(Observed):
         # legion is actually split off with this marker.
         self.selected_markerid = None
         # {str markerid : Legion}
-        self.markerid_to_legion = {}
+        self.markerid_to_legion = LegionDict(self)
         self.mulligans_left = 1
         self.movement_roll = None
         self.summoned = False
@@ -65,7 +96,7 @@ class Player(Observed):
         of importance."""
         value_legions = [(legion.sort_value, legion) for legion in
                          self.legions]
-        value_legions.sort()
+        value_legions.sort(key=lambda tup: tup[0])
         value_legions.reverse()
         return [legion for (value, legion) in value_legions]
 
@@ -186,6 +217,7 @@ class Player(Observed):
         parent.creatures = Creature.n2c(parent_creature_names)
         for creature in parent.creatures:
             creature.legion = parent
+        parent.creatures_changed()
         self.take_marker(child_markerid)
         new_legion2.add_observer(self.game)
         self.markerid_to_legion[child_markerid] = new_legion2
@@ -217,6 +249,9 @@ class Player(Observed):
         parent_creature_names = parent.creature_names
         child_creature_names = child.creature_names
         parent.creatures += child.creatures
+        for creature in child.creatures:
+            creature.legion = parent
+        parent.creatures_changed()
         child.remove_observer(self)
         del self.markerid_to_legion[child_markerid]
         self.markerids_left.add(child.markerid)
@@ -295,8 +330,10 @@ class Player(Observed):
 
     def friendly_legions(self, hexlabel=None):
         """Return a set of this player's legions, in hexlabel if not None."""
-        return set([legion for legion in self.legions if hexlabel in
-                    (None, legion.hexlabel)])
+        if hexlabel is None:
+            return set(self.legions)
+        return set([legion for legion in self.game.legions_in_hex(hexlabel)
+                    if legion.player is self])
 
     def enemy_legions(self, hexlabel=None):
         """Return a set of other players' legions, in hexlabel if not None."""
@@ -381,7 +418,7 @@ class Player(Observed):
     def remove_empty_legions(self):
         """Remove any legions with no creatures, caused by summoning out
         the only creature in the legion."""
-        for legion in self.legions:
+        for legion in list(self.legions):
             if not legion.creatures:
                 self.remove_legion(legion.markerid)
 
@@ -491,6 +528,7 @@ class Player(Observed):
         if not legion.creatures or legion.creatures[-1].name != creature_name:
             return
         legion.creatures.pop()
+        legion.creatures_changed()
         donor.add_creature_by_name(creature_name)
         creature = donor.creatures[-1]
         creature.legion = donor
@@ -543,7 +581,7 @@ class Player(Observed):
 
     def remove_all_legions(self):
         """Remove all legions, after being eliminated from the game."""
-        for legion in self.legions:
+        for legion in list(self.legions):
             self.remove_legion(legion.markerid)
 
     def die(self, scoring_player, check_for_victory):
@@ -569,7 +607,7 @@ class Player(Observed):
         self.has_titan = False
         action = Action.EliminatePlayer(self.game.name, scoring_player_name,
                                         self.name, check_for_victory)
-        reactor.callLater(0.1, self.notify, action)
+        self.game.clock.callLater(0.1, self.notify, action)
 
     def add_points(self, points):
         """Add points.  Do not acquire.
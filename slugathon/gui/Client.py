@@ -12,7 +12,7 @@ from twisted.internet import reactor
 from twisted.python import log
 from zope.interface import implementer
 
-from slugathon.net import config
+from slugathon.net import config, User
 from slugathon.util.Observer import IObserver
 from slugathon.util.Observed import Observed
 from slugathon.game import Action, Game
@@ -138,6 +138,10 @@ class Client(pb.Referenceable, Observed):
         observed = None
         self.update(observed, action, names)
 
+    def remote_update_batch(self, updates):
+        """Handle an update_batch from User.send_updates."""
+        User.apply_updates(self.remote_update, updates)
+
     def _maybe_pick_color(self, game):
         if (game.next_playername_to_pick_color == self.playername and
            self.pickcolor is None):
@@ -5,6 +5,7 @@ __license__ = "GNU GPL v2"
 import os
 import sqlite3
 import math
+import time
 from collections import namedtuple
 import logging
 
@@ -47,6 +48,19 @@ CREATE TABLE rank (
 );
 """
 
+# Also run against existing databases, which predate these tables.
+generation_ddl = """
+CREATE TABLE IF NOT EXISTS generation (
+    generation_id INTEGER PRIMARY KEY ASC,
+    finish_time INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS generation_player (
+    generation_id INTEGER REFERENCES generation(generation_id),
+    player_id INTEGER REFERENCES player(player_id)
+);
+"""
+
 
 class Ranking(namedtuple("Ranking", ["mu", "sigma"])):
 
@@ -75,6 +89,7 @@ class Results(object):
         self.enable_foreign_keys()
         if not exists:
             self.create_db()
+        self.connection.executescript(generation_ddl)
 
     def enable_foreign_keys(self):
         query = "PRAGMA foreign_keys = ON"
@@ -90,99 +105,174 @@ class Results(object):
         maybe it should be run from a thread to avoid blocking the reactor.
         But sqlite is not thread-safe so we can't reuse connections.
         """
+        self.save_games([game])
+
+    def save_games(self, games, generation=None):
+        """Save finished Games to the results database, in one transaction.
+
+        TrueSkill values are updated game by game in memory, and written
+        once per player at the end.
+
+        If generation is not None, also record that it finished, so that an
+        evolution run can resume after it.
+        """
         logging.info("")
         with self.connection:
             cursor = self.connection.cursor()
-            for player in game.players:
-                logging.info("%s %s", player.player_class, player.player_info)
+            ratings = {}  # player_id: trueskill.Rating
+            for game in games:
+                self._save_game(cursor, game, ratings)
+            query = """UPDATE player set mu = ?, sigma = ?
+                       WHERE player_id = ?"""
+            cursor.executemany(query, [(rating.mu, rating.sigma, player_id)
+                                       for player_id, rating in
+                                       ratings.items()])
+            if generation is not None:
+                query = """UPDATE generation SET finish_time = ?
+                           WHERE generation_id = ?"""
+                cursor.execute(query, (int(time.time()), generation))
+        logging.info("")
+
+    def add_generation(self, generation, player_ids, bps):
+        """Record that generation is made up of player_ids plus new
+        CleverBots with BotParams bps, and return all their player_ids.
 
-                # See if that player is already in the database
+        The new AIs and the generation are added in one transaction, and
+        the generation has no finish_time until save_games saves its games,
+        so an interrupted evolution run can play it again instead of
+        breeding another.
+        """
+        with self.connection:
+            cursor = self.connection.cursor()
+            player_ids = list(player_ids)
+            for bp in bps:
+                player_ids.append(self._insert_ai(cursor, bp))
+            query = "INSERT INTO generation (generation_id) VALUES (?)"
+            cursor.execute(query, (generation, ))
+            query = """INSERT INTO generation_player
+                       (generation_id, player_id) VALUES (?, ?)"""
+            cursor.executemany(query, [(generation, player_id)
+                                       for player_id in player_ids])
+        return player_ids
+
+    def _save_game(self, cursor, game, ratings):
+        """Save one finished Game, and update its players' TrueSkill
+        values in ratings, a dict of player_id to trueskill.Rating."""
+        for player in game.players:
+            logging.info("%s %s", player.player_class, player.player_info)
+
+            # See if that player is already in the database
+            query = """SELECT player_id FROM player
+                       where name = ? AND class = ?"""
+            cursor.execute(query, (player.name, player.player_class))
+            row = cursor.fetchone()
+            # If not, insert it.
+            if row is None:
+                query = """INSERT INTO player
+                           (name, class, info, mu, sigma)
+                           VALUES (?, ?, ?, ?, ?)"""
+                cursor.execute(query, (player.name, player.player_class,
+                                       player.player_info, DEFAULT_MU,
+                                       DEFAULT_SIGMA))
+                # And fetch the player_id.
                 query = """SELECT player_id FROM player
-                           where name = ? AND class = ?"""
-                cursor.execute(query, (player.name, player.player_class))
+                           where class = ? AND info = ?"""
+                cursor.execute(query, (player.player_class,
+                                       player.player_info))
                 row = cursor.fetchone()
-                # If not, insert it.
-                if row is None:
-                    query = """INSERT INTO player
-                               (name, class, info, mu, sigma)
-                               VALUES (?, ?, ?, ?, ?)"""
-                    cursor.execute(query, (player.name, player.player_class,
-                                           player.player_info, DEFAULT_MU,
-                                           DEFAULT_SIGMA))
-                    # And fetch the player_id.
-                    query = """SELECT player_id FROM player
-                               where class = ? AND info = ?"""
-                    cursor.execute(query, (player.player_class,
-                                           player.player_info))
-                    row = cursor.fetchone()
-                else:
-                    player_id = row["player_id"]
-                    # We may need to update info, if new fields were added.
-                    query = """UPDATE player SET info = ?
-                               where player_id = ?"""
-                    cursor.execute(query, (player.player_info, player_id))
-
+            else:
                 player_id = row["player_id"]
+                # We may need to update info, if new fields were added.
+                query = """UPDATE player SET info = ?
+                           where player_id = ?"""
+                cursor.execute(query, (player.player_info, player_id))
 
-            # Add the game.
-            query = """INSERT INTO game (name, start_time, finish_time)
-                       VALUES (?, ?, ?)"""
-            cursor.execute(query, (game.name, int(game.start_time),
-                                   int(game.finish_time)))
-            # Find the game_id for the just-inserted game.
-            query = """SELECT game_id FROM game WHERE
-                       name = ? AND start_time = ? AND finish_time = ?"""
-            cursor.execute(query, (game.name, int(game.start_time),
-                                   int(game.finish_time)))
-            row = cursor.fetchone()
-            game_id = row["game_id"]
-            rank = 1
-            for tup in game.finish_order:
-                for player in tup:
-                    # Find the player_id
-                    query = """SELECT player_id FROM player
-                               WHERE name = ? AND class = ? AND info = ?"""
-                    cursor.execute(query, (player.name, player.player_class,
-                                           player.player_info))
-                    row = cursor.fetchone()
-                    player_id = row["player_id"]
-                    # Add to rank.
-                    query = """INSERT INTO rank(player_id, game_id, rank)
-                               VALUES (?, ?, ?)"""
-                    cursor.execute(query, (player_id, game_id, rank))
-                rank += len(tup)
-
-            # Update trueskill values
-            # There is a slight bias when there are ties, so we process tied
-            # players in random order.
-            query = """SELECT p.player_id, p.mu, p.sigma, r.rank
-                       FROM player p, rank r
-                       WHERE p.player_id = r.player_id AND r.game_id = ?
-                       ORDER BY r.rank, RANDOM()"""
-            cursor.execute(query, (game_id, ))
-            rows = cursor.fetchall()
-            player_ids = []
-            rating_tuples = []
-            ranks = []
-            for row in rows:
+            player_id = row["player_id"]
+
+        # Add the game.
+        query = """INSERT INTO game (name, start_time, finish_time)
+                   VALUES (?, ?, ?)"""
+        cursor.execute(query, (game.name, int(game.start_time),
+                               int(game.finish_time)))
+        # Find the game_id for the just-inserted game.
+        query = """SELECT game_id FROM game WHERE
+                   name = ? AND start_time = ? AND finish_time = ?"""
+        cursor.execute(query, (game.name, int(game.start_time),
+                               int(game.finish_time)))
+        row = cursor.fetchone()
+        game_id = row["game_id"]
+        rank = 1
+        for tup in game.finish_order:
+            for player in tup:
+                # Find the player_id
+                query = """SELECT player_id FROM player
+                           WHERE name = ? AND class = ? AND info = ?"""
+                cursor.execute(query, (player.name, player.player_class,
+                                       player.player_info))
+                row = cursor.fetchone()
                 player_id = row["player_id"]
-                player_ids.append(player_id)
-                rank = row["rank"]
-                ranks.append(rank)
-                mu = row["mu"]
-                sigma = row["sigma"]
-                rating = trueskill.Rating(mu=mu, sigma=sigma)
-                rating_tuples.append((rating, ))
-            rating_tuples2 = trueskill.transform_ratings(rating_tuples, ranks)
-            while player_ids:
-                player_id = player_ids.pop()
-                rating = rating_tuples2.pop()[0]
-                mu = rating.mu
-                sigma = rating.sigma
-                query = """UPDATE player set mu = ?, sigma = ?
-                           WHERE player_id = ?"""
-                cursor.execute(query, (mu, sigma, player_id))
-        logging.info("")
+                # Add to rank.
+                query = """INSERT INTO rank(player_id, game_id, rank)
+                           VALUES (?, ?, ?)"""
+                cursor.execute(query, (player_id, game_id, rank))
+            rank += len(tup)
+
+        # Update trueskill values
+        # There is a slight bias when there are ties, so we process tied
+        # players in random order.
+        query = """SELECT p.player_id, p.mu, p.sigma, r.rank
+                   FROM player p, rank r
+                   WHERE p.player_id = r.player_id AND r.game_id = ?
+                   ORDER BY r.rank, RANDOM()"""
+        cursor.execute(query, (game_id, ))
+        rows = cursor.fetchall()
+        player_ids = []
+        rating_tuples = []
+        ranks = []
+        for row in rows:
+            player_id = row["player_id"]
+            player_ids.append(player_id)
+            rank = row["rank"]
+            ranks.append(rank)
+            rating = ratings.get(player_id)
+            if rating is None:
+                rating = trueskill.Rating(mu=row["mu"], sigma=row["sigma"])
+            rating_tuples.append((rating, ))
+        rating_tuples2 = trueskill.transform_ratings(rating_tuples, ranks)
+        while player_ids:
+            player_id = player_ids.pop()
+            ratings[player_id] = rating_tuples2.pop()[0]
+
+    def get_latest_generation(self):
+        """Return (generation, player_ids, finished) for the most recently
+        added generation, where finished is whether its games were saved,
+        or (0, [], True) if none has been added."""
+        with self.connection:
+            cursor = self.connection.cursor()
+            query = """SELECT generation_id, finish_time FROM generation
+                       ORDER BY generation_id DESC LIMIT 1"""
+            cursor.execute(query)
+            row = cursor.fetchone()
+            if row is None:
+                return (0, [], True)
+            generation = row["generation_id"]
+            query = """SELECT player_id FROM generation_player
+                       WHERE generation_id = ? ORDER BY player_id"""
+            cursor.execute(query, (generation, ))
+            player_ids = [row2["player_id"] for row2 in cursor.fetchall()]
+            return (generation, player_ids, row["finish_time"] is not None)
+
+    def get_rankings(self, player_ids):
+        """Return a dict of player_id to Ranking for player_ids."""
+        rankings = {}
+        with self.connection:
+            cursor = self.connection.cursor()
+            query = "SELECT mu, sigma FROM player WHERE player_id = ?"
+            for player_id in player_ids:
+                cursor.execute(query, (player_id, ))
+                row = cursor.fetchone()
+                rankings[player_id] = Ranking(row["mu"], row["sigma"])
+        return rankings
 
     def get_ranking(self, playername):
         """Return a Ranking object for one player name.
@@ -312,7 +402,14 @@ class Results(object):
         """Spawn a new AI, mutated from default_bot_params, and return
         its player_id."""
         bp = BotParams.default_bot_params.mutate_all_fields()
-        bot = CleverBot.CleverBot("spawn", config.DEFAULT_AI_TIME_LIMIT, bp)
+        player_id = self._insert_ai(cursor, bp)
+        logging.info("spawning new AI %s %s", player_id, bp)
+        return player_id
+
+    def _insert_ai(self, cursor, bp):
+        """Add a new CleverBot with BotParams bp, and return its
+        player_id."""
+        bot = CleverBot.CleverBot("ai", config.DEFAULT_AI_TIME_LIMIT, bp)
         info = bot.player_info
         logging.info("player_info %s", info)
         query = """INSERT INTO player (class, info, mu, sigma)
@@ -330,9 +427,15 @@ class Results(object):
         query = """UPDATE player SET name = ?
                    WHERE player_id = ?"""
         cursor.execute(query, (name, player_id))
-        logging.info("spawning new AI %s %s %s", player_id, name, bp)
         return player_id
 
+    def add_ai(self, bp):
+        """Add a new CleverBot with BotParams bp, and return its
+        player_id."""
+        with self.connection:
+            cursor = self.connection.cursor()
+            return self._insert_ai(cursor, bp)
+
     def _breed_new_ai(self, cursor, old_player_ids):
         """Breed a new AI, from two weighted-random experienced parents."""
         query = """SELECT p.player_id, p.mu FROM player p
@@ -355,27 +458,10 @@ class Results(object):
         info2 = self.get_player_info(player_id2)
         bp2 = BotParams.BotParams.fromstring(info2)
         bp3 = bp1.cross(bp2).mutate_random_field()
-        bot = CleverBot.CleverBot("child", config.DEFAULT_AI_TIME_LIMIT, bp3)
-        info = bot.player_info
-        logging.info("player_info %s", info)
-        query = """INSERT INTO player (class, info, mu, sigma)
-                   VALUES (?, ?, ?, ?)"""
-        cursor.execute(query, ("CleverBot", info, DEFAULT_MU,
-                               DEFAULT_SIGMA))
-        # And fetch the player_id.
-        query = """SELECT player_id FROM player
-                   where class = ? AND info = ?"""
-        cursor.execute(query, ("CleverBot", info))
-        row = cursor.fetchone()
-        player_id = row["player_id"]
-        # And update the name.
-        name = "ai%d" % player_id
-        query = """UPDATE player SET name = ?
-                   WHERE player_id = ?"""
-        cursor.execute(query, (name, player_id))
+        player_id = self._insert_ai(cursor, bp3)
         logging.info("father %s %s", player_id1, bp1)
         logging.info("mother %s %s", player_id2, bp2)
-        logging.info("baby %s %s %s", player_id, name, bp3)
+        logging.info("baby %s %s", player_id, bp3)
         return player_id
 
     def get_weighted_random_player_id(self, excludes=(), highest_mu=False):
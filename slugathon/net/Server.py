@@ -41,17 +41,24 @@ class Server(Observed):
 
     """A Slugathon server, which can host multiple games in parallel."""
 
-    def __init__(self, no_passwd, passwd_path, port, log_path):
+    def __init__(self, no_passwd, passwd_path, port, log_path,
+                 clock=reactor, results=None, setup_logging=True):
+        """clock schedules delayed calls for the server and its games, and
+        can be a twisted.internet.task.Clock to run games off the reactor.
+        results is the Results to save games in, or None to not save them.
+        """
         Observed.__init__(self)
         self.no_passwd = no_passwd
         self.passwd_path = passwd_path
         self.port = port
         self.games = []
         self.playernames = set()
-        self.results = Results.Results()
+        self.results = results
         # {game_name: set(ainame) we're waiting for
         self.game_to_waiting_ais = {}
-        self._setup_logging(log_path)
+        self.clock = clock
+        if setup_logging:
+            self._setup_logging(log_path)
 
     def _setup_logging(self, log_path):
         log_observer = log.PythonLoggingObserver()
@@ -110,7 +117,7 @@ class Server(Observed):
         results = []
         num_wanted = 100
         num_from_db = max(0, num_wanted - len(self.games))
-        if num_from_db:
+        if num_from_db and self.results is not None:
             results = self.results.get_game_info_tuples(num_from_db)
         for game in self.games[-num_wanted:]:
             results.append(game.info_tuple)
@@ -162,6 +169,7 @@ class Server(Observed):
                          player_time_limit=player_time_limit,
                          player_class=player_class,
                          player_info=player_info)
+        game.clock = self.clock
         self.games.append(game)
         game.add_observer(self)
         action = Action.FormGame(playername, game.name, game.create_time,
@@ -193,7 +201,7 @@ class Server(Observed):
                 set1.discard(playername)
                 if not set1:
                     game = self.name_to_game(game_name)
-                    reactor.callLater(1, game.start, game.owner.name)
+                    self.clock.callLater(1, game.start, game.owner.name)
             return True
         return False
 
@@ -208,7 +216,7 @@ class Server(Observed):
             if game.num_players < game.min_players:
                 self._spawn_ais(game)
                 # Reschedule this in case spawning AIs fails.
-                reactor.callLater(1, self.start_game, playername, game_name)
+                self.clock.callLater(1, self.start_game, playername, game_name)
                 return
             else:
                 if not game.started:
@@ -234,6 +242,10 @@ class Server(Observed):
 
     def _spawn_ais(self, game):
         logging.debug(game.name)
+        if self.results is None:
+            # AIs are picked from the results database.
+            logging.warning("%s no results to pick AIs from", game.name)
+            return
         excludes = set()
         for game3 in self.games:
             if not game3.over:
@@ -814,12 +826,15 @@ class Server(Observed):
 
     def get_player_data(self):
         """Return a list of player dicts for all players in the database."""
+        if self.results is None:
+            return []
         return self.results.get_player_data()
 
     def _finish_with_game(self, game):
         game.remove_observer(self)
         if game in self.games:
-            self.results.save_game(game)
+            if self.results is not None:
+                self.results.save_game(game)
             self.games.remove(game)
 
     def update(self, observed, action, names):
@@ -828,7 +843,7 @@ class Server(Observed):
             game = self.name_to_game(action.game_name)
             if game in self.games:
                 # Wait to ensure that EliminatePlayer got through.
-                reactor.callLater(1, self._finish_with_game, game)
+                self.clock.callLater(1, self._finish_with_game, game)
         self.notify(action, names)
 
 
@@ -868,7 +883,8 @@ def main():
     add_arguments(parser)
     args, extras = parser.parse_known_args()
     port = args.port
-    server = Server(args.no_passwd, args.passwd_path, args.port, args.log_path)
+    server = Server(args.no_passwd, args.passwd_path, args.port, args.log_path,
+                    results=Results.Results())
     realm = Realm.Realm(server)
     if args.no_passwd:
         checker = UniqueNoPassword(None, server=server)
@@ -23,6 +23,8 @@ class User(Avatar):
         self.name = name
         self.server = server
         self.client = client
+        # (action, names) waiting to be sent to client
+        self.pending_updates = []
         self.server.add_observer(self)
         self.logging_out = False
 
@@ -296,6 +298,38 @@ class User(Avatar):
         if (isinstance(action, Action.SplitLegion) and action.playername ==
            self.name and "Unknown" in action.parent_creature_names):
             return
-        def1 = self.client.callRemote("update", action, names)
+        # Queue updates and send everything from this reactor tick in
+        # one remote call, since one action often leads to several more.
+        if not self.pending_updates:
+            self.server.clock.callLater(0, self.send_updates)
+        self.pending_updates.append((action, names))
+
+    def send_updates(self):
+        """Send all queued updates to the client, in order.
+
+        One update goes as "update", and several as "update_batch", which
+        the client hands to apply_updates.
+        """
+        updates = self.pending_updates
+        self.pending_updates = []
+        if len(updates) == 1:
+            (action, names) = updates[0]
+            def1 = self.client.callRemote("update", action, names)
+        else:
+            def1 = self.client.callRemote("update_batch", updates)
         def1.addErrback(self.trap_connection_lost)
         def1.addErrback(self.log_failure)
+
+
+def apply_updates(remote_update, updates):
+    """Call a client's remote_update for each (action, names) tuple in an
+    update_batch sent by User.send_updates.
+
+    An error in one update is logged and the rest are still applied, just
+    as separate update calls would fail separately.
+    """
+    for (action, names) in updates:
+        try:
+            remote_update(action, names)
+        except Exception:
+            log.err()
@@ -2,12 +2,35 @@ __copyright__ = "Copyright (c) 2012 David Ripton"
 __license__ = "GNU GPL v2"
 
 
+import pickle
 import time
 
-from slugathon.ai import CleverBot
+from slugathon.ai import BotParams, CleverBot, ScoringPool
 from slugathon.game import Creature, Phase, Game
 
 
+def _make_battle():
+    now = time.time()
+    game = Game.Game("g1", "p0", now, now, 2, 6)
+    game.add_player("p1")
+    player0 = game.players[0]
+    player1 = game.players[1]
+    player0.assign_starting_tower(200)
+    player1.assign_starting_tower(100)
+    game.sort_players()
+    game.started = True
+    game.assign_color("p1", "Blue")
+    game.assign_color("p0", "Red")
+    game.assign_first_marker("p0", "Rd01")
+    game.assign_first_marker("p1", "Bu01")
+    rd01 = player0.markerid_to_legion["Rd01"]
+    bu01 = player1.markerid_to_legion["Bu01"]
+    rd01.move(101, False, None, 5)
+    bu01.move(101, False, None, 5)
+    game._init_battle(bu01, rd01)
+    return game
+
+
 def test_best7():
     assert CleverBot.best7([]) == set()
 
@@ -135,6 +158,43 @@ def test_gen_legion_moves():
     assert lm == []
 
 
+def test_gen_legion_moves_ordered():
+    cleverbot = CleverBot.CleverBot("player", 1)
+    movesets = [
+        ["B1", "A1", "A2"],
+        ["A1", "B1"],
+    ]
+    lm = list(cleverbot._gen_legion_moves(movesets))
+    assert lm == [
+        ["B1", "A1"],
+        ["A1", "B1"],
+        ["A2", "A1"],
+        ["A2", "B1"],
+    ]
+    # Nothing is consumed until asked for.
+    legion_moves = cleverbot._gen_legion_moves(movesets)
+    assert next(legion_moves) == ["B1", "A1"]
+
+    def prune(moves):
+        return moves[0] == "A2"
+    lm = list(cleverbot._gen_legion_moves(movesets, prune))
+    assert lm == [
+        ["B1", "A1"],
+        ["A1", "B1"],
+    ]
+    pruned = []
+
+    def prune2(moves):
+        pruned.append(moves)
+        return len(moves) == 2 and moves[1] == "B1"
+    lm = list(cleverbot._gen_legion_moves(movesets, prune2))
+    assert lm == [
+        ["B1", "A1"],
+        ["A2", "A1"],
+    ]
+    assert ("A1", "A1") not in pruned
+
+
 def test_score_legion_move_brush():
     now = time.time()
     game = Game.Game("g1", "p0", now, now, 2, 6)
@@ -865,3 +925,295 @@ def test_player_info():
     cleverbot = CleverBot.CleverBot("ai1", 1)
     assert cleverbot.player_info.startswith("BotParams(SQUASH=0.6, ")
     assert cleverbot.player_info.endswith(")")
+
+
+def test_find_move_order():
+    game = _make_battle()
+    defender = game.defender_legion
+    titan1 = defender.creatures[0]
+    angel1 = defender.creatures[1]
+    ogre1 = [creature for creature in defender.creatures
+             if creature.name == "Ogre"][0]
+    titan1.move("E5")
+    angel1.move("D5")
+    ogre1.move("C5")
+    for creature in defender.creatures:
+        creature.moved = False
+    game.battle_turn = 2
+    cleverbot = CleverBot.CleverBot("p0", 1)
+
+    # Each creature moves into the hex that the next one starts in.
+    creature_moves = [("Titan", "E5", "D5"), ("Angel", "D5", "C5"),
+                      ("Ogre", "C5", "C4")]
+    order = cleverbot._find_move_order(game, creature_moves)
+    assert order == list(reversed(creature_moves))
+    game.check_battle_creature_index()
+    assert titan1.hexlabel == "E5"
+
+    # A rotation, where every creature wants an occupied hex, so nobody
+    # can move.
+    creature_moves = [("Titan", "E5", "D5"), ("Angel", "D5", "C5"),
+                      ("Ogre", "C5", "E5")]
+    order = cleverbot._find_move_order(game, creature_moves)
+    assert sorted(order) == sorted(creature_moves)
+    sort_values = dict((creature.name, creature.sort_value)
+                       for creature in [titan1, angel1, ogre1])
+    assert cleverbot._score_perm(game, sort_values, order) == 0
+    game.check_battle_creature_index()
+    assert titan1.hexlabel == "E5"
+
+
+def _make_search():
+    """Return (game, creatures, movesets) for a small legion move search."""
+    game = _make_battle()
+    defender = game.defender_legion
+    attacker = game.attacker_legion
+    for creature, hexlabel in zip(defender.creatures, ["D5", "E4", "C4"]):
+        creature.move(hexlabel)
+    for creature, hexlabel in zip(attacker.creatures, ["C2", "D2", "E2"]):
+        creature.move(hexlabel)
+    for creature in defender.creatures[3:]:
+        creature.kill()
+    # Placing them counted as moving them.
+    for creature in defender.creatures:
+        creature.moved = False
+    game.battle_turn = 2
+    game.battle_phase = Phase.PhaseBattle.MANEUVER
+    creatures = defender.sorted_living_creatures
+    assert len(creatures) == 3
+    movesets = []
+    for creature in creatures:
+        moves = game.find_battle_moves(creature, ignore_mobile_allies=True)
+        moves.add(creature.hexlabel)
+        movesets.append(sorted(moves)[:5])
+    assert all(len(moveset) == 5 for moveset in movesets)
+    return game, creatures, movesets
+
+
+def test_search_legion_moves():
+    game, creatures, movesets = _make_search()
+    cleverbot = CleverBot.CleverBot("p0", 1000)
+
+    best_score = None
+    for legion_move in cleverbot._gen_legion_moves(movesets):
+        for creature, move in zip(creatures, legion_move):
+            creature.previous_hexlabel = creature.hexlabel
+            creature.hexlabel = move
+        score = cleverbot._score_legion_move(game, creatures)
+        for creature in creatures:
+            creature.hexlabel = creature.previous_hexlabel
+        if best_score is None or score > best_score:
+            best_score = score
+
+    # Every full legion move was scored above, so the search finds them
+    # all in the cache.
+    hits = cleverbot.score_cache.hits
+    misses = cleverbot.score_cache.misses
+    (legion_move, score, upper_bound, nodes,
+     pruned) = cleverbot._search_legion_moves(game, creatures, movesets)
+    assert abs(score - best_score) < 1e-9
+    assert upper_bound == score
+    assert nodes > 0
+    assert cleverbot.score_cache.hits > hits
+    assert cleverbot.score_cache.misses == misses
+    game.check_battle_creature_index()
+    assert [creature.hexlabel for creature in creatures] == [
+        "D5", "E4", "C4"]
+
+    # Out of time after the first legion move, but the bound still covers
+    # the best one.
+    cleverbot.ai_time_limit = 0
+    (legion_move, score, upper_bound, nodes,
+     pruned) = cleverbot._search_legion_moves(game, creatures, movesets)
+    assert score <= best_score + 1e-9
+    assert upper_bound >= best_score - 1e-9
+
+
+def test_scoring_pool():
+    game, creatures, movesets = _make_search()
+    cleverbot = CleverBot.CleverBot("p0", 1000)
+    score = cleverbot._search_legion_moves(game, creatures, movesets)[1]
+    scoring_pool = ScoringPool.ScoringPool(2)
+    try:
+        (legion_move, score2, upper_bound, nodes,
+         pruned) = scoring_pool.search_legion_moves(
+            cleverbot, ScoringPool.snapshot_battle(game, creatures[0].legion,
+                                                   creatures),
+            movesets, time.time() + 1000)
+    finally:
+        scoring_pool.shutdown()
+    assert abs(score2 - score) < 1e-9
+    assert upper_bound == score2
+    assert nodes > 0
+    assert [creature.hexlabel for creature in creatures] == [
+        "D5", "E4", "C4"]
+
+
+def test_legion_move_score():
+    game = _make_battle()
+    defender = game.defender_legion
+    attacker = game.attacker_legion
+    for creature, hexlabel in zip(defender.creatures,
+                                  ["D5", "E4", "C4", "D4"]):
+        creature.move(hexlabel)
+    for creature, hexlabel in zip(attacker.creatures,
+                                  ["C2", "D2", "E2", "F2"]):
+        creature.move(hexlabel)
+    game.battle_turn = 2
+    game.battle_phase = Phase.PhaseBattle.MANEUVER
+    cleverbot = CleverBot.CleverBot("p0", 1)
+    creatures = defender.sorted_living_creatures
+    legion_move_score = CleverBot.LegionMoveScore(cleverbot, game, creatures)
+    score = cleverbot._score_legion_move(game, creatures)
+    assert abs(legion_move_score.score - score) < 1e-9
+
+    for ii, hexlabel in [(0, "E5"), (1, "D3"), (2, "C3"), (1, "E3"),
+                         (3, "D4"), (0, "D5")]:
+        creature = creatures[ii]
+        start = creature.hexlabel
+        delta = legion_move_score.delta(ii, hexlabel)
+        assert creature.hexlabel == start
+        assert abs(legion_move_score.score - score) < 1e-9
+        legion_move_score.move(ii, hexlabel)
+        assert creature.hexlabel == hexlabel
+        new_score = cleverbot._score_legion_move(game, creatures)
+        assert abs(legion_move_score.score - new_score) < 1e-9
+        assert abs(delta - (new_score - score)) < 1e-9
+        assert legion_move_score.key == cleverbot._battle_position_hash(
+            game, creatures).value
+        score = new_score
+    game.check_battle_creature_index()
+
+    # The last position was scored just above, so it's cached now.
+    hits = cleverbot.score_cache.hits
+    assert cleverbot._score_legion_move(game, creatures) == score
+    assert cleverbot.score_cache.hits == hits + 1
+    creatures[0].hits += 1
+    misses = cleverbot.score_cache.misses
+    cleverbot._score_legion_move(game, creatures)
+    assert cleverbot.score_cache.misses == misses + 1
+
+    # The game's name is not part of the key.
+    key = cleverbot._battle_position_hash(game, creatures).value
+    game.name = game.name + "x"
+    assert cleverbot._battle_position_hash(game, creatures).value == key
+
+
+def test_restore_battle():
+    game = _make_battle()
+    defender = game.defender_legion
+    attacker = game.attacker_legion
+    for creature, hexlabel in zip(defender.creatures,
+                                  ["D5", "E4", "C4", "D4"]):
+        creature.move(hexlabel)
+    for creature, hexlabel in zip(attacker.creatures,
+                                  ["C2", "D2", "E2", "F2"]):
+        creature.move(hexlabel)
+    defender.creatures[1].hits = 2
+    game.get_player_by_name("p0").score = 150
+    game.battle_turn = 2
+    game.battle_phase = Phase.PhaseBattle.MANEUVER
+    cleverbot = CleverBot.CleverBot("p0", 1)
+    creatures = defender.sorted_living_creatures
+    snapshot = ScoringPool.snapshot_battle(game, defender, creatures)
+    snapshot = pickle.loads(pickle.dumps(snapshot))
+    game2, creatures2 = ScoringPool.restore_battle(snapshot)
+    assert game2 is not game
+    assert [(creature.name, creature.hexlabel, creature.hits)
+            for creature in creatures2] == [
+        (creature.name, creature.hexlabel, creature.hits)
+        for creature in creatures]
+    assert creatures2[0].power == creatures[0].power
+    assert game2.battle_phase is Phase.PhaseBattle.MANEUVER
+    assert game2.battle_active_legion.markerid == "Rd01"
+    game2.check_battle_creature_index()
+    cleverbot2 = CleverBot.CleverBot("p0", 1)
+    assert abs(cleverbot2._score_legion_move(game2, creatures2) -
+               cleverbot._score_legion_move(game, creatures)) < 1e-9
+
+    # Restored games share the board and battle map, which never change,
+    # but not creatures.
+    game3, creatures3 = ScoringPool.restore_battle(snapshot)
+    assert game3.board is game2.board
+    assert game3.battlemap is game2.battlemap
+    creatures3[0].move("E5")
+    assert creatures2[0].hexlabel == creatures[0].hexlabel
+    game2.check_battle_creature_index()
+
+
+def test_legion_move_bounds():
+    game = _make_battle()
+    defender = game.defender_legion
+    attacker = game.attacker_legion
+    for creature, hexlabel in zip(defender.creatures,
+                                  ["D5", "E4", "C4", "D4"]):
+        creature.move(hexlabel)
+    for creature, hexlabel in zip(attacker.creatures,
+                                  ["C2", "D2", "E2", "F2"]):
+        creature.move(hexlabel)
+    game.battle_turn = 2
+    game.battle_phase = Phase.PhaseBattle.MANEUVER
+    cleverbot = CleverBot.CleverBot("p0", 1)
+    creatures = defender.sorted_living_creatures
+    for creature in creatures:
+        creature.previous_hexlabel = "E6"
+    movesets = [[creature.hexlabel] for creature in creatures]
+    movesets[0].append("E5")
+    cleverbot._legion_move_bounds(game, creatures, movesets)
+    assert [creature.previous_hexlabel for creature in creatures] == [
+        "E6"] * len(creatures)
+    assert [creature.hexlabel for creature in defender.creatures[:4]] == [
+        "D5", "E4", "C4", "D4"]
+    game.check_battle_creature_index()
+
+
+def test_legion_move_bounds_negative_weights():
+    game = _make_battle()
+    defender = game.defender_legion
+    attacker = game.attacker_legion
+    defender.remove_creature_by_name("Gargoyle")
+    defender.remove_creature_by_name("Gargoyle")
+    defender.add_creature_by_name("Ranger")
+    for creature, hexlabel in zip(defender.creatures,
+                                  ["D5", "E4", "C4", "D4"]):
+        creature.move(hexlabel)
+    defender.creatures[-1].move("E5")
+    for creature in defender.creatures[1:-1]:
+        creature.kill()
+    for creature in defender.creatures:
+        creature.moved = False
+    for creature, hexlabel in zip(attacker.creatures, ["C2", "D2", "E2"]):
+        creature.move(hexlabel)
+    for creature in attacker.creatures[3:]:
+        creature.kill()
+    game.battle_turn = 2
+    # Own rangestrikes only count in the strike phase.
+    game.battle_phase = Phase.PhaseBattle.STRIKE
+    ranger = defender.creatures[-1]
+    # Evolution can flip the sign of any weight.
+    bp = BotParams.default_bot_params._replace(
+        RANGESTRIKE_BONUS=-10.0, HIT_BONUS=-5.0, ADJACENT_ALLY_BONUS=-1.0)
+    cleverbot = CleverBot.CleverBot("p0", 1, bot_params=bp)
+    creatures = defender.sorted_living_creatures
+    movesets = []
+    for creature in creatures:
+        moves = game.find_battle_moves(creature, ignore_mobile_allies=True)
+        moves.add(creature.hexlabel)
+        movesets.append(sorted(moves))
+    bases, mean_hits, num_kill_bonuses = cleverbot._legion_move_bounds(
+        game, creatures, movesets)
+    enemies = attacker.creatures
+    start_hexlabels = [creature.hexlabel for creature in creatures]
+    num_rangestrikes = 0
+    for legion_move in cleverbot._gen_legion_moves(movesets):
+        for creature, move in zip(creatures, legion_move):
+            creature.hexlabel = move
+        score = cleverbot._score_legion_move(game, creatures)
+        num_rangestrikes += bool(ranger.rangestrike_targets)
+        for creature, hexlabel in zip(creatures, start_hexlabels):
+            creature.hexlabel = hexlabel
+        bound = cleverbot._legion_move_bound(enemies, bases, mean_hits,
+                                             num_kill_bonuses, None, None,
+                                             legion_move)
+        assert bound >= score - 1e-9
+    assert num_rangestrikes
@@ -5,7 +5,7 @@ __license__ = "GNU GPL v2"
 import time
 from sys import maxsize
 
-from slugathon.game import Game, Phase, Creature, Legion
+from slugathon.game import Game, Phase, Creature, Legion, BattleMap
 
 
 class TestBattle(object):
@@ -50,6 +50,71 @@ class TestBattle(object):
         assert self.game.battle_active_player == \
             self.game.defender_legion.player
 
+    def test_battle_creature_index(self):
+        self.rd01.move(6, False, None, 3)
+        self.bu01.move(6, False, None, 3)
+        game = self.game
+        game._init_battle(self.bu01, self.rd01)
+        game.check_battle_creature_index()
+        assert len(game.creatures_in_battle_hex("DEFENDER")) == 4
+        assert len(game.creatures_in_battle_hex("ATTACKER")) == 4
+        defender = game.defender_legion
+        titan = defender.sorted_creatures[0]
+        titan.move("D1")
+        game.check_battle_creature_index()
+        assert game.creatures_in_battle_hex("D1") == set([titan])
+        assert game.creatures_in_battle_hex("D1", "Ogre") == set()
+        assert len(game.creatures_in_battle_hex("DEFENDER")) == 3
+        titan.undo_move()
+        game.check_battle_creature_index()
+        assert not game.is_battle_hex_occupied("D1")
+        # Temporary moves, as the AI does when scoring layouts.
+        titan.hexlabel = "E1"
+        assert game.is_battle_hex_occupied("E1")
+        titan.hexlabel = "DEFENDER"
+        game.check_battle_creature_index()
+        ogre = defender.sorted_creatures[3]
+        ogre.move("C1")
+        ogre.kill()
+        assert game.is_battle_hex_occupied("C1")
+        game.cleanup_dead_creatures()
+        game.check_battle_creature_index()
+        assert not game.is_battle_hex_occupied("C1")
+        game._cleanup_battle()
+        assert game.battle_hexlabel_to_creatures == {}
+
+    def test_battle_engagements(self):
+        self.rd01.move(6, False, None, 3)
+        self.bu01.move(6, False, None, 3)
+        game = self.game
+        game._init_battle(self.bu01, self.rd01)
+        assert game.battle_adjacent_enemies == {}
+        titan1 = game.defender_legion.sorted_creatures[0]
+        titan2 = game.attacker_legion.sorted_creatures[0]
+        ogre2 = game.attacker_legion.sorted_creatures[3]
+        titan1.move("D4")
+        titan2.move("D5")
+        ogre2.move("E3")
+        game.check_battle_creature_index()
+        assert titan1.engaged_enemies == set([titan2, ogre2])
+        assert titan2.engaged_enemies == set([titan1])
+        assert not titan2.mobile
+        ogre2.kill()
+        assert titan1.engaged_enemies == set([titan2])
+        assert titan1.dead_adjacent_enemies == set([ogre2])
+        ogre2.heal()
+        titan2.undo_move()
+        game.check_battle_creature_index()
+        assert titan1.engaged_enemies == set([ogre2])
+        assert titan2.engaged_enemies == set()
+        # Changes that bypass Creature.hexlabel need an explicit rebuild.
+        ogre2._hexlabel = "A1"
+        game.reindex_battle_creatures()
+        game.check_battle_creature_index()
+        assert titan1.engaged_enemies == set()
+        game._cleanup_battle()
+        assert game.battle_adjacent_enemies == {}
+
     def test_hex_entry_cost(self):
         titan = Creature.Creature("Titan")
         assert self.game.battle_hex_entry_cost(titan, "Bramble", None) == 2
@@ -114,6 +179,24 @@ class TestBattle(object):
                     "D3", "E3", "F3"])
         assert self.game.find_battle_moves(gargoyle) == set3
 
+    def test_battle_move_costs(self):
+        self.rd01.move(3, False, None, 3)
+        self.bu01.move(3, False, None, 3)
+        self.game._init_battle(self.bu01, self.rd01)
+        battlemap = self.game.battlemap
+        titan = self.game.defender_legion.sorted_creatures[0]
+        costs = self.game.battle_move_costs(titan)
+        assert battlemap.move_costs["Titan"] is costs
+        assert self.game.battle_move_costs(titan) is costs
+        for hexlabel, hex1 in battlemap.hexes.items():
+            neighbor_costs = costs[BattleMap.hexlabel_to_id[hexlabel]]
+            assert len(neighbor_costs) == len(hex1.neighbors)
+            for id2, cost, min_cost in neighbor_costs:
+                assert min_cost == cost
+                hexlabel2 = BattleMap.id_to_hexlabel[id2]
+                if battlemap.hexes[hexlabel2].terrain == "Tree":
+                    assert cost == maxsize
+
     def test_find_moves_marsh(self):
         self.rd01.move(41, False, None, 3)
         self.bu01.move(41, False, None, 3)
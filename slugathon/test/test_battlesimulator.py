@@ -0,0 +1,95 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+import random
+import time
+
+from slugathon.ai import BattleSimulator
+from slugathon.game import Game
+
+
+def _make_game():
+    now = time.time()
+    game = Game.Game("g1", "p0", now, now, 2, 6)
+    game.add_player("p1")
+    player0 = game.players[0]
+    player1 = game.players[1]
+    player0.assign_starting_tower(200)
+    player1.assign_starting_tower(100)
+    game.sort_players()
+    game.started = True
+    game.assign_color("p1", "Blue")
+    game.assign_color("p0", "Red")
+    game.assign_first_marker("p0", "Rd01")
+    game.assign_first_marker("p1", "Bu01")
+    rd01 = player0.markerid_to_legion["Rd01"]
+    bu01 = player1.markerid_to_legion["Bu01"]
+    rd01.move(3, False, None, 5)
+    bu01.move(3, False, None, 5)
+    return game, rd01, bu01
+
+
+def test_simulate():
+    game, rd01, bu01 = _make_game()
+    zobrist_hash = game.zobrist_hash
+    simulator = BattleSimulator.BattleSimulator(rd01, bu01,
+                                                rng=random.Random(1))
+    # Brush has some bramble, and nobody in starting legions is native.
+    assert len(simulator.sites) > 1
+    assert len(simulator.attackers) == len(rd01)
+    result = simulator.simulate(500)
+    assert result.battles == 500
+    assert (result.attacker_wins + result.defender_wins + result.draws ==
+            result.battles)
+    assert 0 < result.attacker_win_probability < 1
+    assert 0 < result.defender_win_probability < 1
+    assert 0 < result.expected_attacker_points < rd01.score
+    assert 0 < result.expected_defender_points < bu01.score
+    assert game.battlemap is None
+    assert game.zobrist_hash == zobrist_hash
+    game.check_zobrist_hash()
+    assert not any(creature.legion in (rd01, bu01) for creature in
+                   simulator.attackers + simulator.defenders)
+
+    simulator2 = BattleSimulator.BattleSimulator(rd01, bu01,
+                                                 rng=random.Random(1))
+    result2 = simulator2.simulate(500)
+    assert result2.attacker_wins == result.attacker_wins
+    assert result2.defender_points == result.defender_points
+
+    result3 = simulator.simulate(500, time.time() - 1)
+    assert result3.battles == 0
+    assert result3.defender_win_probability == 0
+
+
+def test_simulate_lopsided():
+    game, rd01, bu01 = _make_game()
+    for creature_name in ["Titan", "Angel", "Ogre", "Ogre", "Centaur",
+                          "Centaur"]:
+        rd01.remove_creature_by_name(creature_name)
+    assert rd01.creature_names == ["Gargoyle", "Gargoyle"]
+    simulator = BattleSimulator.BattleSimulator(rd01, bu01,
+                                                rng=random.Random(1))
+    result = simulator.simulate(200)
+    assert result.defender_win_probability == 1
+    assert result.expected_attacker_points == 0
+    simulator = BattleSimulator.BattleSimulator(bu01, rd01,
+                                                rng=random.Random(1))
+    result = simulator.simulate(200)
+    assert result.attacker_win_probability == 1
+    assert result.expected_defender_points == 0
+
+
+def test_simulate_during_battle():
+    game, rd01, bu01 = _make_game()
+    game._init_battle(bu01, rd01)
+    battlemap = game.battlemap
+    zobrist_hash = game.zobrist_hash
+    simulator = BattleSimulator.BattleSimulator(rd01, bu01,
+                                                rng=random.Random(1))
+    simulator.simulate(100)
+    assert game.battlemap is battlemap
+    assert game.zobrist_hash == zobrist_hash
+    game.check_zobrist_hash()
+    game.check_battle_creature_index()
@@ -146,3 +146,22 @@ def test_hex_width():
 
 def test_hex_height():
     assert board.hex_height == 8
+
+
+def test_find_paths():
+    paths = board.find_paths(200, 1)
+    assert set(path[-1] for path in paths) == set([(6, 5), (10, 1),
+                                                   (108, 3)])
+    for roll in range(1, MasterBoard.MAX_ROLL + 1):
+        for path in board.find_paths(1, roll):
+            assert len(path) == roll + 1
+            assert path[0] == (1, None)
+
+
+def test_find_paths_precomputed():
+    for hexlabel in board.hexes:
+        for roll in range(1, MasterBoard.MAX_ROLL + 1):
+            block = board.hexes[hexlabel].find_block()
+            if block is None:
+                block = MasterBoard.ARCHES_AND_ARROWS
+            assert (hexlabel, roll, block, None) in board.paths
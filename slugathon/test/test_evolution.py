@@ -0,0 +1,56 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+import tempfile
+from collections import Counter
+
+from slugathon.ai import Evolution
+from slugathon.net import Results
+
+
+def test_schedule():
+    with tempfile.NamedTemporaryFile(prefix="slugathon", suffix=".db",
+                                     delete=True) as tmp_file:
+        results = Results.Results(db_path=tmp_file.name)
+        evolution = Evolution.Evolution(results, 6, 3, 9, 2, 2, 1, 1)
+        player_ids, bps = evolution._initial_population()
+        assert player_ids == []
+        assert len(bps) == 6
+        player_ids = results.add_generation(3, player_ids, bps)
+        game_args = evolution._schedule(3, player_ids)
+        assert len(game_args) == 9
+        assert game_args[0][0] == "gen3_1"
+        counts = Counter(playername for args in game_args
+                         for playername, player_info in args[1])
+        assert sorted(counts) == ["ai%d" % player_id for player_id in
+                                  player_ids]
+        assert set(counts.values()) == set([3])
+
+
+def test_next_population():
+    with tempfile.NamedTemporaryFile(prefix="slugathon", suffix=".db",
+                                     delete=True) as tmp_file:
+        results = Results.Results(db_path=tmp_file.name)
+        evolution = Evolution.Evolution(results, 4, 2, 4, 2, 4, 1, 1)
+        player_ids = results.add_generation(
+            1, *evolution._initial_population())
+        with results.connection:
+            query = "UPDATE player SET mu = ? WHERE player_id = ?"
+            for mu, player_id in zip([20, 30, 10, 40], player_ids):
+                results.connection.execute(query, (mu, player_id))
+        # Existing AIs are reused before new ones are spawned.
+        assert evolution._initial_population() == ([player_ids[3],
+                                                    player_ids[1],
+                                                    player_ids[0],
+                                                    player_ids[2]], [])
+        survivors, bps = evolution._next_population(player_ids)
+        assert survivors == [player_ids[3], player_ids[1]]
+        assert len(bps) == 2
+        # Children are only added along with their generation.
+        num_players = len(results.get_player_data())
+        population = results.add_generation(2, survivors, bps)
+        assert len(population) == 4
+        assert population[:2] == survivors
+        assert not set(population[2:]) & set(player_ids)
+        assert len(results.get_player_data()) == num_players + 2
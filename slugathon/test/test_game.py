@@ -5,7 +5,7 @@ __license__ = "GNU GPL v2"
 import time
 import logging
 
-from slugathon.game import Game
+from slugathon.game import Game, Phase
 
 
 class TestGame(object):
@@ -38,6 +38,93 @@ class TestGame(object):
         assert len(game.all_legions(100)) == 1
         assert len(game.all_legions(300)) == 0
 
+    def test_legion_index(self):
+        game = self.game
+        player0 = game.players[0]
+        game.check_legion_index()
+        legion1 = player0.markerid_to_legion["Rd01"]
+        legion2 = player0.markerid_to_legion["Rd02"]
+        assert set(game.legions_in_hex(200)) == set([legion1, legion2])
+
+        legion1.move(6, False, None, 5)
+        game.check_legion_index()
+        assert game.legions_in_hex(200) == [legion2]
+        assert game.legions_in_hex(6) == [legion1]
+        assert player0.friendly_legions(6) == set([legion1])
+
+        legion1.undo_move()
+        game.check_legion_index()
+        assert game.legions_in_hex(6) == []
+
+        # Direct assignment, as the AI does for hypothetical moves.
+        legion2.hexlabel = 7
+        game.check_legion_index()
+        assert game.all_legions(7) == set([legion2])
+        legion2.hexlabel = 200
+
+        player0.undo_split("Rd01", "Rd02")
+        game.check_legion_index()
+        assert game.legions_in_hex(200) == [legion1]
+
+        player0.remove_legion("Rd01")
+        game.check_legion_index()
+        assert game.legions_in_hex(200) == []
+
+    def test_zobrist_hash(self):
+        game = self.game
+        player0 = game.players[0]
+        player1 = game.players[1]
+        game.check_zobrist_hash()
+        hash1 = game.zobrist_hash
+        legion1 = player0.markerid_to_legion["Rd01"]
+        legion2 = player0.markerid_to_legion["Rd02"]
+        legion3 = player1.markerid_to_legion["Bu01"]
+
+        legion1.move(6, False, None, 5)
+        game.check_zobrist_hash()
+        assert game.zobrist_hash != hash1
+        legion1.undo_move()
+        assert game.zobrist_hash == hash1
+
+        player0.undo_split("Rd01", "Rd02")
+        game.check_zobrist_hash()
+        hash2 = game.zobrist_hash
+        player0.split_legion("Rd01", "Rd02",
+                             ["Titan", "Centaur", "Centaur", "Gargoyle"],
+                             ["Angel", "Ogre", "Ogre", "Gargoyle"])
+        assert game.zobrist_hash == hash1
+        player0.undo_split("Rd01", "Rd02")
+        assert game.zobrist_hash == hash2
+
+        game.caretaker.take_one("Ogre")
+        game.check_zobrist_hash()
+        game.caretaker.put_one_back("Ogre")
+        assert game.zobrist_hash == hash2
+
+        legion1.move(101, False, None, 5)
+        legion3.move(101, False, None, 5)
+        game._init_battle(legion3, legion1)
+        game.check_zobrist_hash()
+        hash3 = game.zobrist_hash
+        titan = legion1.creatures[0]
+        titan.move("D4")
+        titan.hits = 2
+        game.battle_phase = Phase.PhaseBattle.STRIKE
+        game.check_zobrist_hash()
+        titan.hits = 0
+        titan.undo_move()
+        game.battle_phase = Phase.PhaseBattle.MANEUVER
+        assert game.zobrist_hash == hash3
+
+        legion1.forget_creatures()
+        game.check_zobrist_hash()
+        game._cleanup_battle()
+        game.check_zobrist_hash()
+        player0.remove_legion("Rd01")
+        game.check_zobrist_hash()
+        assert legion2.zobrist_features is None
+        assert legion3.zobrist_features is not None
+
     def test_find_normal_moves(self):
         game = self.game
         player = self.game.players[0]
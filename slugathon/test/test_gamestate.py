@@ -0,0 +1,141 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+import pickle
+import random
+import time
+
+from slugathon.game import Game, GameState, Phase
+
+
+def _make_game():
+    now = time.time()
+    game = Game.Game("g1", "p0", now, now, 2, 6)
+    game.add_player("p1")
+    player0 = game.players[0]
+    player1 = game.players[1]
+    player0.assign_starting_tower(200)
+    player1.assign_starting_tower(100)
+    game.sort_players()
+    game.started = True
+    game.assign_color("p1", "Blue")
+    game.assign_color("p0", "Red")
+    game.assign_first_marker("p0", "Rd01")
+    game.assign_first_marker("p1", "Bu01")
+    player0.pick_marker("Rd02")
+    player0.split_legion("Rd01", "Rd02",
+                         ["Titan", "Centaur", "Ogre", "Gargoyle"],
+                         ["Angel", "Centaur", "Ogre", "Gargoyle"])
+    player0.done_with_splits()
+    return game
+
+
+def test_snapshot():
+    game = _make_game()
+    player0 = game.players[0]
+    player0.score = 420
+    rd01 = player0.markerid_to_legion["Rd01"]
+    rd02 = player0.markerid_to_legion["Rd02"]
+    bu01 = game.players[1].markerid_to_legion["Bu01"]
+    rd02.hexlabel = 1
+    state = GameState.snapshot(game)
+    legion = state.legions["Rd01"]
+    assert legion.creature_names == ("Titan", "Centaur", "Ogre", "Gargoyle")
+    assert state.active_playername == "p0"
+    assert state.turn == game.turn
+    assert state.score(legion) == rd01.score
+    assert state.sort_value(legion) == rd01.sort_value
+    assert state.combat_value(legion) == rd01.combat_value
+    assert state.terrain_combat_value(legion) == rd01.terrain_combat_value
+    assert (state.available_recruits(state.legions["Rd02"], "Plains") ==
+            rd02.available_recruits("Plains", game.caretaker))
+    assert ([legion2.markerid for legion2 in state.legions_in_hex(100)] ==
+            ["Bu01"])
+    assert state.players["p0"].can_titan_teleport
+    for legion2 in (rd01, rd02, bu01):
+        for roll in range(1, 6 + 1):
+            masterhex = game.board.hexes[legion2.hexlabel]
+            assert (state.find_all_moves(state.legions[legion2.markerid],
+                                         legion2.hexlabel, roll) ==
+                    game.find_all_moves(legion2, masterhex, roll))
+
+
+def test_find_all_moves_random():
+    game = _make_game()
+    player1 = game.players[1]
+    player1.pick_marker("Bu02")
+    player1.split_legion("Bu01", "Bu02",
+                         ["Titan", "Centaur", "Ogre", "Gargoyle"],
+                         ["Angel", "Centaur", "Ogre", "Gargoyle"])
+    legions = []
+    for player in game.players:
+        legions.extend(player.legions)
+    hexlabels = sorted(game.board.hexes)
+    rng = random.Random(1)
+    for unused in range(50):
+        for legion in legions:
+            # Crowd the legions into a few hexes, and onto towers.
+            legion.hexlabel = rng.choice(hexlabels[:10] +
+                                         [100, 200, 300, 400, 500, 600])
+            legion.teleported = rng.random() < 0.2
+        for player in game.players:
+            player.score = rng.choice([0, 400])
+        state = GameState.snapshot(game)
+        for legion in legions:
+            masterhex = game.board.hexes[legion.hexlabel]
+            for roll in range(1, 6 + 1):
+                assert (state.find_all_moves(state.legions[legion.markerid],
+                                             legion.hexlabel, roll) ==
+                        game.find_all_moves(legion, masterhex, roll))
+
+
+def test_move_legion():
+    game = _make_game()
+    state = GameState.snapshot(game)
+    state2 = state.move_legion("Rd02", 100)
+    assert state.legions["Rd02"].hexlabel == 200
+    assert state2.legions["Rd02"].hexlabel == 100
+    assert state2.legions["Rd01"] is state.legions["Rd01"]
+    assert state2.players is state.players
+    assert ([legion.markerid for legion in state.legions_in_hex(200)] ==
+            ["Rd01", "Rd02"])
+    assert ([legion.markerid for legion in state2.legions_in_hex(200)] ==
+            ["Rd01"])
+    assert (sorted(legion.markerid for legion in
+                   state2.legions_in_hex(100)) == ["Bu01", "Rd02"])
+    assert state.move_legion("Rd02", 200) is state
+    assert game.players[0].markerid_to_legion["Rd02"].hexlabel == 200
+
+
+def test_snapshot_battle():
+    game = _make_game()
+    player0 = game.players[0]
+    player1 = game.players[1]
+    rd01 = player0.markerid_to_legion["Rd01"]
+    bu01 = player1.markerid_to_legion["Bu01"]
+    rd01.move(101, False, None, 5)
+    bu01.move(101, False, None, 5)
+    game._init_battle(bu01, rd01)
+    defender = game.defender_legion
+    for creature, hexlabel in zip(defender.creatures, ["D5", "E4", "C4"]):
+        creature.move(hexlabel)
+    defender.creatures[0].hits = 3
+    game.battle_phase = Phase.PhaseBattle.STRIKE
+    battle_state = GameState.snapshot_battle(game)
+    battle_state = pickle.loads(pickle.dumps(battle_state))
+    assert battle_state.attacker.markerid == "Bu01"
+    assert battle_state.defender.creatures[0] == ("Titan", "D5", 3, True,
+                                                  False)
+    battle_state2 = battle_state.move_creature("Rd01", 3, "D4")
+    assert battle_state.defender.creatures[3].hexlabel == "DEFENDER"
+    assert battle_state2.defender.creatures[3].hexlabel == "D4"
+    assert battle_state2.attacker is battle_state.attacker
+    game2 = GameState.restore_battle(battle_state2)
+    assert game2.battle_phase is Phase.PhaseBattle.STRIKE
+    assert game2.battle_active_legion.markerid == "Rd01"
+    legion = game2.defender_legion
+    assert ([creature.hexlabel for creature in legion.creatures] ==
+            ["D5", "E4", "C4", "D4"])
+    assert legion.creatures[0].hits == 3
+    game2.check_battle_creature_index()
@@ -265,6 +265,73 @@ def test_is_los_blocked():
     assert not map5.is_los_blocked("E2", "E2", None)
 
 
+class OccupiedHexes(object):
+    def __init__(self, hexlabels):
+        self.hexlabels = hexlabels
+
+    def is_battle_hex_occupied(self, hexlabel):
+        return hexlabel in self.hexlabels
+
+
+def test_is_los_blocked_by_creatures():
+    map6 = BattleMap.BattleMap("Plains", 1)
+    assert not map6.is_los_blocked("A1", "A3", None)
+    assert not map6.is_los_blocked("A1", "A3", OccupiedHexes(set(["B2"])))
+    assert map6.is_los_blocked("A1", "A3", OccupiedHexes(set(["A2"])))
+    # Mountains
+    assert not map1.is_los_blocked("D5", "F2", OccupiedHexes(set(["D4"])))
+    assert map1.is_los_blocked("D5", "F2", OccupiedHexes(set(["E3"])))
+    assert map1.is_los_blocked("D5", "B4", OccupiedHexes(set(["C4"])))
+
+
+def test_count_bramble_hexes():
+    assert map3.count_bramble_hexes("C4", "C4", None) == 0
+    for hexlabel1 in map3.hexes:
+        for hexlabel2 in map3.hexes:
+            if (hexlabel1 == hexlabel2 or map3.hexes[hexlabel1].entrance or
+                    map3.hexes[hexlabel2].entrance):
+                continue
+            count = map3.count_bramble_hexes(hexlabel1, hexlabel2, None)
+            if map3.is_los_blocked(hexlabel1, hexlabel2, None):
+                assert count == 0
+            else:
+                assert 0 <= count < map3.range(hexlabel1, hexlabel2)
+
+
+def test_tables_shared():
+    map6 = BattleMap.BattleMap("Mountains", 1)
+    assert map6.ranges is map1.ranges
+    assert map6.los_blocks is map1.los_blocks
+    assert map6.bramble_counts is map1.bramble_counts
+    assert map6.ranges is not map2.ranges
+
+
+def test_hex_ids():
+    assert len(BattleMap.id_to_hexlabel) == 29
+    for ii, hexlabel in enumerate(BattleMap.id_to_hexlabel):
+        assert BattleMap.hexlabel_to_id[hexlabel] == ii
+        assert BattleMap.hexlabel_to_bit[hexlabel] == 1 << ii
+    assert BattleMap.id_to_hexlabel[-2:] == ["ATTACKER", "DEFENDER"]
+    mask = BattleMap.hexlabel_to_bit["A1"] | BattleMap.hexlabel_to_bit["D6"]
+    assert BattleMap.mask_to_hexlabels(mask) == ["A1", "D6"]
+    assert BattleMap.mask_to_hexlabels(0) == []
+
+
+def test_neighbor_masks():
+    for hexlabel, hex1 in map1.hexes.items():
+        ii = BattleMap.hexlabel_to_id[hexlabel]
+        neighbors = set(hex2.label for hex2 in hex1.neighbors.values())
+        assert (set(BattleMap.mask_to_hexlabels(map1.neighbor_masks[ii])) ==
+                neighbors)
+    # Mountains has a cliff between B1 and C2.
+    ii = BattleMap.hexlabel_to_id["B1"]
+    assert BattleMap.mask_to_hexlabels(map1.cliff_masks[ii]) == ["C2"]
+    assert "C2" not in BattleMap.mask_to_hexlabels(
+        map1.engagement_masks[ii])
+    assert "B2" in BattleMap.mask_to_hexlabels(map1.engagement_masks[ii])
+    assert not any(map2.cliff_masks)
+
+
 def test_battlehex_repr():
     assert repr(hex1) == "BattleHex A2 (5, 2)"
 
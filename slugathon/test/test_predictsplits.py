@@ -2,9 +2,13 @@ __copyright__ = "Copyright (c) 2003-2012 David Ripton"
 __license__ = "GNU GPL v2"
 
 
+from collections import Counter
+import itertools
+
 from slugathon.data.creaturedata import starting_creature_names
+from slugathon.game.Creature import Creature
 from slugathon.ai.predictsplits import (PredictSplits, CreatureInfo, Node,
-                                        AllPredictSplits)
+                                        AllPredictSplits, sub_counts)
 
 
 def test_predict_splits1():
@@ -4902,3 +4906,80 @@ def test_predict_splits12():
                                            'Ranger', 'Ranger'])
     aps.get_leaf('Gr11').reveal_creatures(['Lion', 'Lion'])
     aps.print_leaves()
+
+
+def test_node_counts():
+    creatures = [CreatureInfo("Angel", True, True),
+                 CreatureInfo("Centaur", True, True),
+                 CreatureInfo("Centaur", False, True),
+                 CreatureInfo("Ogre", False, True),
+                 CreatureInfo("Lion", True, False)]
+    node = Node("Gd10", 1, creatures, None)
+    assert len(node) == 5
+    assert node.num_uncertain_creatures == 2
+    assert node.creature_names == ["Angel", "Centaur", "Centaur", "Lion",
+                                   "Ogre"]
+    node.reveal_creatures(["Centaur", "Centaur", "Gargoyle"])
+    assert node.certain == {"Angel": 1, "Centaur": 2, "Gargoyle": 1}
+    assert not node.uncertain
+    assert node.after_split == {"Lion": 1}
+    node.remove_creature("Centaur")
+    node.remove_creature("Lion")
+    assert node.removed == {"Centaur": 1}
+    assert str(node) == "Gd10(1): Angel Gargoyle Centaur Centaur-"
+
+
+def test_sub_counts():
+    counts = Counter(starting_creature_names)
+    for size in range(9):
+        splits = [tuple(sorted(pos.elements())) for pos in
+                  sub_counts(counts, size)]
+        combos = set(tuple(sorted(combo)) for combo in
+                     itertools.combinations(starting_creature_names, size))
+        assert len(splits) == len(set(splits))
+        assert set(splits) == combos
+    assert list(sub_counts(counts, 9)) == []
+
+
+def test_probabilistic():
+    ps = PredictSplits("Rd", "Rd01", starting_creature_names,
+                       probabilistic=True)
+    ps.get_leaf("Rd01").split(4, "Rd02", 1)
+    for markerid in ["Rd01", "Rd02"]:
+        distribution = ps.get_distribution(markerid)
+        assert abs(sum(prob for names, prob in distribution) - 1) < 1e-9
+        for names, prob in distribution:
+            assert len(names) == 4
+            assert names.count("Titan") + names.count("Angel") == 1
+    assert ps.get_distribution("Rd03") is None
+
+    ps.get_leaf("Rd01").reveal_creatures(["Titan"])
+    distribution = ps.get_distribution("Rd02")
+    for names, prob in distribution:
+        assert "Angel" in names
+    names, prob = distribution[0]
+    assert names == ("Angel", "Centaur", "Gargoyle", "Ogre")
+    assert abs(prob - 0.4) < 1e-9
+
+    ps.get_leaf("Rd02").reveal_creatures(["Angel", "Gargoyle", "Gargoyle",
+                                          "Ogre"])
+    ps.get_leaf("Rd01").remove_creature("Centaur")
+    ps.get_leaf("Rd01").add_creature("Lion")
+    distribution = ps.get_distribution("Rd01")
+    assert len(distribution) == 1
+    names, prob = distribution[0]
+    assert names == ("Centaur", "Lion", "Ogre", "Titan")
+    assert abs(ps.expected_combat_value("Rd01") - sum(
+        Creature(name).combat_value for name in names)) < 1e-9
+
+
+def test_get_relatives():
+    aps = AllPredictSplits()
+    aps.append(PredictSplits("Rd", "Rd01", starting_creature_names))
+    aps.append(PredictSplits("Bu", "Bu01", starting_creature_names))
+    aps.get_leaf("Rd01").split(4, "Rd02", 1)
+    aps.get_leaf("Rd01").split(2, "Rd03", 2)
+    assert sorted(leaf.markerid for leaf in aps.get_relatives("Rd03")) == [
+        "Rd01", "Rd02", "Rd03"]
+    assert [leaf.markerid for leaf in aps.get_relatives("Bu01")] == ["Bu01"]
+    assert aps.get_relatives("Gr01") == []
@@ -9,6 +9,7 @@ import sqlite3
 
 from slugathon.net import Results
 from slugathon.game import Game
+from slugathon.ai import BotParams
 
 
 def test_db_creation():
@@ -102,3 +103,40 @@ def test_save_game_and_get_ranking():
         assert 20 < pd2["mu"] < 21
         assert 7 < pd2["sigma"] < 8
         assert pd2["skill"] == 1
+
+
+def test_save_games_and_get_latest_generation():
+    with tempfile.NamedTemporaryFile(prefix="slugathon", suffix=".db",
+                                     delete=True) as tmp_file:
+        db_path = tmp_file.name
+        results = Results.Results(db_path=db_path)
+        assert results.get_latest_generation() == (0, [], True)
+        bp = BotParams.default_bot_params
+        player_id1 = results.add_ai(bp.mutate_all_fields())
+        player_id2, = results.add_generation(1, [],
+                                             [bp.mutate_all_fields()])
+        assert results.get_latest_generation() == (1, [player_id2], False)
+        player_ids = results.add_generation(2, [player_id1, player_id2], [])
+        assert player_ids == [player_id1, player_id2]
+        assert results.get_latest_generation() == (2, player_ids, False)
+        assert results.get_player_info(player_id1) != results.get_player_info(
+            player_id2)
+        now = time.time()
+        games = []
+        for num in range(2):
+            game = Game.Game("g%d" % num, "ai%d" % player_id1, now, now, 2, 6,
+                             player_class="CleverBot",
+                             player_info=results.get_player_info(player_id1))
+            game.add_player("ai%d" % player_id2, "CleverBot",
+                            results.get_player_info(player_id2))
+            game.finish_time = game.start_time + 5
+            game.finish_order = [(game.players[0], ), (game.players[1], )]
+            games.append(game)
+        results.save_games(games, 2)
+        assert results.get_latest_generation() == (2, player_ids, True)
+        rankings = results.get_rankings([player_id1, player_id2])
+        assert rankings[player_id1] == results.get_ranking("ai%d" %
+                                                           player_id1)
+        # Both games count, so this is past one win's 29 < mu < 30.
+        assert rankings[player_id1].mu > 30
+        assert rankings[player_id2].mu < 20
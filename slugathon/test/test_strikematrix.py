@@ -0,0 +1,144 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+import time
+
+from slugathon.ai import StrikeMatrix
+from slugathon.game import Game, Phase
+
+
+def test_kill_probability():
+    assert StrikeMatrix.kill_probability(3, 4, 0) == 1.0
+    assert StrikeMatrix.kill_probability(3, 4, 4) == 0.0
+    assert StrikeMatrix.kill_probability(1, 4, 1) == 0.5
+    assert StrikeMatrix.kill_probability(2, 4, 2) == 0.25
+    assert StrikeMatrix.kill_probability(2, 4, 1) == 0.75
+    assert StrikeMatrix.kill_probability(2, 6, 2) == 1. / 36
+    assert StrikeMatrix.kill_probability(2, 1, 2) == 1.0
+    assert StrikeMatrix.kill_probability(2, 0, 2) == 1.0
+    assert StrikeMatrix.kill_probability(2, 7, 1) == 0.0
+
+
+def test_hit_probabilities():
+    at_least = StrikeMatrix.hit_probabilities(3, 5)
+    assert len(at_least) == 5
+    assert at_least[0] == 1.0
+    assert abs(at_least[1] - (1 - (4. / 6) ** 3)) < 1e-12
+    assert abs(at_least[3] - (2. / 6) ** 3) < 1e-12
+    assert at_least[4] == 0.0
+    big = StrikeMatrix.MAX_DICE + 2
+    at_least = StrikeMatrix.hit_probabilities(big, 2)
+    assert len(at_least) == big + 2
+    assert abs(at_least[big] - (5. / 6) ** big) < 1e-12
+
+
+def test_combined_kill_probability():
+    assert StrikeMatrix.combined_kill_probability([(4, 4)], 0) == 1.0
+    assert (StrikeMatrix.combined_kill_probability([(4, 4)], 3) ==
+            StrikeMatrix.kill_probability(4, 4, 3))
+    # Two one-die strikes on 4s need both to hit.
+    assert StrikeMatrix.combined_kill_probability([(1, 4), (1, 4)], 2) == 0.25
+    assert StrikeMatrix.combined_kill_probability([(1, 4), (1, 4)], 3) == 0.0
+    # Two separate strikes equal one strike with all the dice at the same
+    # strike number.
+    assert abs(StrikeMatrix.combined_kill_probability([(3, 3), (2, 3)], 4) -
+               StrikeMatrix.kill_probability(5, 3, 4)) < 1e-12
+
+
+def _make_battle():
+    now = time.time()
+    game = Game.Game("g1", "p0", now, now, 2, 6)
+    game.add_player("p1")
+    player0 = game.players[0]
+    player1 = game.players[1]
+    player0.assign_starting_tower(200)
+    player1.assign_starting_tower(100)
+    game.sort_players()
+    game.started = True
+    game.assign_color("p1", "Blue")
+    game.assign_color("p0", "Red")
+    game.assign_first_marker("p0", "Rd01")
+    game.assign_first_marker("p1", "Bu01")
+    rd01 = player0.markerid_to_legion["Rd01"]
+    bu01 = player1.markerid_to_legion["Bu01"]
+    rd01.move(101, False, None, 5)
+    bu01.move(101, False, None, 5)
+    game._init_battle(bu01, rd01)
+    return game
+
+
+def _check_matrix(game):
+    defender = game.defender_legion
+    attacker = game.attacker_legion
+    matrix = StrikeMatrix.StrikeMatrix(defender.creatures, attacker.creatures)
+    for ii, creature in enumerate(defender.creatures):
+        for jj, enemy in enumerate(attacker.creatures):
+            engaged = enemy in creature.engaged_enemies
+            assert matrix.melee[ii][jj] == engaged
+            if engaged or enemy in creature.rangestrike_targets:
+                assert matrix.strikes[ii][jj]
+                assert matrix.dice[ii][jj] == creature.number_of_dice(enemy)
+                assert (matrix.strike_numbers[ii][jj] ==
+                        creature.strike_number(enemy))
+            else:
+                assert not matrix.strikes[ii][jj]
+                assert matrix.mean_hits[ii][jj] == 0
+            assert (matrix.enemy_dice[ii][jj] ==
+                    enemy.number_of_dice(creature))
+    return matrix
+
+
+def test_strike_matrix():
+    game = _make_battle()
+    defender = game.defender_legion
+    attacker = game.attacker_legion
+    titan1, angel1, ogre1 = defender.creatures[:3]
+    titan2, angel2, ogre2, centaur2 = attacker.creatures[:4]
+    titan1.move("C3")
+    ogre1.move("C4")
+    angel1.move("E4")
+    titan2.move("C2")
+    ogre2.move("D4")
+    centaur2.move("D2")
+    game.battle_phase = Phase.PhaseBattle.STRIKE
+
+    matrix = _check_matrix(game)
+    # titan1 is engaged with titan2 and ogre2; angel1 and ogre1 with ogre2.
+    assert matrix.targets(0) == [titan2, ogre2]
+    assert matrix.targets(1) == [ogre2]
+    assert matrix.targets(2) == [ogre2]
+    assert matrix.targets(3) == []
+    totals = matrix.total_mean_hits()
+    assert totals[:3] == [3, 0, 13]
+    assert matrix.max_mean_hits()[:3] == [5, 5, 3]
+    assert matrix.total_mean_damage_taken()[:3] == [4, 1, 3]
+    kill_probabilities = matrix.kill_probabilities
+    # Six dice hitting on 2s must all hit to kill an Ogre.
+    assert abs(kill_probabilities[0][2] - (5. / 6) ** 6) < 1e-9
+    assert kill_probabilities[0][1] == 0
+
+    titan1.struck = True
+    matrix = StrikeMatrix.StrikeMatrix(defender.creatures, attacker.creatures,
+                                       unstruck_only=True)
+    assert matrix.targets(0) == []
+    assert matrix.targets(2) == [ogre2]
+    # Carried wounds make ogre2 easier to kill for those yet to strike.
+    before = matrix.combined_kill_probabilities()
+    after = matrix.combined_kill_probabilities(2)
+    assert after[2] > before[2]
+    assert after[2] == StrikeMatrix.combined_kill_probability(
+        [(int(matrix.dice[ii][2]), int(matrix.strike_numbers[ii][2]))
+         for ii in range(len(matrix.creatures)) if matrix.strikes[ii][2]],
+        ogre2.hits_left - 2)
+    assert after[1] == before[1] == 0
+
+    numpy = StrikeMatrix.numpy
+    try:
+        StrikeMatrix.numpy = None
+        titan1.struck = False
+        matrix2 = _check_matrix(game)
+        assert matrix2.total_mean_hits() == totals
+        assert isinstance(matrix2.mean_hits, list)
+    finally:
+        StrikeMatrix.numpy = numpy
@@ -0,0 +1,46 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+from twisted.internet import task
+
+from slugathon.ai import Tournament
+
+
+class Target(object):
+    def __init__(self):
+        self.calls = []
+
+    def remote_add(self, li, num):
+        li.append(num)
+        self.calls.append(li)
+        return len(li)
+
+
+def test_local_reference():
+    clock = task.Clock()
+    target = Target()
+    ref = Tournament.LocalReference(target, "remote_", clock)
+    li = [1]
+    results = []
+    def1 = ref.callRemote("add", li, 2)
+    def1.addCallback(results.append)
+    assert not target.calls
+    clock.advance(0)
+    assert target.calls == [[1, 2]]
+    assert li == [1]
+    assert results == [2]
+
+
+def test_result_game():
+    players = [("ai1", "info1"), ("ai2", "info2"), ("ai3", "info3")]
+    result = ("g1", 1000, 2000, players, [("ai2",), ("ai1", "ai3")])
+    game = Tournament.result_game(result)
+    assert game.name == "g1"
+    assert game.finish_time == 2000
+    assert [player.name for player in game.players] == ["ai1", "ai2",
+                                                        "ai3"]
+    assert [player.player_info for player in game.players] == [
+        "info1", "info2", "info3"]
+    assert [[player.name for player in tup] for tup in game.finish_order] == [
+        ["ai2"], ["ai1", "ai3"]]
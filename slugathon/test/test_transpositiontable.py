@@ -0,0 +1,35 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+from slugathon.ai import TranspositionTable
+from slugathon.util import Zobrist
+
+
+def test_lru():
+    table = TranspositionTable.TranspositionTable(2)
+    assert table.get(1) is None
+    table.put(1, 1.5)
+    table.put(2, 0)
+    assert table.get(1) == 1.5
+    assert table.get(2) == 0
+    assert table.get(1) == 1.5
+    # 2 is now the least recently used.
+    table.put(3, -1.0)
+    assert len(table) == 2
+    assert table.get(2) is None
+    assert table.get(1) == 1.5
+    assert table.get(3) == -1.0
+    assert table.hits == 5
+    assert table.misses == 2
+
+
+def test_zobrist_keys():
+    key = Zobrist.key("battle_turn", 1)
+    assert key == Zobrist.key("battle_turn", 1)
+    assert key != Zobrist.key("battle_turn", 2)
+    assert 0 <= key < 2 ** 64
+    features = [("Ogre", "A1"), ("Ogre", "A1")]
+    keys = list(Zobrist.counted_keys(features))
+    assert keys[0] != keys[1]
+    assert keys[0] ^ keys[1] != 0
@@ -0,0 +1,58 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+from twisted.internet import defer, task
+
+from slugathon.net import User
+from slugathon.game import Action
+from slugathon.util.Observed import Observed
+
+
+class FakeServer(Observed):
+    def __init__(self, clock):
+        Observed.__init__(self)
+        self.clock = clock
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.calls = []
+
+    def callRemote(self, method_name, *args):
+        self.calls.append((method_name, args))
+        return defer.succeed(None)
+
+
+def test_update_batch():
+    clock = task.Clock()
+    server = FakeServer(clock)
+    client = FakeClient()
+    User.User("p1", server, client)
+    actions = [Action.AddUsername("p2"), Action.AddUsername("p3"),
+               Action.DelUsername("p2")]
+    for action in actions:
+        server.notify(action)
+    assert not client.calls
+    clock.advance(0)
+    assert len(client.calls) == 1
+    method_name, (updates, ) = client.calls[0]
+    assert method_name == "update_batch"
+    assert [action for (action, names) in updates] == actions
+
+    server.notify(actions[0])
+    clock.advance(0)
+    assert client.calls[1] == ("update", (actions[0], None))
+
+
+def test_apply_updates():
+    calls = []
+
+    def remote_update(action, names):
+        calls.append(action)
+        if action == "bad":
+            raise ValueError(action)
+
+    User.apply_updates(remote_update, [("a", None), ("bad", None),
+                                       ("b", None)])
+    assert calls == ["a", "bad", "b"]
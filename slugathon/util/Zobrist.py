@@ -0,0 +1,82 @@
+__copyright__ = "Copyright (c) 2026 agent"
+__license__ = "GNU GPL v2"
+
+
+"""Zobrist hashing: a position's hash is the XOR of a random 64-bit key
+for each of its features, so it can be updated a feature at a time."""
+
+
+import functools
+import hashlib
+
+
+# Number of feature keys to remember.  Keys can always be recomputed, so
+# this only bounds memory in a long-running process.
+KEY_CACHE_SIZE = 100000
+
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def _key(feature):
+    digest = hashlib.blake2b(repr(feature).encode("utf-8"),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def key(*feature):
+    """Return the 64-bit key for feature, a tuple of strings and numbers.
+
+    Keys come from a digest of the feature rather than from a random
+    number generator, so every process agrees on them, whatever order
+    features are first seen in.
+    """
+    return _key(feature)
+
+
+def counted_keys(features):
+    """Yield a key for each feature in features, an iterable of tuples.
+
+    XOR cancels out pairs of equal keys, so each repeat of a feature is
+    numbered to give it a key of its own.
+    """
+    counts = {}
+    for feature in features:
+        count = counts.get(feature, 0)
+        counts[feature] = count + 1
+        yield key(count, *feature)
+
+
+class CountedHash(object):
+
+    """A Zobrist hash of a multiset of features, kept in value.
+
+    value is the XOR of counted_keys for the features, updated one feature
+    at a time as they are added and removed.
+    """
+
+    def __init__(self, features=()):
+        self.value = 0
+        self._counts = {}
+        for feature in features:
+            self.add(feature)
+
+    def add(self, feature):
+        """Add feature, a tuple of strings and numbers."""
+        count = self._counts.get(feature, 0)
+        self._counts[feature] = count + 1
+        self.value ^= key(count, *feature)
+
+    def remove(self, feature):
+        """Remove feature, which must have been added."""
+        count = self._counts[feature] - 1
+        if count:
+            self._counts[feature] = count
+        else:
+            del self._counts[feature]
+        self.value ^= key(count, *feature)
+
+    def copy(self):
+        """Return a CountedHash of the same features."""
+        result = CountedHash()
+        result.value = self.value
+        result._counts = dict(self._counts)
+        return result